@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.utils import timezone
 
 from mptt.admin import MPTTModelAdmin
 from mptt.admin import TreeRelatedFieldListFilter
@@ -8,6 +9,10 @@ from API.models import Product
 from API.models import Address
 from API.models import Order
 from API.models import OrderProductListItem
+from API.models import StockReservation
+from API.models import StockMovement
+from API.models import OutboxEmail
+from API.response_cache import invalidate_product_responses
 
 import random
 
@@ -30,15 +35,23 @@ def randomise_categories(modeladmin, request, queryset):
         product.category_id = random.choice(categories)
 
     Product.objects.bulk_update(queryset, ['category'])
+    invalidate_product_responses(product.pk for product in queryset)
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'price', 'category', 'seller', 'stock')
-    list_filter = ('name', 'seller')
-    search_fields = ('name', 'category__name')
+    list_display = ('id', 'sku', 'name', 'price', 'category', 'seller', 'stock')
+    list_filter = ('name', 'seller', 'stock_ledger')
+    search_fields = ('name', 'sku', 'category__name')
     actions = [randomise_categories]
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        # stock of products with stock ledger isn't written by `Product.save`, it's changed by a restock movement
+        if change and obj.stock_ledger and 'stock' in form.changed_data:
+            StockMovement.objects.restock({obj.pk: obj.stock})
+
 
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
@@ -50,11 +63,13 @@ class AddressAdmin(admin.ModelAdmin):
 @admin.action(description='Randomise orders statuses')
 def randomise_statuses(modeladmin, request, queryset):
     statuses_count = len(Order.OrderStatus.choices)
+    updated_at = timezone.now()
 
     for order in queryset:
         order.status = random.randint(0, statuses_count)
+        order.updated_at = updated_at
 
-    Order.objects.bulk_update(queryset, ['status'])
+    Order.objects.bulk_update(queryset, ['status', 'updated_at'])
 
 
 @admin.action(description='Soft delete selected orders')
@@ -88,3 +103,26 @@ class OrderAdmin(admin.ModelAdmin):
 
     def delete_queryset(self, request, queryset):
         queryset.delete(force=True)
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'product', 'quantity', 'created_at', 'expires_at', 'released_at',)
+    list_filter = ('expires_at', 'released_at',)
+    search_fields = ('product__name',)
+    raw_id_fields = ('order', 'product',)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'order', 'kind', 'quantity', 'created_at', 'compacted',)
+    list_filter = ('kind', 'compacted',)
+    search_fields = ('product__name',)
+    raw_id_fields = ('order', 'product',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at',)
+    list_filter = ('status', 'subject',)
+    search_fields = ('recipient', 'dedupe_key',)
@@ -2,6 +2,8 @@ from django.conf import settings
 
 from rest_framework.permissions import BasePermission
 
+from API.roles import has_group
+
 
 class BaseAuthenticatedCustomUserGroupOnly(BasePermission):
     """
@@ -11,7 +13,7 @@ class BaseAuthenticatedCustomUserGroupOnly(BasePermission):
 
     def has_permission(self, request, view):
         return request.user.is_authenticated and \
-               (request.user.is_superuser or request.user.groups.filter(name=self.user_group_name).exists())
+               (request.user.is_superuser or has_group(request.user, self.user_group_name))
 
 
 class AuthenticatedClientsOnly(BaseAuthenticatedCustomUserGroupOnly):
@@ -7,13 +7,18 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         from django.conf import settings
+        import API.signals  # noqa: F401
         if settings.USE_ASYNC_TASK_COLLECTOR:
             from API.async_task_collector import NotifiesClientsWithUnpaidOrdersCollector
             from API.async_task_collector import ExpireUnpaidOrdersCollector
+            from API.async_task_collector import CompactStockLedgerCollector
+            from API.async_task_collector import DispatchOutboxEmailsCollector
 
             async_task_collectors = [
                 NotifiesClientsWithUnpaidOrdersCollector(),
-                ExpireUnpaidOrdersCollector()
+                ExpireUnpaidOrdersCollector(),
+                CompactStockLedgerCollector(),
+                DispatchOutboxEmailsCollector()
             ]
             # start collectors
             for task_collector in async_task_collectors:
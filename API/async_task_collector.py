@@ -1,8 +1,12 @@
 from django.conf import settings
-from django.core.mail import send_mass_mail
+from django.db import transaction
 from django.utils import timezone
 
 from API.models import Order
+from API.models import StockReservation
+from API.models import StockMovement
+from API.models import OutboxEmail
+from API.outbox import dispatch
 
 from datetime import timedelta
 import asyncio
@@ -75,19 +79,17 @@ class NotifiesClientsWithUnpaidOrdersCollector(BaseAsyncTaskCollector):
             payment_deadline__year=current_time_next_day.year,
             payment_deadline__month=current_time_next_day.month,
             payment_deadline__day=current_time_next_day.day
-        ).values_list('full_price', 'client__email')
+        ).values_list('pk', 'full_price', 'client__email')
 
-        from_email = settings.DEFAULT_EMAIL_ADDRESS
-
-        if unpaid_orders.exists():
-            send_mass_mail((
-                (
-                    'Unpaid order!',
-                    f'You have one day left to pay for your order worth {order[0]}',
-                    from_email,
-                    [order[1]]
-                ) for order in unpaid_orders
-            ), fail_silently=True)
+        # queued emails are sent in background by outbox dispatcher, each reminder only once
+        OutboxEmail.objects.enqueue((
+            (
+                'Unpaid order!',
+                f'You have one day left to pay for your order worth {full_price}',
+                email,
+                f'order-unpaid-reminder:{pk}'
+            ) for pk, full_price, email in unpaid_orders.iterator()
+        ))
 
 
 class ExpireUnpaidOrdersCollector(BaseAsyncTaskCollector):
@@ -98,20 +100,47 @@ class ExpireUnpaidOrdersCollector(BaseAsyncTaskCollector):
         """
         current_time = timezone.now()
 
-        expired_orders_emails = Order.objects.select_related('client').filter(
-            status__in=Order.UNPAID_STATUS,
-            payment_deadline__gte=current_time
-        )
-
-        from_email = settings.DEFAULT_EMAIL_ADDRESS
-
-        if expired_orders_emails.exists():
-            send_mass_mail((
+        with transaction.atomic():
+            # overdue orders are selected (and locked) once, so exactly the notified orders are expired
+            expired_orders = list(Order.objects.overdue(current_time).select_for_update(of=('self',)).values_list(
+                'pk', 'client__email'
+            ))
+            # queued emails are sent in background by outbox dispatcher once status change is committed
+            OutboxEmail.objects.enqueue((
                 (
                     'Order expired!',
                     f'Your order has expired because you have not paid in full for your order',
-                    from_email,
-                    [order]
-                ) for order in expired_orders_emails.values_list('client__email', flat=True)
-            ), fail_silently=True)
-            expired_orders_emails.update(status=Order.OrderStatus.EXPIRED)
+                    email,
+                    f'order-expired:{pk}'
+                ) for pk, email in expired_orders
+            ))
+            Order.objects.filter(pk__in=[pk for pk, _ in expired_orders]).update(
+                status=Order.OrderStatus.EXPIRED, updated_at=timezone.now()
+            )
+
+        # return products of expired orders to stock
+        StockReservation.objects.release_expired(current_time)
+
+
+class CompactStockLedgerCollector(BaseAsyncTaskCollector):
+    def __init__(self):
+        super().__init__()
+        self.refresh_rate = settings.STOCK_LEDGER_COMPACTION_INTERVAL
+
+    def sync_check_callback(self):
+        """
+        Fold stock movements of products with stock ledger enabled into their stock
+        """
+        StockMovement.objects.compact()
+
+
+class DispatchOutboxEmailsCollector(BaseAsyncTaskCollector):
+    def __init__(self):
+        super().__init__()
+        self.refresh_rate = settings.OUTBOX_DISPATCH_INTERVAL
+
+    def sync_check_callback(self):
+        """
+        Send pending outbox emails
+        """
+        dispatch()
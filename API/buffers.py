@@ -0,0 +1,151 @@
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from API.models import Product
+from API.models import ProductView
+from API.models import ProductVisitorsSketch
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Tuple
+import atexit
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProductViewsBuffer:
+    """
+    Process-local write-behind buffer for :model:`API.ProductView` records.
+
+    Views are deduplicated in memory by (product, ip) pair within `dedupe_window` seconds and written to db in batches
+    with a single `bulk_create` when the buffer reaches `max_size` entries or `flush_interval` seconds have passed since
+    the last flush. Unique constraint on (product, ip) keeps the table correct when multiple workers write the same view.
+    Buffer is always flushed by a background thread, so requests recording views never wait for the db.
+    """
+    def __init__(self, max_size: int = None, flush_interval: float = None, dedupe_window: float = None):
+        self.max_size = settings.PRODUCT_VIEWS_BUFFER_SIZE if max_size is None else max_size
+        self.flush_interval = settings.PRODUCT_VIEWS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.dedupe_window = settings.PRODUCT_VIEWS_DEDUPE_WINDOW if dedupe_window is None else dedupe_window
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # day of each buffered view, so views are added to sketches of the day they happened even if flushed later
+        self._pending: Dict[Tuple[int, str], date] = {}
+        self._seen: Dict[Tuple[int, str], float] = {}
+        self._last_flush = time.monotonic()
+        self._flusher = None
+        self._flush_requested = threading.Event()
+        self._stopped = threading.Event()
+
+        atexit.register(self.stop)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, product_id: int, ip: str) -> bool:
+        """
+        Add product view to the buffer
+        :param product_id: id of viewed product
+        :param ip: viewer ip address
+        :return: True if view was added, False if it was already seen within deduplication window
+        """
+        key = (product_id, ip)
+        now = time.monotonic()
+
+        with self._lock:
+            seen_at = self._seen.get(key, None)
+
+            if seen_at is not None and now - seen_at < self.dedupe_window:
+                return False
+
+            self._seen[key] = now
+            self._pending[key] = timezone.localdate()
+            should_flush = len(self._pending) >= self.max_size or now - self._last_flush >= self.flush_interval
+
+        if should_flush:
+            self._flush_requested.set()
+        self._start_flusher()
+
+        return True
+
+    def flush(self) -> int:
+        """
+        Write all buffered views to db, increment corresponding products `views_count` and add viewers to products unique
+        visitors sketches
+        :return: number of inserted views
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = now = time.monotonic()
+                # forget pairs outside deduplication window, so memory usage stays bounded
+                self._seen = {key: seen_at for key, seen_at in self._seen.items() if now - seen_at < self.dedupe_window}
+
+            if not pending:
+                return 0
+
+            try:
+                # returning visitors are not inserted as raw views again, but still count as unique visitors of the
+                # day of their view
+                visits_per_day = defaultdict(list)
+                for key, day in pending.items():
+                    visits_per_day[day].append(key)
+
+                for day, visits in sorted(visits_per_day.items()):
+                    ProductVisitorsSketch.objects.record(visits, day)
+
+                with transaction.atomic():
+                    # views counters are incremented only by views actually inserted by this flush
+                    inserted = ProductView.objects.insert_new(pending, batch_size=self.max_size or None)
+
+                    products_per_increment = defaultdict(list)
+                    for product_id, increment in inserted.items():
+                        products_per_increment[increment].append(product_id)
+
+                    for increment, products_ids in products_per_increment.items():
+                        Product.objects.filter(pk__in=products_ids).update(views_count=F('views_count') + increment)
+            except Exception:
+                # keep views for the next flush (sketches ignore visitors added again)
+                with self._lock:
+                    for key, day in pending.items():
+                        self._pending.setdefault(key, day)
+                raise
+
+            return sum(inserted.values())
+
+    def stop(self):
+        self._stopped.set()
+        self._flush_requested.set()
+        self.flush()
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            with self._lock:
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                    self._flusher.start()
+
+    def _run_flusher(self):
+        """
+        Flush buffered views when the buffer is full and periodically, so they are written even when traffic stops
+        """
+        while not self._stopped.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+
+            if self._pending and not self._stopped.is_set():
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Flushing product views buffer failed")
+                finally:
+                    close_old_connections()
+
+
+product_views_buffer = ProductViewsBuffer()
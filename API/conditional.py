@@ -0,0 +1,85 @@
+from django.utils.cache import get_conditional_response
+from django.utils.cache import quote_etag
+from django.utils.http import http_date
+
+from rest_framework.response import Response
+
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+import hashlib
+
+
+def make_etag(*parts) -> str:
+    """
+    :param parts: values identifying response version
+    :return: weak ETag (responses with the same data rendered by different renderers share it)
+    """
+    return 'W/' + quote_etag(hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest())
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin answering conditional GET requests (`If-None-Match`, `If-Modified-Since`) of `conditional_actions`
+    with `304 Not Modified` before the response is computed. Validators are returned by `get_conditional_validators`,
+    which should be much cheaper than the response itself (ex. single indexed lookup).
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_conditional_validators(self, request) -> Tuple[Optional[str], Optional[datetime]]:
+        """
+        :param request: api request
+        :return: ETag and last modification date of the requested resource (None if unknown)
+        """
+        return None, None
+
+    def conditional_response(self, request, get_response: Callable[[], Response], etag: Optional[str] = None,
+                             last_modified: Optional[datetime] = None):
+        """
+        :param request: api request
+        :param get_response: function computing response if resource was modified
+        :param etag: ETag of requested resource, taken from `get_conditional_validators` if neither validator is given
+        :param last_modified: last modification date of requested resource
+        :return: `304 Not Modified` response or computed response with validators headers
+        """
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return get_response()
+
+        if etag is None and last_modified is None:
+            etag, last_modified = self.get_conditional_validators(request)
+
+        # http dates have one second resolution
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified is not None else None
+        )
+
+        if not_modified is not None:
+            if not_modified.status_code == 304 and etag is not None:
+                not_modified['ETag'] = etag
+
+            return not_modified
+
+        response = get_response()
+
+        if response.status_code == 200:
+            if etag is not None and not response.has_header('ETag'):
+                response['ETag'] = etag
+            if last_modified is not None and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+
+        return response
+
+
+def hash_data(data) -> str:
+    """
+    :param data: serialized response data
+    :return: ETag of response data
+    """
+    return make_etag(_freeze(data))
+
+
+def _freeze(data):
+    if isinstance(data, dict):
+        return tuple((key, _freeze(value)) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return tuple(_freeze(value) for value in data)
+    return data
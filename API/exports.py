@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+
+from rest_framework import serializers
+from rest_framework.renderers import BaseRenderer
+
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, Sequence
+import csv
+import io
+import orjson
+import re
+
+
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@')
+CSV_NUMBER = re.compile(r'[+-]?\d+(\.\d+)?')
+
+
+def _encode_ndjson_value(value):
+    # decimals are exported as strings, the same as in JSON responses
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def _escape_csv_value(value):
+    # text cells which spreadsheets would evaluate as formulas are prefixed with a quote, numbers are kept
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES) and not CSV_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows: Iterable[Dict], fields: Sequence[str], buffer_size: int = 65536) -> Iterator[bytes]:
+    """
+    :param rows: exported rows
+    :param fields: exported columns
+    :param buffer_size: minimal size of yielded chunks (except the first and the last one)
+    :return: CSV chunks, header row is yielded right away, so the client gets the first byte before the first query ends,
+    cells starting with `=`, `+`, `-` or `@` (except numbers) are prefixed with `'` against formula injection
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in rows:
+        writer.writerow({name: _escape_csv_value(value) for name, value in row.items()})
+
+        if buffer.tell() >= buffer_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def iter_ndjson(rows: Iterable[Dict], buffer_size: int = 65536) -> Iterator[bytes]:
+    """
+    :param rows: exported rows
+    :param buffer_size: minimal size of yielded chunks (except the last one)
+    :return: newline delimited JSON chunks
+    """
+    chunk = []
+    size = 0
+
+    for row in rows:
+        line = orjson.dumps(row, default=_encode_ndjson_value, option=orjson.OPT_APPEND_NEWLINE)
+        chunk.append(line)
+        size += len(line)
+
+        if size >= buffer_size:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+
+    if chunk:
+        yield b''.join(chunk)
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renderer of `?format=csv` responses which are not streamed by :class:`StreamingExportMixin` (ex. errors)
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        rows = data if isinstance(data, list) else [data]
+        fields = list(rows[0]) if rows else []
+
+        return b''.join(iter_csv(rows, fields))
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer of `?format=ndjson` responses which are not streamed by :class:`StreamingExportMixin` (ex. errors)
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return b''.join(iter_ndjson(data if isinstance(data, list) else [data]))
+
+
+class StreamingExportMixin:
+    """
+    ViewSet mixin exporting whole filtered `list` querysets as CSV or NDJSON (`?format=csv|ndjson` or `Accept` header)
+    instead of paginated JSON. Rows are read with `.values()` in chunks (server-side cursor on PostgreSQL) and written to
+    the response while they are fetched, so memory use doesn't depend on the number of exported rows.
+
+    Exported columns are returned by `get_export_fields` as names of fields or annotations, (name, expression) pairs or
+    (name, source) pairs exporting field or annotation `source` as `name` (ex. annotation replacing a model field).
+    Decimal columns rendered by the serializer are formatted by its fields, like in JSON responses.
+    """
+    export_actions = ('list',)
+    export_renderer_classes = (CSVRenderer, NDJSONRenderer)
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+
+        if getattr(self, 'action', None) in self.export_actions:
+            renderers += [renderer() for renderer in self.export_renderer_classes]
+
+        return renderers
+
+    def get_export_fields(self) -> Sequence:
+        raise NotImplementedError('`get_export_fields()` must be implemented.')
+
+    def get_export_filename(self) -> str:
+        return self.basename if self.action == 'list' else self.action
+
+    def export_rows(self, queryset: QuerySet) -> Iterator[Dict]:
+        export_fields = self.get_export_fields()
+        names = [field if isinstance(field, str) else field[0] for field in export_fields]
+        fields, sources, expressions = [], {}, {}
+
+        for field in export_fields:
+            if isinstance(field, str):
+                fields.append(field)
+            elif isinstance(field[1], str):
+                sources[field[0]] = field[1]
+            else:
+                expressions[field[0]] = field[1]
+
+        serializer_fields = self.get_serializer().fields
+        converters = [
+            (name, serializer_fields[name].to_representation) for name in names
+            if isinstance(serializer_fields.get(name, None), serializers.DecimalField)
+        ]
+
+        rows = queryset.prefetch_related(None).values(*fields, *sources.values(), **expressions).iterator(
+            chunk_size=settings.EXPORT_CHUNK_SIZE
+        )
+
+        for row in rows:
+            if sources:
+                row = {name: row[sources.get(name, name)] for name in names}
+            for name, convert in converters:
+                if row[name] is not None:
+                    row[name] = convert(row[name])
+            yield row
+
+    def list(self, request, *args, **kwargs):
+        export_format = request.accepted_renderer.format
+
+        if export_format not in (renderer.format for renderer in self.export_renderer_classes):
+            return super().list(request, *args, **kwargs)
+
+        rows = self.export_rows(self.filter_queryset(self.get_queryset()))
+        names = [field if isinstance(field, str) else field[0] for field in self.get_export_fields()]
+
+        if export_format == CSVRenderer.format:
+            content = iter_csv(rows, names)
+        else:
+            content = iter_ndjson(rows)
+
+        response = StreamingHttpResponse(content, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.get_export_filename()}.{export_format}"'
+
+        return response
@@ -134,7 +134,7 @@ class ProductViewFactory(DjangoModelFactory):
         if count:
             ProductView.objects.bulk_create([
                 ProductView(product=self.product, ip=random_ip()) for _ in range(count)
-            ], batch_size=count)
+            ], batch_size=count, ignore_conflicts=True)
 
 
 class AddressFactory(DjangoModelFactory):
@@ -172,13 +172,17 @@ class OrderFactory(DjangoModelFactory):
     @factory.post_generation
     def random_product_list(self, create, extracted, **kwargs):
         count = random.randint(min(max(1, kwargs.get('count', 1)), 8), 16)
-        products = [ids for ids in Product.objects.all().values_list('id', flat=True)]
+        products = [product for product in Product.objects.all().values_list('id', 'price', 'seller_id')]
         products = random.sample(products, count)
+        quantities = [random.randint(1, 32) for _ in range(count)]
         OrderProductListItem.objects.bulk_create([
             OrderProductListItem(
                 order=self,
-                product_id=products[i],
-                quantity=random.randint(1, 32)
+                product_id=products[i][0],
+                quantity=quantities[i],
+                unit_price=products[i][1],
+                line_total=products[i][1] * quantities[i],
+                seller_id=products[i][2]
             ) for i in range(count)
         ], count)
         ordered_products = {
@@ -0,0 +1,166 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+
+
+class SparseFieldset(NamedTuple):
+    fields: Optional[FrozenSet[str]]
+    expand: Optional[FrozenSet[str]]
+
+
+def parse_fieldset_param(value: Optional[str]) -> Optional[FrozenSet[str]]:
+    """
+    :param value: comma separated names
+    :return: set of names or None if parameter is missing
+    """
+    if value is None:
+        return None
+
+    return frozenset(name.strip() for name in value.split(',') if name.strip())
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Model serializer rendering only fields requested with `fields` query parameter. Relations listed in
+    `Meta.expandable_fields` are nested only when listed in `expand` query parameter and rendered as primary keys
+    otherwise. Without both parameters all fields are rendered and all relations are nested.
+
+    `Meta.fields_sources` maps serializer fields which are not model fields (ex. properties) to model fields they use,
+    so `narrow_queryset` loads only columns and relations needed by requested fields.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    @classmethod
+    def parse_fieldset(cls, query_params) -> Optional[SparseFieldset]:
+        """
+        :param query_params: request query parameters
+        :return: requested fieldset or None if all fields should be rendered
+        """
+        fieldset = SparseFieldset(
+            parse_fieldset_param(query_params.get(cls.fields_query_param, None)),
+            parse_fieldset_param(query_params.get(cls.expand_query_param, None))
+        )
+
+        if fieldset.fields is None and fieldset.expand is None:
+            return None
+
+        errors = {}
+        unknown_fields = (fieldset.fields or frozenset()).difference(cls.Meta.fields)
+        unknown_expand = (fieldset.expand or frozenset()).difference(getattr(cls.Meta, 'expandable_fields', ()))
+
+        if unknown_fields:
+            errors[cls.fields_query_param] = f"Unknown fields: {', '.join(sorted(unknown_fields))}"
+        if unknown_expand:
+            errors[cls.expand_query_param] = f"Fields can't be expanded: {', '.join(sorted(unknown_expand))}"
+        if errors:
+            raise ValidationError(errors)
+
+        return fieldset
+
+    @classmethod
+    def resolve_fieldset(cls, fieldset: SparseFieldset) -> Tuple[List[str], FrozenSet[str]]:
+        """
+        :param fieldset: requested fieldset
+        :return: names of rendered fields and names of nested relations, relations listed in `expand` are always rendered
+        """
+        expandable = frozenset(getattr(cls.Meta, 'expandable_fields', ()))
+        expanded = expandable if fieldset.expand is None else expandable & fieldset.expand
+
+        if fieldset.fields is None:
+            return list(cls.Meta.fields), expanded
+
+        requested = fieldset.fields | (fieldset.expand or frozenset())
+
+        return [name for name in cls.Meta.fields if name in requested], expanded
+
+    @classmethod
+    def narrow_queryset(cls, queryset: QuerySet, fieldset: SparseFieldset) -> QuerySet:
+        """
+        :param queryset: serialized objects queryset
+        :param fieldset: requested fieldset
+        :return: queryset loading only columns and relations used by requested fields
+        """
+        requested, expanded = cls.resolve_fieldset(fieldset)
+        fields_sources = getattr(cls.Meta, 'fields_sources', {})
+        opts = queryset.model._meta
+        only, select_related, prefetch_related = {opts.pk.name}, [], []
+
+        for name in requested:
+            for source in fields_sources.get(name, (name,)):
+                try:
+                    field = opts.get_field(source)
+                except FieldDoesNotExist:
+                    continue
+
+                if field.many_to_one or (field.one_to_one and field.concrete):
+                    only.add(source)
+                    if name in expanded:
+                        select_related.append(source)
+                elif field.concrete:
+                    only.add(source)
+                elif field.one_to_many or field.many_to_many or field.one_to_one:
+                    prefetch_related.append(source)
+
+        return queryset.select_related(None).select_related(*select_related) \
+            .prefetch_related(None).prefetch_related(*prefetch_related).only(*only)
+
+    def is_root_resource(self) -> bool:
+        return self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('sparse_fieldset', None)
+
+        # fieldset applies only to the requested resource, not to the same serializer nested somewhere else
+        if fieldset is None or not self.is_root_resource():
+            return fields
+
+        requested, expanded = self.resolve_fieldset(fieldset)
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+
+        for name in list(fields):
+            if name not in requested:
+                del fields[name]
+            elif name in expandable and name not in expanded:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        return fields
+
+
+class SparseFieldsetViewMixin:
+    """
+    ViewSet mixin passing requested fieldset to serializers of `sparse_fieldset_actions` (using
+    :class:`SparseFieldsetSerializerMixin`) and narrowing filtered queryset to it
+    """
+    sparse_fieldset_actions = ('list', 'retrieve')
+
+    def get_sparse_fieldset(self) -> Optional[SparseFieldset]:
+        if self.action not in self.sparse_fieldset_actions:
+            return None
+
+        serializer_class = self.get_serializer_class()
+
+        if not issubclass(serializer_class, SparseFieldsetSerializerMixin):
+            return None
+
+        return serializer_class.parse_fieldset(self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['sparse_fieldset'] = self.get_sparse_fieldset()
+
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fieldset = self.get_sparse_fieldset()
+
+        if fieldset is not None:
+            queryset = self.get_serializer_class().narrow_queryset(queryset, fieldset)
+
+        return queryset
@@ -7,14 +7,20 @@ from django_filters import rest_framework as filters
 
 from API.models import ProductCategory
 from API.models import Product
+from API.search import search_products
 
 
 class ProductFilter(filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='icontains')
     category = django_filters.ModelMultipleChoiceFilter(queryset=ProductCategory.objects.all())
+    category_tree = django_filters.ModelChoiceFilter(queryset=ProductCategory.objects.all(),
+                                                     method='filter_category_tree',
+                                                     label='Product category (including all its subcategories)')
     description = django_filters.CharFilter(lookup_expr='icontains')
     price = django_filters.NumberFilter()
     price_range = django_filters.RangeFilter(field_name='price')
+    # declared before `order`, so explicit ordering overrides relevance ordering
+    search = django_filters.CharFilter(method='filter_search', label='Full-text search (ordered by relevance)')
     order = django_filters.OrderingFilter(
         fields=(
             ('name', 'name'),
@@ -28,7 +34,16 @@ class ProductFilter(filters.FilterSet):
 
     class Meta:
         model = Product
-        fields = ['name', 'category', 'description', 'price', 'price_range', 'seller']
+        fields = ['name', 'category', 'category_tree', 'description', 'price', 'price_range', 'seller', 'search']
+
+    def filter_category_tree(self, queryset, name, value):
+        # category interval is resolved once, so the whole subtree is a single indexed range join
+        return queryset.filter(
+            category__tree_id=value.tree_id, category__lft__gte=value.lft, category__rght__lte=value.rght
+        )
+
+    def filter_search(self, queryset, name, value):
+        return search_products(queryset, value)
 
 
 class ProductStatisticsFilter(filters.FilterSet):
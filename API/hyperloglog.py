@@ -0,0 +1,87 @@
+import hashlib
+import math
+from typing import Iterable
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality estimator with `2 ** precision` one byte registers.
+
+    Memory usage is fixed (1KB for default precision) no matter how many values are added and the standard error of the
+    estimation is about `1.04 / sqrt(2 ** precision)` (~3.25% for default precision). Sketches with the same precision
+    can be merged, so estimation for a range of buckets is made by merging sketches of each bucket.
+    """
+    DEFAULT_PRECISION = 10
+    HASH_BITS = 64
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: bytes = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16!")
+
+        self.precision = precision
+        self.size = 1 << precision
+
+        if registers:
+            if len(registers) != self.size:
+                raise ValueError(f"HyperLogLog registers must have {self.size} bytes for precision {precision}!")
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.size)
+
+    @classmethod
+    def from_bytes(cls, registers: bytes) -> 'HyperLogLog':
+        """
+        :param registers: registers of serialized sketch, precision is derived from their length
+        :return: deserialized sketch
+        """
+        return cls(precision=len(registers).bit_length() - 1, registers=registers)
+
+    def __bytes__(self):
+        return bytes(self.registers)
+
+    def add(self, value: str) -> None:
+        """
+        :param value: counted value, ex. visitor ip address
+        """
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=self.HASH_BITS // 8).digest(), 'big')
+        index = x >> (self.HASH_BITS - self.precision)
+        rest_bits = self.HASH_BITS - self.precision
+        rank = rest_bits - (x & ((1 << rest_bits) - 1)).bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """
+        Merge other sketch into this one, so it estimates the cardinality of both sketches values union
+        :param other: sketch with the same precision
+        :return: self
+        """
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLog sketches with different precisions!")
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+        return self
+
+    def count(self) -> int:
+        """
+        :return: estimated number of distinct added values
+        """
+        if self.size >= 128:
+            alpha = 0.7213 / (1 + 1.079 / self.size)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+
+        # small range correction, 64-bit hash does not need the large range one
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+
+        return int(round(estimate))
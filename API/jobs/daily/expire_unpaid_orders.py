@@ -1,6 +1,5 @@
+from django.db import transaction
 from django.utils import timezone
-from django.conf import settings
-from django.core.mail import send_mass_mail
 
 from django_extensions.management.jobs import DailyJob
 
@@ -11,21 +10,30 @@ class ExpireUnpaidOrders(DailyJob):
 
     def execute(self):
         from API.models import Order
+        from API.models import StockReservation
+        from API.models import OutboxEmail
 
         current_time = timezone.now()
-        expired_orders_emails = Order.objects.select_related('client').filter(
-            status__in=Order.UNPAID_STATUS,
-            payment_deadline__gte=current_time
-        )
-        from_email = settings.DEFAULT_EMAIL_ADDRESS
-
-        if expired_orders_emails.exists():
-            send_mass_mail((
+        with transaction.atomic():
+            # overdue orders are selected (and locked) once, so exactly the notified orders are expired
+            expired_orders = list(Order.objects.overdue(current_time).select_for_update(of=('self',)).values_list(
+                'pk', 'client__email'
+            ))
+            # queued emails are sent in background by outbox dispatcher once status change is committed
+            OutboxEmail.objects.enqueue((
                 (
                     'Order expired!',
                     f'Your order has expired because you have not paid in full for your order',
-                    from_email,
-                    [order]
-                ) for order in expired_orders_emails.values_list('client__email', flat=True)
-            ), fail_silently=True)
-            expired_orders_emails.update(status=Order.OrderStatus.EXPIRED)
+                    email,
+                    f'order-expired:{pk}'
+                ) for pk, email in expired_orders
+            ))
+            Order.objects.filter(pk__in=[pk for pk, _ in expired_orders]).update(
+                status=Order.OrderStatus.EXPIRED, updated_at=timezone.now()
+            )
+
+        # return products of expired orders to stock
+        StockReservation.objects.release_expired(current_time)
+
+
+Job = ExpireUnpaidOrders
@@ -1,6 +1,4 @@
 from django.utils import timezone
-from django.conf import settings
-from django.core.mail import send_mass_mail
 
 from django_extensions.management.jobs import DailyJob
 
@@ -12,6 +10,7 @@ class NotifiesClientsWithUnpaidOrders(DailyJob):
 
     def execute(self):
         from API.models import Order
+        from API.models import OutboxEmail
 
         current_time_next_day = timezone.now() + timedelta(days=1)
         unpaid_orders = Order.objects.select_related('client').filter(
@@ -19,15 +18,17 @@ class NotifiesClientsWithUnpaidOrders(DailyJob):
             payment_deadline__year=current_time_next_day.year,
             payment_deadline__month=current_time_next_day.month,
             payment_deadline__day=current_time_next_day.day
-        ).values_list('full_price', 'client__email')
-        from_email = settings.DEFAULT_EMAIL_ADDRESS
-
-        if unpaid_orders.exists():
-            send_mass_mail((
-                (
-                    'Unpaid order!',
-                    f'You have one day left to pay for your order worth {order[0]}',
-                    from_email,
-                    [order[1]]
-                ) for order in unpaid_orders
-            ), fail_silently=True)
+        ).values_list('pk', 'full_price', 'client__email')
+
+        # queued emails are sent in background by outbox dispatcher, each reminder only once
+        OutboxEmail.objects.enqueue((
+            (
+                'Unpaid order!',
+                f'You have one day left to pay for your order worth {full_price}',
+                email,
+                f'order-unpaid-reminder:{pk}'
+            ) for pk, full_price, email in unpaid_orders.iterator()
+        ))
+
+
+Job = NotifiesClientsWithUnpaidOrders
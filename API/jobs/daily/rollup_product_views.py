@@ -0,0 +1,21 @@
+from django.conf import settings
+
+from django_extensions.management.jobs import DailyJob
+
+
+class RollupProductViews(DailyJob):
+    help = "Aggregate raw product views from previous days into daily statistics and delete raw views and daily " \
+           "unique visitors sketches older than retention window."
+
+    def execute(self):
+        from API.models import ProductViewDaily
+        from API.models import ProductVisitorsSketch
+
+        ProductViewDaily.objects.rollup(chunk_size=settings.PRODUCT_VIEWS_ROLLUP_CHUNK_SIZE)
+        ProductViewDaily.objects.compact(
+            settings.PRODUCT_VIEWS_RETENTION_DAYS, chunk_size=settings.PRODUCT_VIEWS_ROLLUP_CHUNK_SIZE
+        )
+        ProductVisitorsSketch.objects.compact(settings.PRODUCT_VISITORS_DAILY_SKETCH_RETENTION_DAYS)
+
+
+Job = RollupProductViews
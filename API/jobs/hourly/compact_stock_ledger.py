@@ -0,0 +1,14 @@
+from django_extensions.management.jobs import HourlyJob
+
+
+class CompactStockLedger(HourlyJob):
+    help = "Fold stock movements of products with stock ledger enabled into their stock (run it more often with " \
+           "async task collector, see `STOCK_LEDGER_COMPACTION_INTERVAL`)."
+
+    def execute(self):
+        from API.models import StockMovement
+
+        StockMovement.objects.compact()
+
+
+Job = CompactStockLedger
@@ -0,0 +1,14 @@
+from django_extensions.management.jobs import MinutelyJob
+
+
+class DispatchOutboxEmails(MinutelyJob):
+    help = "Send emails queued in the outbox (run it more often with async task collector, see " \
+           "`OUTBOX_DISPATCH_INTERVAL`, or with `dispatch_emails --loop` worker)."
+
+    def execute(self):
+        from API.outbox import dispatch
+
+        dispatch()
+
+
+Job = DispatchOutboxEmails
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+
+from API.models import Order
+from API.models import OrderProductListItem
+from API.models import Product
+
+
+class Command(BaseCommand):
+    help = "Fill unit price and line total of order lines created before prices were saved at checkout with current " \
+           "products prices (required by sales and profits statistics), and missing orders full prices"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=5000, help="Number of order lines updated at once")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+        last_pk, updated = 0, 0
+
+        while True:
+            pks = list(OrderProductListItem.objects.filter(unit_price__isnull=True, pk__gt=last_pk).order_by(
+                'pk'
+            ).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+
+            last_pk = pks[-1]
+            with transaction.atomic():
+                updated += OrderProductListItem.objects.filter(pk__in=pks).update(
+                    unit_price=price, line_total=price * F('quantity')
+                )
+            self.stdout.write(f'Updated order lines up to id {last_pk}: {updated} lines')
+
+        orders = 0
+        for order in Order.objects.get_queryset(with_deleted=True).filter(full_price__isnull=True).iterator():
+            order.save(update_fields=['full_price', 'updated_at'], update_full_price=True)
+            orders += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {updated} order lines and {orders} orders updated'))
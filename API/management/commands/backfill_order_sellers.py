@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from API.models import OrderProductListItem
+from API.models import Product
+
+
+class Command(BaseCommand):
+    help = "Fill seller of order lines created before sellers were saved at checkout (required by seller orders list " \
+           "and sales statistics) with current products sellers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=5000, help="Number of order lines updated at once")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        seller = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('seller_id')[:1])
+        last_pk, updated = 0, 0
+
+        while True:
+            pks = list(OrderProductListItem.objects.filter(seller__isnull=True, pk__gt=last_pk).order_by(
+                'pk'
+            ).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+
+            last_pk = pks[-1]
+            with transaction.atomic():
+                updated += OrderProductListItem.objects.filter(pk__in=pks).update(seller_id=seller)
+            self.stdout.write(f'Updated order lines up to id {last_pk}: {updated} lines')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {updated} order lines updated'))
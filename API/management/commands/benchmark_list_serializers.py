@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from API.models import Product
+from API.models import ProductRating
+from API.models import Address
+from API.models import Order
+from API.serializers import ProductSerializer
+from API.serializers import ProductRatingSerializer
+from API.serializers import AddressSerializer
+from API.serializers import OrderSerializer
+from API.read_serializers import compile_serializer
+
+import timeit
+
+
+class Command(BaseCommand):
+    help = "Compare per row cost of list endpoints serializers with their compiled read-only versions (see " \
+           "`API.read_serializers`) on current database and check both render the same JSON"
+
+    endpoints = {
+        'products': (ProductSerializer, lambda: Product.objects.with_available_stock().select_related(
+            'category', 'seller'
+        ).order_by('-pk')),
+        'orders': (OrderSerializer, lambda: Order.objects.select_related('client', 'order_address').prefetch_related(
+            Order.products_list_prefetch()
+        ).order_by('-pk')),
+        'ratings': (ProductRatingSerializer,
+                    lambda: ProductRating.objects.select_related('reviewer').order_by('-created_at')),
+        'addresses': (AddressSerializer, lambda: Address.objects.order_by('pk')),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('-e', '--endpoint', action='append', choices=list(self.endpoints),
+                            help="Benchmarked list endpoint, can be repeated (all by default)")
+        parser.add_argument('-l', '--limit', type=int, default=100, help="Number of serialized rows (page size)")
+        parser.add_argument('-r', '--repeat', type=int, default=5, help="Number of repeats of each serialization")
+        parser.add_argument('--host', default='localhost', help="Host of urls built by serializers")
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/', HTTP_HOST=options['host']))
+        renderer = JSONRenderer()
+        limit = max(1, options['limit'])
+
+        for endpoint in options['endpoint'] or self.endpoints:
+            serializer_class, get_queryset = self.endpoints[endpoint]
+            queryset = get_queryset()
+            compiled = compile_serializer(serializer_class(context={'request': request}), queryset)
+
+            if compiled is None:
+                self.stdout.write(self.style.ERROR(f'{endpoint}: serializer can\'t be compiled'))
+                continue
+
+            # both paths fetch a page and serialize it, like list endpoint does
+            def serialize():
+                return serializer_class(list(queryset[:limit]), many=True, context={'request': request}).data
+
+            def serialize_compiled():
+                return compiled.serialize(compiled.values(queryset)[:limit])
+
+            with CaptureQueriesContext(connection) as serializer_queries:
+                data = serialize()
+            with CaptureQueriesContext(connection) as compiled_queries:
+                compiled_data = serialize_compiled()
+
+            rows = len(data)
+            if not rows:
+                self.stdout.write(self.style.WARNING(
+                    f'{endpoint}: nothing to serialize! Fill db with `fake_db_fill` command first.'
+                ))
+                continue
+
+            if renderer.render(data) != renderer.render(compiled_data):
+                self.stdout.write(self.style.ERROR(f'{endpoint}: compiled serializer output differs!'))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f'{endpoint}: {rows} rows, identical output'))
+
+            for label, function, queries in (('serializer', serialize, serializer_queries),
+                                              ('compiled', serialize_compiled, compiled_queries)):
+                best = min(timeit.repeat(function, number=1, repeat=options['repeat']))
+                self.stdout.write(self.style.SUCCESS(
+                    f'{label:>12}: {best * 1000:.2f} ms total, {best * 1_000_000 / rows:.1f} µs per row, '
+                    f'{len(queries)} queries'
+                ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from API.models import Product
+from API.search import search_products
+from API.search import search_terms
+
+import random
+import timeit
+
+
+class Command(BaseCommand):
+    help = "Compare products full-text search with `icontains` filtering on current database (fill it first with " \
+           "`fake_db_fill` command)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-q', '--queries', type=int, default=50, help="Number of random search queries")
+        parser.add_argument('-r', '--repeat', type=int, default=5, help="Number of repeats of each query")
+        parser.add_argument('-l', '--limit', type=int, default=10, help="Number of fetched products (page size)")
+
+    def handle(self, *args, **options):
+        names = list(Product.objects.order_by('?').values_list('name', flat=True)[:options['queries']])
+        words = [word for name in names for word in search_terms(name) if len(word) > 2]
+
+        if not words:
+            self.stdout.write(self.style.ERROR('No products to search! Fill db with `fake_db_fill` command first.'))
+            return
+
+        queries = [random.choice(words) for _ in range(options['queries'])]
+        limit = options['limit']
+        products = Product.objects.order_by('-pk')
+
+        # paginated list endpoint counts all matching products and fetches a single page
+        def icontains_search():
+            for query in queries:
+                q = products.filter(Q(name__icontains=query) | Q(description__icontains=query))
+                q.count()
+                list(q[:limit])
+
+        def full_text_search():
+            for query in queries:
+                q = search_products(products, query)
+                q.count()
+                list(q[:limit])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Searching {Product.objects.count()} products with {len(queries)} queries repeated '
+            f'{options["repeat"]} times...'
+        ))
+
+        for label, function in (('icontains', icontains_search), ('full-text', full_text_search)):
+            best = min(timeit.repeat(function, number=1, repeat=options['repeat']))
+            self.stdout.write(self.style.SUCCESS(
+                f'{label:>10}: {best * 1000:.2f} ms total, {best * 1000 / len(queries):.3f} ms per query'
+            ))
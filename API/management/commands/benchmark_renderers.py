@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from API.models import Order
+from API.models import Product
+from API.serializers import OrderSerializer
+from API.serializers import ProductTopLeastProfitableSerializer
+from API.renderers import MessagePackRenderer
+from API.renderers import ORJSONParser
+from API.renderers import ORJSONRenderer
+
+from io import BytesIO
+import timeit
+
+
+class Command(BaseCommand):
+    help = "Compare api renderers and parsers on large orders and statistics pages built from current database (fill " \
+           "it first with `fake_db_fill` command)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-l', '--limit', type=int, default=1000, help="Number of rendered orders and products")
+        parser.add_argument('-r', '--repeat', type=int, default=5, help="Number of repeats of each rendering")
+        parser.add_argument('--host', default='localhost', help="Host of urls built by serializers")
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/', HTTP_HOST=options['host']))
+        context = {'request': request}
+        limit = max(1, options['limit'])
+        superuser = get_user_model()(is_superuser=True)
+
+        pages = {
+            'orders': OrderSerializer(
+                Order.objects.select_related('client', 'order_address').order_by('-pk')[:limit], many=True,
+                context=context
+            ).data,
+            'statistics': ProductTopLeastProfitableSerializer(
+                Product.objects.most_profitable(superuser)[:limit], many=True, context=context
+            ).data,
+        }
+
+        for name, data in pages.items():
+            if not data:
+                self.stdout.write(self.style.WARNING(f'{name}: nothing to render! Fill db with `fake_db_fill` command '
+                                                     f'first.'))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f'{name}: {len(data)} rows'))
+            json = JSONRenderer().render(data)
+
+            if ORJSONRenderer().render(data) != json:
+                self.stdout.write(self.style.ERROR(f'{"orjson":>12}: output differs from json renderer!'))
+
+            for label, renderer in (('json', JSONRenderer()), ('orjson', ORJSONRenderer()),
+                                    ('msgpack', MessagePackRenderer())):
+                size = len(renderer.render(data))
+                best = min(timeit.repeat(lambda: renderer.render(data), number=1, repeat=options['repeat']))
+                self.stdout.write(self.style.SUCCESS(
+                    f'{label:>12}: render {best * 1000:.2f} ms, {size / 1024:.1f} KiB'
+                ))
+
+            for label, parser in (('json', JSONParser()), ('orjson', ORJSONParser())):
+                best = min(timeit.repeat(lambda: parser.parse(BytesIO(json), parser_context={'encoding': 'utf-8'}),
+                                         number=1, repeat=options['repeat']))
+                self.stdout.write(self.style.SUCCESS(f'{label:>12}: parse {best * 1000:.2f} ms'))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from API.models import Address
+from API.models import Order
+
+from collections import defaultdict
+
+
+class Command(BaseCommand):
+    help = "Fill fingerprints of addresses created before they were added and merge duplicated addresses (orders of " \
+           "duplicates are moved to the oldest address with the same fingerprint). Addresses are processed in batches, " \
+           "each one in its own transaction, so the command can be interrupted and run again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=1000, help="Number of addresses in a batch")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        last_pk, filled, merged = 0, 0, 0
+
+        while True:
+            batch = list(Address.objects.filter(fingerprint__isnull=True, pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+
+            last_pk = batch[-1].pk
+            batch_filled, batch_merged = self.process_batch(batch)
+            filled += batch_filled
+            merged += batch_merged
+
+            self.stdout.write(f'Processed addresses up to id {last_pk}: {filled} fingerprints filled, {merged} '
+                              f'duplicates merged')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {filled} fingerprints filled, {merged} duplicates merged'))
+
+    @staticmethod
+    def process_batch(batch) -> tuple:
+        """
+        :param batch: addresses without fingerprints, ordered by id
+        :return: number of addresses with filled fingerprint and number of merged duplicates
+        """
+        for address in batch:
+            address.update_fingerprint()
+
+        with transaction.atomic():
+            # addresses which already have fingerprint (ex. created by new orders) are kept
+            keepers = dict(Address.objects.select_for_update().filter(
+                fingerprint__in={address.fingerprint for address in batch}
+            ).values_list('fingerprint', 'pk'))
+            duplicates = defaultdict(list)
+            filled = []
+
+            for address in batch:
+                if address.fingerprint in keepers:
+                    duplicates[keepers[address.fingerprint]].append(address.pk)
+                else:
+                    keepers[address.fingerprint] = address.pk
+                    filled.append(address)
+
+            for keeper_pk, duplicates_pks in duplicates.items():
+                Order.objects.get_queryset(with_deleted=True).filter(order_address_id__in=duplicates_pks).update(
+                    order_address_id=keeper_pk, updated_at=timezone.now()
+                )
+
+            Address.objects.filter(pk__in=[pk for pks in duplicates.values() for pk in pks]).delete()
+            Address.objects.bulk_update(filled, ['fingerprint', 'state'])
+            # voivodeship of addresses outside Poland is cleared, it's a part of orders representation
+            Order.objects.get_queryset(with_deleted=True).filter(order_address__in=filled).update(
+                updated_at=timezone.now()
+            )
+
+        return len(filled), sum(len(pks) for pks in duplicates.values())
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from API.outbox import dispatch
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Send pending outbox emails in batches over a single mail connection, optionally as a long running worker " \
+           "(many workers can run at once, each email is sent by one of them)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=None,
+                            help="Number of emails claimed at once (OUTBOX_BATCH_SIZE by default)")
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help="Keep sending new emails every OUTBOX_DISPATCH_INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = dispatch(options['batch_size'])
+
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'{sent} emails sent, {failed} failed (will be retried)'))
+
+            if not options['loop']:
+                break
+
+            time.sleep(settings.OUTBOX_DISPATCH_INTERVAL)
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 
 
 from API import factories
+from API.models import Product
 
 
 class Command(BaseCommand):
@@ -75,6 +76,8 @@ class Command(BaseCommand):
         if options['views']:
             self.stdout.write(self.style.SUCCESS(f'Generating {batch_size} test product views...'))
             factories.ProductViewFactory.create_batch(batch_size)
+            # extra views are bulk created without signals, so counters have to be recalculated
+            Product.objects.rebuild_counters()
             self.stdout.write(self.style.SUCCESS(f'Successfully created {batch_size} test product views.'))
             created_anything = True
 
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from API.models import Product
+from API.thumbnails import generate_thumbnail
+from API.thumbnails import ThumbnailWorkerPool
+
+from concurrent.futures import wait
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and photo hashes of products which don't have ready ones (ex. interrupted by worker " \
+           "restart), missing photos of imported products are downloaded first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--all', action='store_true', help="Regenerate thumbnails of all products")
+        parser.add_argument('-w', '--workers', type=int, default=None,
+                            help="Number of worker threads (defaults to THUMBNAIL_WORKERS setting)")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+
+        if not options['all']:
+            products = products.filter(~Q(thumbnail_status=Product.ThumbnailStatus.READY) | Q(photo_hash='')).exclude(
+                thumbnail_status=Product.ThumbnailStatus.NO_PHOTO
+            )
+
+        products_ids = list(products.values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(f'Generating thumbnails of {len(products_ids)} products...'))
+
+        pool = ThumbnailWorkerPool(workers=options['workers'])
+
+        if pool.workers < 1:
+            created = sum(generate_thumbnail(product_id) for product_id in products_ids)
+        else:
+            futures = [pool.submit(product_id) for product_id in products_ids]
+            wait(futures)
+            created = sum(future.result() for future in futures)
+            pool.executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully generated {created} thumbnails.'))
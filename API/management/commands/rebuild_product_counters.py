@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from API.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recalculate products denormalized ratings and views counters from ratings and views tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                            help="Number of products updated in a single query")
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding products ratings and views counters...'))
+        updated = Product.objects.rebuild_counters(batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt counters of {updated} products.'))
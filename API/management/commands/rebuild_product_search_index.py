@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from API.search import install_product_search
+
+
+class Command(BaseCommand):
+    help = "Create products full-text search index (FTS5 table on SQLite, GIN index on PostgreSQL) and fill it with " \
+           "current products"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database alias")
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding products full-text search index...'))
+        backend = install_product_search(options['database'], rebuild=True)
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt products search index ({backend.__class__.__name__}).'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from API.response_cache import response_cache
+
+
+class Command(BaseCommand):
+    help = "Show hits and misses of cached api responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('namespaces', nargs='*', default=['api_products', 'api_categories'],
+                            help="Cached views names (router basenames)")
+        parser.add_argument('-r', '--reset', action='store_true', help="Reset counters after showing them")
+
+    def handle(self, *args, **options):
+        for namespace in options['namespaces']:
+            stats = response_cache.stats(namespace)
+            self.stdout.write(
+                f"{namespace}: {stats['hits']} hits, {stats['misses']} misses, hit ratio {stats['hit_ratio']:.2%}"
+            )
+
+            if options['reset']:
+                response_cache.reset_stats(namespace)
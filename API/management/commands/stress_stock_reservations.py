@@ -0,0 +1,136 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import close_old_connections
+from django.db import DatabaseError
+from django.db.models import Sum
+from django.utils import timezone
+
+from API.models import Order
+from API.models import Product
+from API.models import StockReservation
+from API.models import StockMovement
+from API.managers import StockReservationError
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import random
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = "Benchmark: place many concurrent orders for a few scarce test products with " \
+           "`StockReservation.objects.reserve` and check that stock is never oversold, then release all reservations " \
+           "and check that stock is restored. Test products and orders are created in the configured database (use a " \
+           "development one) and only they are removed afterwards. Correctness is covered by `API.tests`."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-t', '--threads', type=int, default=8, help="Number of concurrent threads")
+        parser.add_argument('-o', '--orders', type=int, default=200, help="Number of placed orders")
+        parser.add_argument('-p', '--products', type=int, default=3, help="Number of test products")
+        parser.add_argument('-s', '--stock', type=int, default=100, help="Initial stock of each test product")
+        parser.add_argument('-q', '--max-quantity', type=int, default=5, help="Max ordered quantity of a product")
+        parser.add_argument('--ledger', action='store_true', help="Enable stock ledger of test products")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Don't ask for confirmation before writing to the database")
+
+    def handle(self, *args, **options):
+        if options['interactive'] and input(
+            f"Test products and orders will be created in database '{connection.settings_dict['NAME']}'. "
+            f"Type 'yes' to continue: "
+        ) != 'yes':
+            self.stdout.write('Benchmark cancelled.')
+            return
+
+        stock = max(0, options['stock'])
+        products = Product.objects.bulk_create([
+            Product(name=f'Stock reservation stress test {number}', price=1, stock=stock, stock_ledger=options['ledger'])
+            for number in range(max(1, options['products']))
+        ])
+        products_ids = [product.pk for product in products]
+        results = {'reserved': 0, 'rejected': 0, 'errors': 0}
+        results_lock = threading.Lock()
+        orders_ids = []
+        deadline = timezone.now() + timedelta(hours=1)
+
+        def place_order(_):
+            # each order takes a random subset of products, listed in random order
+            quantities = {
+                product_id: random.randint(1, max(1, options['max_quantity']))
+                for product_id in random.sample(products_ids, random.randint(1, len(products_ids)))
+            }
+
+            try:
+                order = Order.objects.create(payment_deadline=deadline)
+                with results_lock:
+                    orders_ids.append(order.pk)
+                StockReservation.objects.reserve(order, quantities, deadline)
+                result = 'reserved'
+            except StockReservationError:
+                result = 'rejected'
+            except DatabaseError:
+                # ex. "database is locked" on SQLite which doesn't support concurrent writes
+                result = 'errors'
+            finally:
+                close_old_connections()
+                connection.close()
+
+            with results_lock:
+                results[result] += 1
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as executor:
+                list(executor.map(place_order, range(max(1, options['orders']))))
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{sum(results.values())} orders in {elapsed:.2f} s: {results["reserved"]} reserved, '
+                f'{results["rejected"]} rejected for missing stock, {results["errors"]} database errors'
+            ))
+
+            reservations = StockReservation.objects.filter(product_id__in=products_ids)
+
+            if not self.check_stock(products_ids, stock, reservations.filter(released_at__isnull=True)):
+                return
+
+            released = StockReservation.objects.release(reservations)
+            self.stdout.write(self.style.SUCCESS(f'{released} reservations released'))
+
+            if not self.check_stock(products_ids, stock, reservations.filter(released_at__isnull=True)):
+                return
+
+            if options['ledger']:
+                compacted = StockMovement.objects.compact(products_ids)
+                self.stdout.write(self.style.SUCCESS(f'{compacted} stock movements compacted'))
+
+                self.check_stock(products_ids, stock, reservations.filter(released_at__isnull=True))
+        finally:
+            Order.objects.filter(pk__in=orders_ids).delete(force=True)
+            Product.objects.filter(pk__in=products_ids).delete()
+
+    def check_stock(self, products_ids, initial_stock, reservations) -> bool:
+        """
+        :param products_ids: test products ids
+        :param initial_stock: initial stock of each product
+        :param reservations: not released reservations of test products
+        :return: whether available stock (including not compacted stock movements) of each product is not negative and
+        equal to initial stock minus reserved quantity
+        """
+        reserved = dict(reservations.values('product_id').annotate(quantity=Sum('quantity')).values_list(
+            'product_id', 'quantity'
+        ))
+        valid = True
+
+        for product_id, stock in sorted(StockMovement.objects.available_stock(products_ids).items()):
+            quantity = reserved.get(product_id, 0)
+
+            if stock < 0 or stock + quantity != initial_stock:
+                valid = False
+                self.stdout.write(self.style.ERROR(
+                    f'product {product_id}: stock {stock} + reserved {quantity} != initial stock {initial_stock}!'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'product {product_id}: stock {stock}, reserved {quantity}'))
+
+        return valid
@@ -1,5 +1,10 @@
+from django.apps import apps
+from django.db import connections
 from django.db import models
-from django.db.models import F, Q, QuerySet, Avg, Count
+from django.db import transaction
+from django.db.models import F, Q, QuerySet, Count, Sum
+from django.db.models import Case, When, Value, OuterRef, Subquery, Max, Min
+from django.db.models import ExpressionWrapper
 from django.contrib.auth.models import User
 from django.db.models.functions import Coalesce
 from django.db.models.functions import Cast
@@ -7,23 +12,70 @@ from django.db.models.functions import ExtractMonth
 from django.db.models.functions import ExtractDay
 from django.db.models.functions import ExtractYear
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
-from datetime import datetime
-from typing import Union, Tuple, List
+from mptt.managers import TreeManager
+
+from datetime import datetime, date, time, timedelta
+from typing import Union, Tuple, List, Optional, Iterable, Dict
+from collections import defaultdict
+import random
 import sys
 
+from API.hyperloglog import HyperLogLog
+from API.thumbnails import thumbnail_pool
+from API.response_cache import invalidate_product_responses
+from API.roles import is_client
+from API.roles import is_seller
+
+
+def day_start(day: date) -> datetime:
+    """
+    :param day: date
+    :return: aware datetime of provided day beginning in current timezone
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def week_start(day: date) -> date:
+    """
+    :param day: date
+    :return: monday of provided day week
+    """
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day: date) -> date:
+    """
+    :param day: date
+    :return: first day of provided day month
+    """
+    return day.replace(day=1)
+
+
+def next_month_start(day: date) -> date:
+    """
+    :param day: date
+    :return: first day of the month following provided day month
+    """
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
 
 class SoftDeleteQuerySet(QuerySet):
     def delete(self, force=False):
         """
-        'Delete' the records in the current QuerySet by setting is_deleted to True.
+        'Delete' the records in the current QuerySet by setting is_deleted to True (and bumping `auto_now` fields, like
+        saving deleted instance does).
         :param force: force delete - if True perform actual delete in db ex. for admin management
         """
         if force:
             super().delete()
         else:
-            self.update(is_deleted=True)
+            now = timezone.now()
+            self.update(is_deleted=True, **{
+                field.name: now for field in self.model._meta.concrete_fields if getattr(field, 'auto_now', False)
+            })
 
 
 class SoftDeleteManager(models.manager.BaseManager.from_queryset(SoftDeleteQuerySet)):
@@ -36,8 +88,78 @@ class SoftDeleteManager(models.manager.BaseManager.from_queryset(SoftDeleteQuery
         return self.get_queryset(with_deleted=True).filter(is_deleted=True)
 
 
+class ProductCategoryManager(TreeManager):
+    TREE_CACHE_KEY = 'product_category_tree'
+
+    def build_tree(self) -> dict:
+        """
+        Build whole categories tree from a single query in MPTT order (parents always come before their children)
+        :return: dict with `roots` - list of root nodes, `nodes` - node of each category by id and `paths` - breadcrumb
+        path (from root to the category) of each category by id, nodes have the same shape as `ProductCategorySerializer`
+        output
+        """
+        roots, nodes, paths = [], {}, {}
+
+        for category_id, name, parent_id in self.get_queryset().order_by(
+                self.tree_id_attr, self.left_attr
+        ).values_list('id', 'name', 'parent_id'):
+            node = {'id': category_id, 'name': name, 'parent': parent_id, 'children': []}
+            nodes[category_id] = node
+            crumb = {'id': category_id, 'name': name}
+
+            if parent_id is None:
+                roots.append(node)
+                paths[category_id] = [crumb]
+            else:
+                nodes[parent_id]['children'].append(node)
+                paths[category_id] = paths[parent_id] + [crumb]
+
+        return {'roots': roots, 'nodes': nodes, 'paths': paths}
+
+    def cached_tree(self) -> dict:
+        """
+        :return: categories tree (see `build_tree`) from cache, invalidated on every category change (processes not
+        sharing the cache backend refresh it after `CATEGORY_TREE_CACHE_TIMEOUT` seconds)
+        """
+        tree = cache.get(self.TREE_CACHE_KEY, None)
+
+        if tree is None:
+            tree = self.build_tree()
+            cache.set(self.TREE_CACHE_KEY, tree, timeout=settings.CATEGORY_TREE_CACHE_TIMEOUT)
+
+        return tree
+
+    def invalidate_tree_cache(self) -> None:
+        cache.delete(self.TREE_CACHE_KEY)
+
+    def subtree(self, category_id: int) -> Optional[dict]:
+        """
+        :param category_id: category id
+        :return: serialized category with all its descendants
+        """
+        return self.cached_tree()['nodes'].get(category_id, None)
+
+    def path(self, category_id: int) -> List[dict]:
+        """
+        :param category_id: category id
+        :return: breadcrumb path from root category to provided one
+        """
+        return self.cached_tree()['paths'].get(category_id, [])
+
+
 class ProductManager(models.Manager):
     EPSILON = sys.float_info.epsilon
+    RATINGS_AVERAGE = Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=F('rating_sum') / Cast(F('rating_count'), models.FloatField()),
+        output_field=models.FloatField()
+    )
+    # sum of order lines totals at checkout prices, independent of later price changes
+    TOTAL_PROFIT = Coalesce(
+        models.Sum('orderproductlistitem__line_total'),
+        Cast(0.0, models.DecimalField(decimal_places=2, max_digits=24)),
+        output_field=models.DecimalField(decimal_places=2, max_digits=24)
+    )
 
     def products_by_seller(self, seller: User, filter_q: Q = None) -> QuerySet:
         """
@@ -63,7 +185,9 @@ class ProductManager(models.Manager):
         :return: products with the total number of copies sold
         """
 
-        return self.products_by_seller(seller, filter_q).select_related('category').prefetch_related(
+        q = self.with_available_stock(self.products_by_seller(seller, filter_q))
+
+        return q.select_related('category').prefetch_related(
             'orderproductlistitem_set'
         ).annotate(
             sells_count=Coalesce(
@@ -100,13 +224,7 @@ class ProductManager(models.Manager):
         list of products form date range)
         :return: products with the total profit
         """
-        return self.counted_sales(seller, filter_q).annotate(
-            total_profit=Coalesce(
-                F('price') * Cast(F('sells_count'), models.DecimalField(decimal_places=2, max_digits=18)),
-                Cast(0.0, models.DecimalField(decimal_places=2, max_digits=24)),
-                output_field=models.DecimalField(decimal_places=2, max_digits=24)
-            )
-        )
+        return self.counted_sales(seller, filter_q).annotate(total_profit=self.TOTAL_PROFIT)
 
     def most_profitable(self, seller: User, filter_q: Q = None) -> QuerySet:
         """
@@ -128,26 +246,35 @@ class ProductManager(models.Manager):
         """
         return self.counted_profits(seller, filter_q).order_by('total_profit')
 
+    def with_available_stock(self, q: QuerySet = None) -> QuerySet:
+        """
+        :param q: products query, all products by default
+        :return: products annotated with `available_stock` - `stock` plus not compacted stock movements of products with
+        stock ledger, read endpoints show it as product stock
+        """
+        if q is None:
+            q = self.get_queryset()
+
+        return q.annotate(available_stock=apps.get_model('API', 'StockMovement').objects.available_stock_expression())
+
     def available(self) -> QuerySet:
         """
-        :return: Available products query with stock > 0
+        :return: Available products query with stock > 0 (annotated with `available_stock`)
         """
-        return self.get_queryset().filter(stock__gt=0)
+        return self.with_available_stock().filter(available_stock__gt=0)
 
     def out_of_stock(self) -> QuerySet:
         """
-        :return: Not available products query with stock == 0
+        :return: Not available products query with stock == 0 (annotated with `available_stock`)
         """
-        return self.get_queryset().filter(stock=0)
+        return self.with_available_stock().filter(available_stock__lte=0)
 
     def with_ratings(self) -> QuerySet:
         """
-        Get products annotated with average ratings
+        Get products with average ratings (computed from denormalized `rating_sum` and `rating_count` fields) available
+        for filtering and ordering under `ratings` alias
         """
-        return self.get_queryset().prefetch_related('productrating_set').annotate(
-            ratings=Coalesce(Avg('productrating__rating'), Cast(0.0, models.FloatField())),
-            rates_count=Count('productrating__rating')
-        )
+        return self.get_queryset().alias(ratings=self.RATINGS_AVERAGE)
 
     def n_star_rating(self, stars: Union[Tuple[float, float], List[float]]) -> QuerySet:
         """
@@ -227,28 +354,448 @@ class ProductManager(models.Manager):
 
     def with_views(self) -> QuerySet:
         """
-        Get products annotated with number of views
+        Get products with number of views available for filtering and ordering under `views` alias
         """
-        return self.get_queryset().prefetch_related('productview_set').annotate(views=Count('productview'))
+        return self.get_queryset().alias(views=F('views_count'))
 
-    def full_stats(self, filter_q: Q = None) -> QuerySet:
+    def full_stats(self, filter_q: Q = None, date_from: datetime = None, date_to: datetime = None) -> QuerySet:
+        """
+        Get products annotated with sales, profits, ratings and views statistics
+        :param filter_q: additional filtering expression
+        :param date_from: optional lower limit of counted views, if no limit is provided all-time views are used
+        :param date_to: optional upper limit of counted views
+        :return: products with annotated statistics
+        """
         q = self.get_queryset()
+        views = F('views_count')
+
+        if date_from or date_to:
+            views = apps.get_model('API', 'ProductViewDaily').objects.views_total(
+                date_from.date() if date_from else None, date_to.date() if date_to else None
+            )
 
         if filter_q:
             q = q.filter(filter_q)
 
-        return q.prefetch_related('orderproductlistitem_set', 'productrating_set', 'productview_set').annotate(
+        return self.with_available_stock(q).prefetch_related('orderproductlistitem_set').annotate(
             sells_count=Coalesce(models.Sum('orderproductlistitem__quantity'), Cast(0, models.PositiveIntegerField())),
-            total_profit=Coalesce(
-                F('price') * Cast(F('sells_count'), models.DecimalField(decimal_places=2, max_digits=18)),
-                Cast(0.0, models.DecimalField(decimal_places=2, max_digits=24)),
-                output_field=models.DecimalField(decimal_places=2, max_digits=24)
-            ),
-            ratings=Coalesce(Avg('productrating__rating'), Cast(0.0, models.FloatField())),
-            rates_count=Count('productrating__rating'),
-            views=Count('productview')
+            total_profit=self.TOTAL_PROFIT,
+            ratings=self.RATINGS_AVERAGE,
+            rates_count=F('rating_count'),
+            views=views
+        )
+
+    def rebuild_counters(self, batch_size: int = 1000) -> int:
+        """
+        Recalculate denormalized `rating_sum`, `rating_count` and `views_count` fields from :model:`API.ProductRating`,
+        :model:`API.ProductViewDaily` and not yet rolled up :model:`API.ProductView` tables, ex. after bulk inserts which
+        do not send model signals
+        :param batch_size: number of products updated in a single query
+        :return: number of updated products
+        """
+        ratings = apps.get_model('API', 'ProductRating').objects.filter(product=OuterRef('pk')).order_by()
+        views = apps.get_model('API', 'ProductViewDaily').objects.views_total()
+        products_ids = list(self.get_queryset().order_by('pk').values_list('pk', flat=True))
+        updated = 0
+
+        for i in range(0, len(products_ids), batch_size):
+            updated += self.get_queryset().filter(pk__in=products_ids[i:i + batch_size]).update(
+                rating_sum=Coalesce(
+                    Subquery(ratings.values('product').annotate(total=Sum('rating')).values('total')),
+                    Value(0.0),
+                    output_field=models.FloatField()
+                ),
+                rating_count=Coalesce(
+                    Subquery(ratings.values('product').annotate(total=Count('pk')).values('total')),
+                    Value(0),
+                    output_field=models.PositiveIntegerField()
+                ),
+                views_count=views,
+            )
+
+        return updated
+
+    def bulk_upsert(self, seller: User, products: List[Dict]) -> Dict[str, Tuple[int, bool]]:
+        """
+        Create or update seller's products identified by their sku with insert queries updating conflicting rows (one
+        for products with new photo and one for the rest). Photos of products with new `photo_url` are downloaded and
+        their thumbnails created in background after current transaction commits, new products without `photo_url`
+        are marked as having no photo.
+        :param seller: user with 'seller' role
+        :param products: validated fields of products with unique `sku` (`category_id` instead of `category`), missing
+        `photo_url` keeps current product photo
+        :return: id of each product and True if it was created by its sku
+        """
+        model = self.model
+        existing = {
+            sku: (pk, photo_url, stock_ledger) for sku, pk, photo_url, stock_ledger in self.get_queryset().filter(
+                seller=seller, sku__in=[product['sku'] for product in products]
+            ).values_list('sku', 'pk', 'photo_url', 'stock_ledger')
+        }
+        fields = ['name', 'description', 'price', 'category', 'stock']
+        # products grouped by whether their photo changed and whether they use stock ledger
+        groups = defaultdict(list)
+
+        for data in products:
+            product = model(seller=seller, **data)
+            photo_url = data.get('photo_url', None)
+            photo_changed = photo_url is not None and (data['sku'] not in existing or
+                                                       existing[data['sku']][1] != photo_url)
+
+            if photo_changed:
+                product.photo = ''
+                product.photo_hash = ''
+                product.thumbnail = ''
+                product.thumbnail_status = model.ThumbnailStatus.PENDING
+            elif data['sku'] not in existing:
+                # new product without photo has no thumbnail to wait for
+                product.thumbnail_status = model.ThumbnailStatus.NO_PHOTO
+
+            groups[photo_changed, data['sku'] in existing and existing[data['sku']][2]].append(product)
+
+        for (photo_changed, ledger), group in groups.items():
+            update_fields = fields + ['photo', 'photo_url'] + list(model.THUMBNAIL_FIELDS) if photo_changed else fields
+
+            if ledger:
+                # stock of products with stock ledger is changed by restock movements instead
+                update_fields = [field for field in update_fields if field != 'stock']
+
+            self.bulk_create(group, update_conflicts=True, unique_fields=['seller', 'sku'], update_fields=update_fields)
+
+        with_photo = groups[True, False] + groups[True, True]
+        saved = [product for group in groups.values() for product in group]
+
+        # not every database returns ids of updated rows
+        if any(product.pk is None for product in saved):
+            ids = dict(self.get_queryset().filter(seller=seller, sku__in=[product['sku'] for product in products])
+                       .values_list('sku', 'pk'))
+            for product in saved:
+                product.pk = ids[product.sku]
+
+        ledger_products = groups[False, True] + groups[True, True]
+        if ledger_products:
+            apps.get_model('API', 'StockMovement').objects.restock({
+                product.pk: product.stock for product in ledger_products
+            })
+
+        for product in with_photo:
+            thumbnail_pool.schedule(product.pk)
+        invalidate_product_responses(product.pk for product in saved)
+
+        return {product.sku: (product.pk, product.sku not in existing) for product in saved}
+
+
+class ProductViewManager(models.Manager):
+    def insert_new(self, views: Iterable[Tuple[int, str]], batch_size: int = None) -> Dict[int, int]:
+        """
+        Insert product views skipping ones which already exist (ex. written in the meantime by another worker). Views
+        stored before the insert aren't counted, the same view inserted concurrently by another worker may be counted
+        by both of them.
+        :param views: (product id, viewer ip) pairs
+        :param batch_size: number of rows inserted in a single query
+        :return: number of inserted views per product id
+        """
+        ip_field = self.model._meta.get_field('ip')
+        # ips are compared with stored ones in the form they are stored in (ex. compressed IPv6)
+        objs = [self.model(product_id=product_id, ip=ip_field.get_prep_value(ip)) for product_id, ip in views]
+        batch_size = batch_size or len(objs) or 1
+        inserted = defaultdict(int)
+
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            existing = set(self.get_queryset().filter(
+                product_id__in={obj.product_id for obj in batch}, ip__in={obj.ip for obj in batch}
+            ).values_list('product_id', 'ip'))
+            self.bulk_create(batch, ignore_conflicts=True)
+
+            for obj in batch:
+                if (obj.product_id, obj.ip) not in existing:
+                    inserted[obj.product_id] += 1
+
+        return inserted
+
+
+class ProductViewDailyManager(models.Manager):
+    def last_rolled_up_day(self) -> Optional[date]:
+        """
+        :return: last day for which raw :model:`API.ProductView` rows have been rolled up
+        """
+        return self.get_queryset().aggregate(last_day=Max('day'))['last_day']
+
+    def raw_views(self) -> QuerySet:
+        """
+        :return: raw :model:`API.ProductView` rows which have not been rolled up yet
+        """
+        q = apps.get_model('API', 'ProductView').objects.all()
+        last_day = self.last_rolled_up_day()
+
+        if last_day is not None:
+            q = q.filter(created_at__gte=day_start(last_day + timedelta(days=1)))
+
+        return q
+
+    def views_total(self, date_from: date = None, date_to: date = None) -> Coalesce:
+        """
+        Expression counting views of the outer product query from rollup rows and not yet rolled up raw rows
+        :param date_from: optional first counted day
+        :param date_to: optional last counted day
+        :return: views count expression for annotating or updating products query
+        """
+        rollup_q = self.get_queryset().filter(product=OuterRef('pk')).order_by()
+        raw_q = self.raw_views().filter(product=OuterRef('pk')).order_by()
+
+        if date_from:
+            rollup_q = rollup_q.filter(day__gte=date_from)
+            raw_q = raw_q.filter(created_at__gte=day_start(date_from))
+        if date_to:
+            rollup_q = rollup_q.filter(day__lte=date_to)
+            raw_q = raw_q.filter(created_at__lt=day_start(date_to + timedelta(days=1)))
+
+        return Coalesce(
+            Subquery(rollup_q.values('product').annotate(total=Sum('views')).values('total')), Value(0),
+            output_field=models.PositiveIntegerField()
+        ) + Coalesce(
+            Subquery(raw_q.values('product').annotate(total=Count('pk')).values('total')), Value(0),
+            output_field=models.PositiveIntegerField()
         )
 
+    def rollup_day(self, day: date, chunk_size: int = 1000) -> int:
+        """
+        Aggregate raw :model:`API.ProductView` rows from provided day into rollup rows, existing rollup rows of this day
+        are overwritten, so the rollup can be safely repeated
+        :param day: rolled up day
+        :param chunk_size: number of products aggregated in a single query
+        :return: number of created or updated rollup rows
+        """
+        raw_q = apps.get_model('API', 'ProductView').objects.filter(
+            created_at__gte=day_start(day), created_at__lt=day_start(day + timedelta(days=1))
+        ).order_by()
+        products_ids = list(raw_q.values_list('product_id', flat=True).distinct().order_by('product_id'))
+        rolled_up = 0
+
+        for i in range(0, len(products_ids), chunk_size):
+            rows = raw_q.filter(product_id__in=products_ids[i:i + chunk_size]).values('product_id').annotate(
+                views_sum=Count('pk')
+            )
+            rolled_up += len(self.bulk_create([
+                self.model(product_id=row['product_id'], day=day, views=row['views_sum']) for row in rows
+            ], update_conflicts=True, unique_fields=['product', 'day'], update_fields=['views']))
+
+        return rolled_up
+
+    def rollup(self, until: date = None, chunk_size: int = 1000) -> int:
+        """
+        Aggregate all not yet rolled up days until provided day (yesterday by default)
+        :param until: last rolled up day
+        :param chunk_size: number of products aggregated in a single query
+        :return: number of created or updated rollup rows
+        """
+        if until is None:
+            until = timezone.localdate() - timedelta(days=1)
+
+        last_day = self.last_rolled_up_day()
+
+        if last_day is None:
+            first_view = apps.get_model('API', 'ProductView').objects.aggregate(first=Min('created_at'))['first']
+
+            if first_view is None:
+                return 0
+
+            day = timezone.localtime(first_view).date()
+        else:
+            day = last_day + timedelta(days=1)
+
+        rolled_up = 0
+
+        while day <= until:
+            rolled_up += self.rollup_day(day, chunk_size)
+            day += timedelta(days=1)
+
+        return rolled_up
+
+    def compact(self, retention_days: int, chunk_size: int = 1000) -> int:
+        """
+        Delete already rolled up raw :model:`API.ProductView` rows older than retention window. Raw rows are also the
+        record of (product, ip) pairs already counted, so a visitor whose view has been deleted is counted again on the
+        next visit: views are unique per ip within the retention window, not forever.
+        :param retention_days: number of days for which raw rows are kept
+        :param chunk_size: number of rows deleted in a single query
+        :return: number of deleted rows
+        """
+        last_day = self.last_rolled_up_day()
+
+        if last_day is None:
+            return 0
+
+        view_model = apps.get_model('API', 'ProductView')
+        limit = min(
+            day_start(timezone.localdate() - timedelta(days=retention_days)),
+            day_start(last_day + timedelta(days=1))
+        )
+        old_views = view_model.objects.filter(created_at__lt=limit).order_by('pk').values_list('pk', flat=True)
+        deleted = 0
+
+        while True:
+            chunk = list(old_views[:chunk_size])
+
+            if not chunk:
+                break
+
+            deleted += view_model.objects.filter(pk__in=chunk).delete()[0]
+
+        return deleted
+
+
+class ProductVisitorsSketchManager(models.Manager):
+    def bucket_start(self, day: date, period: int) -> date:
+        """
+        :param day: date
+        :param period: :model:`API.ProductVisitorsSketch` period (day, week or month)
+        :return: start of the bucket containing provided day
+        """
+        if period == self.model.Period.WEEK:
+            return week_start(day)
+        if period == self.model.Period.MONTH:
+            return month_start(day)
+        return day
+
+    def record(self, visits: Iterable[Tuple[int, str]], day: date = None) -> int:
+        """
+        Add visitors to daily, weekly and monthly sketches of visited products
+        :param visits: (product id, visitor ip) pairs
+        :param day: day of the visits, current day by default
+        :return: number of updated sketches
+        """
+        if day is None:
+            day = timezone.localdate()
+
+        visitors = defaultdict(set)
+        for product_id, ip in visits:
+            visitors[product_id].add(ip)
+
+        if not visitors:
+            return 0
+
+        buckets = {period: self.bucket_start(day, period) for period in self.model.Period.values}
+        keys_filter = Q()
+        for period, bucket_start in buckets.items():
+            keys_filter |= Q(period=period, bucket_start=bucket_start)
+
+        with transaction.atomic():
+            # create missing sketches first, so concurrent workers update the same rows instead of inserting duplicates
+            self.bulk_create([
+                self.model(product_id=product_id, period=period, bucket_start=bucket_start, registers=bytes(HyperLogLog()))
+                for product_id in visitors for period, bucket_start in buckets.items()
+            ], ignore_conflicts=True)
+            sketches = list(self.get_queryset().select_for_update().filter(
+                keys_filter, product_id__in=list(visitors)
+            ))
+
+            for sketch in sketches:
+                hll = sketch.sketch
+                hll.update(visitors[sketch.product_id])
+                sketch.registers = bytes(hll)
+
+            self.bulk_update(sketches, ['registers'])
+
+        return len(sketches)
+
+    def buckets_covering(self, date_from: date, date_to: date) -> Dict[int, List[date]]:
+        """
+        Split days range into the smallest number of whole months, weeks and days buckets
+        :param date_from: first day of the range
+        :param date_to: last day of the range
+        :return: buckets starts grouped by period
+        """
+        buckets = defaultdict(list)
+        day = date_from
+
+        while day <= date_to:
+            if day.day == 1 and next_month_start(day) - timedelta(days=1) <= date_to:
+                buckets[self.model.Period.MONTH].append(day)
+                day = next_month_start(day)
+            elif day.weekday() == 0 and day + timedelta(days=6) <= date_to:
+                buckets[self.model.Period.WEEK].append(day)
+                day += timedelta(days=7)
+            else:
+                buckets[self.model.Period.DAY].append(day)
+                day += timedelta(days=1)
+
+        return buckets
+
+    def unique_visitors(self, product_id: int, date_from: date, date_to: date) -> int:
+        """
+        Estimate number of unique visitors of the product in provided days range by merging covering sketches
+        :param product_id: product id
+        :param date_from: first day of the range
+        :param date_to: last day of the range
+        :return: estimated number of unique visitors
+        """
+        keys_filter = Q()
+        for period, buckets_starts in self.buckets_covering(date_from, date_to).items():
+            keys_filter |= Q(period=period, bucket_start__in=buckets_starts)
+
+        if not keys_filter:
+            return 0
+
+        hll = HyperLogLog()
+        for registers in self.get_queryset().filter(keys_filter, product_id=product_id).values_list('registers',
+                                                                                                     flat=True):
+            hll.merge(HyperLogLog.from_bytes(registers))
+
+        return hll.count()
+
+    def unique_visitors_series(self, product_id: int, period: int, date_from: date, date_to: date) -> List[dict]:
+        """
+        :param product_id: product id
+        :param period: buckets period (day, week or month)
+        :param date_from: first day of the range
+        :param date_to: last day of the range
+        :return: estimated number of unique visitors in each bucket of provided range
+        """
+        return [
+            {'bucket_start': sketch.bucket_start, 'unique_visitors': sketch.unique_visitors}
+            for sketch in self.get_queryset().filter(
+                product_id=product_id, period=period,
+                bucket_start__gte=self.bucket_start(date_from, period), bucket_start__lte=date_to
+            ).order_by('bucket_start')
+        ]
+
+    def compact(self, retention_days: int) -> int:
+        """
+        Delete daily sketches older than retention window, weekly and monthly sketches still cover those days
+        :param retention_days: number of days for which daily sketches are kept
+        :return: number of deleted sketches
+        """
+        return self.get_queryset().filter(
+            period=self.model.Period.DAY, bucket_start__lt=timezone.localdate() - timedelta(days=retention_days)
+        ).delete()[0]
+
+
+class AddressManager(models.Manager):
+    def upsert(self, **fields) -> models.Model:
+        """
+        Find the address by its fingerprint (single unique index lookup) or insert it. Insert skips the conflict with
+        the same address inserted concurrently, so the address is never stored twice.
+        :param fields: address fields
+        :return: stored address
+        """
+        address = self.model(**fields)
+        address.update_fingerprint()
+
+        existing = self.get_queryset().filter(fingerprint=address.fingerprint).first()
+        if existing is not None:
+            return existing
+
+        # conflicting row is "updated" with its own fingerprint, so its primary key is returned like for inserted one
+        self.bulk_create([address], update_conflicts=True, unique_fields=['fingerprint'],
+                         update_fields=['fingerprint'])
+
+        if address.pk is None:
+            # databases which don't return primary keys from bulk inserts
+            return self.get_queryset().get(fingerprint=address.fingerprint)
+        return address
+
 
 class OrderManager(SoftDeleteManager):
     def __combine_user_filter_q(self, user: User) -> Q:
@@ -257,9 +804,10 @@ class OrderManager(SoftDeleteManager):
         :return: Q object representing query filter based on passed user
         """
         user_q = Q()
-        if user.groups.filter(name=settings.USER_SELLER_GROUP_NAME).exists():
-            user_q = Q(orderproductlistitem_set__product__seller=user)
-        elif user.groups.filter(name=settings.USER_CLIENT_GROUP_NAME).exists():
+        if is_seller(user):
+            # seller sees only sales of own products, sums below are limited to lines matched by this filter
+            user_q = Q(orderproductlistitem__seller=user)
+        elif is_client(user):
             user_q = Q(client=user)
         return user_q
 
@@ -272,9 +820,7 @@ class OrderManager(SoftDeleteManager):
         """
         return queryset.values(group_key).annotate(
             sales=models.Sum('orderproductlistitem__quantity'),
-            profits=models.Sum(
-                models.F('orderproductlistitem__quantity') * models.F('orderproductlistitem__product__price')
-            )
+            profits=models.Sum('orderproductlistitem__line_total')
         )
 
     def sales_by_day(self, user: User, date: datetime) -> QuerySet:
@@ -289,9 +835,7 @@ class OrderManager(SoftDeleteManager):
         if user_q:
             filter_q.add(user_q, Q.AND)
 
-        q = self.get_queryset().filter(filter_q).prefetch_related('orderproductlistitem_set').annotate(
-            day=ExtractDay('order_date')
-        )
+        q = self.get_queryset().filter(filter_q).annotate(day=ExtractDay('order_date'))
 
         return self.__annotate_sales_and_profits(q, 'day')
 
@@ -315,9 +859,7 @@ class OrderManager(SoftDeleteManager):
         if user_q:
             filter_q.add(user_q, Q.AND)
 
-        q = self.get_queryset().filter(filter_q).prefetch_related('orderproductlistitem_set').annotate(
-            day=ExtractDay('order_date')
-        )
+        q = self.get_queryset().filter(filter_q).annotate(day=ExtractDay('order_date'))
 
         return self.__annotate_sales_and_profits(q, 'day').order_by('day')
 
@@ -335,9 +877,7 @@ class OrderManager(SoftDeleteManager):
         if user_q:
             filter_q.add(user_q, Q.AND)
 
-        q = self.get_queryset().filter(filter_q).prefetch_related('orderproductlistitem_set').annotate(
-            month=ExtractMonth('order_date')
-        )
+        q = self.get_queryset().filter(filter_q).annotate(month=ExtractMonth('order_date'))
 
         return self.__annotate_sales_and_profits(q, 'month').order_by('month')
 
@@ -349,9 +889,9 @@ class OrderManager(SoftDeleteManager):
         user_q = self.__combine_user_filter_q(user)
 
         if user_q:
-            q = self.get_queryset().filter(user_q).prefetch_related('orderproductlistitem_set')
+            q = self.get_queryset().filter(user_q)
         else:
-            q = self.get_queryset().prefetch_related('orderproductlistitem_set')
+            q = self.get_queryset()
 
         q = q.annotate(year=ExtractYear('order_date'))
 
@@ -366,16 +906,21 @@ class OrderManager(SoftDeleteManager):
         user_q = self.__combine_user_filter_q(user)
 
         if user_q:
-            q = self.get_queryset().filter(user_q).prefetch_related(
-                'orderproductlistitem_set', 'orderproductlistitem_set__product'
-            ).select_related('order_address').annotate(country=F('order_address__country'))
+            q = self.get_queryset().filter(user_q).annotate(country=F('order_address__country'))
         else:
-            q = self.get_queryset().prefetch_related(
-                'orderproductlistitem_set', 'orderproductlistitem_set__product'
-            ).select_related('order_address').annotate(country=F('order_address__country'))
+            q = self.get_queryset().annotate(country=F('order_address__country'))
 
         return self.__annotate_sales_and_profits(q, 'country').order_by('-profits')
 
+    def of_seller(self, seller: User) -> QuerySet:
+        """
+        :param seller: user with 'seller' role
+        :return: orders with seller's products, each order once (looked up by seller index of order lines)
+        """
+        return self.get_queryset().filter(
+            pk__in=apps.get_model('API', 'OrderProductListItem').objects.filter(seller=seller).values('order_id')
+        )
+
     def unpaid(self) -> QuerySet:
         return self.get_queryset().filter(Q(is_paid=False) | Q(status__in=self.model.UNPAID_STATUS))
 
@@ -384,3 +929,414 @@ class OrderManager(SoftDeleteManager):
 
     def completed(self) -> QuerySet:
         return self.get_queryset().filter(status__in=self.model.OrderStatus.COMPLETED)
+
+    def overdue(self, current_time: datetime = None) -> QuerySet:
+        """
+        :param current_time: checked time, now by default
+        :return: not paid orders (which haven't expired yet) with payment deadline before given time
+        """
+        return self.get_queryset().filter(
+            status__in=[self.model.OrderStatus.PENDING, self.model.OrderStatus.PENDING_PAYMENT],
+            payment_deadline__lt=current_time or timezone.now()
+        )
+
+
+class StockReservationError(Exception):
+    """
+    Some products don't have enough stock, `errors` maps their ids to error messages
+    """
+    def __init__(self, errors: Dict[int, str]):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class StockReservationManager(models.Manager):
+    def reserve(self, order, quantities: Dict[int, int], expires_at: Optional[datetime]) -> List:
+        """
+        Take products from stock for the order. Stock of each product is decremented with a single conditional update
+        (`stock >= quantity`), so concurrent orders never take more than is available and never wait for each other's
+        reads. Products are updated in order of their ids, so concurrent orders lock rows in the same order and can't
+        deadlock.
+        :param order: reserving order
+        :param quantities: reserved quantity of each product by its id
+        :param expires_at: time after which not paid reservation is released (see `release_expired`), None for ones
+        which never expire
+        :return: created reservations
+        :raise StockReservationError: if any product doesn't have enough stock, nothing is reserved then
+        """
+        product_model = apps.get_model('API', 'Product')
+        movement_model = apps.get_model('API', 'StockMovement')
+        ledger_ids = set(product_model.objects.filter(pk__in=list(quantities), stock_ledger=True).values_list(
+            'pk', flat=True
+        ))
+        errors = {}
+
+        with transaction.atomic():
+            for product_id in sorted(set(quantities) - ledger_ids):
+                quantity = quantities[product_id]
+
+                if not product_model.objects.filter(pk=product_id, stock__gte=quantity).update(
+                        stock=F('stock') - quantity):
+                    available = product_model.objects.filter(pk=product_id).values_list('stock', flat=True).first()
+                    errors[product_id] = f"Product {product_id} doesn't exist!" if available is None else \
+                        f"Only {available} items of product {product_id} are available, {quantity} requested!"
+
+            if ledger_ids:
+                shortages = movement_model.objects.take(order, {pk: quantities[pk] for pk in ledger_ids})
+
+                for product_id, available in shortages.items():
+                    errors[product_id] = f"Only {max(0, available)} items of product {product_id} are available, " \
+                                         f"{quantities[product_id]} requested!"
+
+            if errors:
+                # roll back stock already taken by this order
+                raise StockReservationError(errors)
+
+            reservations = self.bulk_create([
+                self.model(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+
+        invalidate_product_responses(quantities)
+
+        return reservations
+
+    def commit(self, order) -> int:
+        """
+        Keep order reservations forever, ex. after the order is paid
+        :param order: order
+        :return: number of committed reservations
+        """
+        return self.get_queryset().filter(order=order, released_at__isnull=True).update(expires_at=None)
+
+    def release(self, reservations: QuerySet, current_time: datetime = None) -> int:
+        """
+        Return reserved products to stock, each reservation is released only once even if called concurrently
+        :param reservations: released reservations
+        :param current_time: release time, now by default
+        :return: number of released reservations
+        """
+        current_time = current_time or timezone.now()
+        product_model = apps.get_model('API', 'Product')
+
+        with transaction.atomic():
+            # lock rows, so concurrent release of the same reservations waits and then skips them
+            released = list(
+                reservations.filter(released_at__isnull=True).select_for_update().order_by('pk').values_list(
+                    'pk', 'product_id', 'quantity'
+                )
+            )
+            quantities = defaultdict(int)
+
+            for pk, product_id, quantity in released:
+                quantities[product_id] += quantity
+
+            self.get_queryset().filter(pk__in=[pk for pk, product_id, quantity in released]).update(
+                released_at=current_time
+            )
+
+            ledger_ids = set(product_model.objects.filter(pk__in=list(quantities), stock_ledger=True).values_list(
+                'pk', flat=True
+            ))
+            movement_model = apps.get_model('API', 'StockMovement')
+            movement_model.objects.record({pk: quantities[pk] for pk in ledger_ids}, movement_model.Kind.RELEASE)
+
+            for product_id in sorted(set(quantities) - ledger_ids):
+                product_model.objects.filter(pk=product_id).update(stock=F('stock') + quantities[product_id])
+
+        invalidate_product_responses(quantities)
+
+        return len(released)
+
+    def release_order(self, order) -> int:
+        """
+        :param order: canceled, declined or expired order
+        :return: number of released reservations
+        """
+        return self.release(self.get_queryset().filter(order=order))
+
+    def release_expired(self, current_time: datetime = None) -> int:
+        """
+        :param current_time: checked time, now by default
+        :return: number of released reservations which expired before given time
+        """
+        current_time = current_time or timezone.now()
+
+        return self.release(self.get_queryset().filter(expires_at__lt=current_time), current_time)
+
+
+class StockMovementManager(models.Manager):
+    def record(self, quantities: Dict[int, int], kind: int, order=None) -> List:
+        """
+        :param quantities: stock change of each product by its id, negative for products taken from stock
+        :param kind: movement kind, see `StockMovement.Kind`
+        :param order: order which caused the movements
+        :return: inserted movements
+        """
+        return self.bulk_create([
+            self.model(product_id=product_id, order=order, kind=kind, quantity=quantities[product_id])
+            for product_id in sorted(quantities) if quantities[product_id]
+        ])
+
+    def available_stock_expression(self) -> ExpressionWrapper:
+        """
+        :return: products query expression of product stock plus its not compacted movements, read in a single query so
+        concurrent compaction is never counted twice
+        """
+        pending = self.get_queryset().filter(product=OuterRef('pk'), compacted=False).values('product').annotate(
+            total=Sum('quantity')
+        ).values('total')
+
+        return ExpressionWrapper(
+            F('stock') + Coalesce(Subquery(pending, output_field=models.IntegerField()), 0),
+            output_field=models.IntegerField()
+        )
+
+    def available_stock(self, products_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        :param products_ids: products ids
+        :return: product stock plus not compacted movements of each product by its id
+        """
+        return dict(apps.get_model('API', 'Product').objects.filter(pk__in=list(products_ids)).annotate(
+            available=self.available_stock_expression()
+        ).values_list('pk', 'available'))
+
+    def restock(self, stocks: Dict[int, int]) -> List:
+        """
+        Set available stock of products with stock ledger by recording its change as a restock movement, so restocking
+        doesn't overwrite `stock` changed in the meantime by compaction. Stock shards are allotted again from the new
+        stock.
+        :param stocks: new available stock of each product by its id
+        :return: inserted movements
+        """
+        movements = []
+
+        with transaction.atomic():
+            for product_id in sorted(stocks):
+                if not self.lock_shards(product_id):
+                    continue
+
+                available = self.available_stock([product_id])[product_id]
+                movements += self.record({product_id: stocks[product_id] - available}, self.model.Kind.RESTOCK)
+                self.allot(product_id, stocks[product_id])
+
+        invalidate_product_responses(stocks)
+
+        return movements
+
+    def lock_shards(self, product_id: int) -> bool:
+        """
+        Lock product row and then its stock shards (waiting for orders taking stock from them), call it inside a
+        transaction. Products are locked in order of their ids, like by `StockReservationManager.reserve`.
+        :param product_id: product id
+        :return: False if the product doesn't exist
+        """
+        product_model = apps.get_model('API', 'Product')
+        shard_model = apps.get_model('API', 'StockShard')
+        # key share lock taken by foreign key checks of movements inserted concurrently mustn't wait for this one
+        no_key = connections[self.db].features.has_select_for_no_key_update
+
+        if not product_model.objects.filter(pk=product_id).select_for_update(no_key=no_key).exists():
+            return False
+
+        list(shard_model.objects.filter(product_id=product_id).order_by('number').select_for_update().values_list(
+            'pk', flat=True
+        ))
+
+        return True
+
+    def allot(self, product_id: int, available: int) -> None:
+        """
+        Split available stock above `STOCK_LEDGER_SAFETY_MARGIN` evenly between `STOCK_LEDGER_SHARDS` stock shards of
+        the product, call it after `lock_shards`
+        :param product_id: product id
+        :param available: available stock of the product, including reservations of the current transaction
+        """
+        shard_model = apps.get_model('API', 'StockShard')
+        shards = max(1, settings.STOCK_LEDGER_SHARDS)
+        quantity, remainder = divmod(max(0, available - settings.STOCK_LEDGER_SAFETY_MARGIN), shards)
+
+        shard_model.objects.filter(product_id=product_id, number__gte=shards).delete()
+        shard_model.objects.bulk_create([
+            shard_model(product_id=product_id, number=number, quantity=quantity + (number < remainder))
+            for number in range(shards)
+        ], update_conflicts=True, unique_fields=['product', 'number'], update_fields=['quantity'])
+
+    def take(self, order, quantities: Dict[int, int]) -> Dict[int, int]:
+        """
+        Reserve products by inserting movements. Stock of each product above `STOCK_LEDGER_SAFETY_MARGIN` is allotted to
+        its stock shards and an order takes its quantity from a random shard with a conditional update
+        (`quantity >= reserved quantity`), so concurrent orders of the same product mostly lock different shards and
+        never take more than was allotted. When the shard doesn't have enough stock, the product row and its shards are
+        locked, stock is checked and the rest of it is allotted to shards again. Must be called inside a transaction,
+        which is rolled back by the caller when some products are missing.
+        :param order: reserving order
+        :param quantities: reserved quantity of each product by its id
+        :return: stock available before the reservation of each product which doesn't have enough stock
+        """
+        shard_model = apps.get_model('API', 'StockShard')
+        shortages = {}
+
+        # products are reserved in order of their ids, so concurrent orders lock rows in the same order
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+
+            with transaction.atomic():
+                taken = shard_model.objects.filter(
+                    product_id=product_id, number=random.randrange(max(1, settings.STOCK_LEDGER_SHARDS)),
+                    quantity__gte=quantity
+                ).update(quantity=F('quantity') - quantity)
+                # shard row which changed while the update waited for it stays locked even if it wasn't updated, the
+                # savepoint is rolled back to unlock it before locking the product row (otherwise it could deadlock)
+                transaction.set_rollback(not taken)
+
+            if taken:
+                continue
+
+            available = self.take_locked(product_id, quantity)
+            if available is not None:
+                shortages[product_id] = available
+
+        self.record({
+            product_id: -quantity for product_id, quantity in quantities.items() if product_id not in shortages
+        }, self.model.Kind.RESERVATION, order=order)
+
+        return shortages
+
+    def take_locked(self, product_id: int, quantity: int) -> Optional[int]:
+        """
+        Take stock while the product row and its shards are locked and allot the rest of it to shards again
+        :param product_id: product id
+        :param quantity: reserved quantity
+        :return: None if the quantity was taken, available stock of the product otherwise
+        """
+        if not self.lock_shards(product_id):
+            return 0
+
+        available = self.available_stock([product_id])[product_id]
+
+        if available < quantity:
+            return available
+
+        self.allot(product_id, available - quantity)
+
+        return None
+
+    def compact(self, products_ids: Iterable[int] = None) -> int:
+        """
+        Fold not compacted movements into products stock, each product in its own short transaction. Movements
+        inserted during compaction are left for the next one.
+        :param products_ids: compacted products ids, all products with pending movements by default
+        :return: number of compacted movements
+        """
+        product_model = apps.get_model('API', 'Product')
+        pending = self.get_queryset().filter(compacted=False)
+
+        if products_ids is None:
+            products_ids = pending.values_list('product_id', flat=True).distinct()
+
+        compacted = 0
+
+        for product_id in sorted(set(products_ids)):
+            with transaction.atomic():
+                movements = list(pending.filter(product_id=product_id).select_for_update().values_list(
+                    'pk', 'quantity'
+                ))
+
+                if not movements:
+                    continue
+
+                self.get_queryset().filter(pk__in=[pk for pk, quantity in movements]).update(compacted=True)
+                product_model.objects.filter(pk=product_id).update(
+                    stock=F('stock') + sum(quantity for pk, quantity in movements)
+                )
+
+                # shards drained by orders are filled again
+                if product_model.objects.filter(pk=product_id, stock_ledger=True).exists() and \
+                        self.lock_shards(product_id):
+                    self.allot(product_id, self.available_stock([product_id])[product_id])
+
+            compacted += len(movements)
+            invalidate_product_responses([product_id])
+
+        return compacted
+
+
+class OutboxEmailManager(models.Manager):
+    def enqueue(self, messages: Iterable[Tuple[str, str, str, str]], from_email: str = None,
+                batch_size: int = 1000) -> int:
+        """
+        Queue emails in the outbox, call it in the same transaction as the change the emails inform about. Emails
+        already queued for the same recipient with the same deduplication key are skipped.
+        :param messages: (subject, body, recipient, deduplication key) of each email, ex. lazily read from a queryset
+        :param from_email: sender address, `DEFAULT_EMAIL_ADDRESS` by default
+        :param batch_size: number of emails inserted at once
+        :return: number of processed messages (including skipped duplicates)
+        """
+        from_email = from_email or settings.DEFAULT_EMAIL_ADDRESS
+        count, batch = 0, []
+
+        for subject, body, recipient, dedupe_key in messages:
+            if not recipient:
+                continue
+
+            batch.append(self.model(subject=subject, body=body, from_email=from_email, recipient=recipient,
+                                    dedupe_key=dedupe_key))
+
+            if len(batch) >= batch_size:
+                count += len(self.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+
+        if batch:
+            count += len(self.bulk_create(batch, ignore_conflicts=True))
+
+        return count
+
+    def claim(self, batch_size: int) -> List:
+        """
+        Take pending emails to send. Rows locked by other dispatchers are skipped and claimed emails are hidden from
+        them for `OUTBOX_CLAIM_TIMEOUT` seconds, so each email is sent by a single dispatcher.
+        :param batch_size: max number of claimed emails
+        :return: claimed emails
+        """
+        current_time = timezone.now()
+
+        with transaction.atomic():
+            emails = list(self.get_queryset().filter(
+                status=self.model.Status.PENDING, next_attempt_at__lte=current_time
+            ).order_by('next_attempt_at').select_for_update(skip_locked=True)[:batch_size])
+
+            self.get_queryset().filter(pk__in=[email.pk for email in emails]).update(
+                attempts=F('attempts') + 1,
+                next_attempt_at=current_time + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+            )
+
+        for email in emails:
+            email.attempts += 1
+
+        return emails
+
+    def mark_sent(self, emails_ids: Iterable[int]) -> int:
+        """
+        :param emails_ids: ids of sent emails
+        :return: number of updated emails
+        """
+        return self.get_queryset().filter(pk__in=list(emails_ids)).update(
+            status=self.model.Status.SENT, sent_at=timezone.now(), last_error=''
+        )
+
+    def retry_later(self, email, error: str) -> None:
+        """
+        Schedule next attempt of claimed email after exponentially growing delay, or give up after `OUTBOX_MAX_ATTEMPTS`
+        :param email: claimed email which couldn't be sent
+        :param error: sending error
+        """
+        if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            self.get_queryset().filter(pk=email.pk).update(status=self.model.Status.FAILED, last_error=error)
+        else:
+            self.get_queryset().filter(pk=email.pk).update(
+                next_attempt_at=timezone.now() + timedelta(
+                    seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+                ),
+                last_error=error
+            )
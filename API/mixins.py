@@ -1,5 +1,6 @@
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.conf import settings
+
+from API.roles import is_seller
 
 
 class AdminAndSellerOnlyMixin(UserPassesTestMixin):
@@ -8,6 +9,6 @@ class AdminAndSellerOnlyMixin(UserPassesTestMixin):
     def test_func(self):
         user = self.request.user
         if user.is_authenticated:
-            return user.is_superuser or user.groups.filter(name=settings.USER_SELLER_GROUP_NAME).exists()
+            return user.is_superuser or is_seller(user)
         return False
 
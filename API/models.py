@@ -1,9 +1,8 @@
-from django.core.files.base import ContentFile
+from django.core.validators import FileExtensionValidator
 from django.core.validators import MinValueValidator
 from django.core.validators import MaxValueValidator
 from django.db import models
-from django.db.models import F, QuerySet
-from django.db.models import Avg
+from django.db.models import F, Prefetch, QuerySet
 from django.utils import timezone
 from django.utils.text import gettext_lazy as _
 from django.conf import settings
@@ -14,14 +13,23 @@ from django_countries.fields import CountryField
 from mptt.models import MPTTModel, TreeForeignKey
 
 from API.managers import SoftDeleteManager
+from API.managers import ProductCategoryManager
 from API.managers import ProductManager
 from API.managers import OrderManager
+from API.managers import AddressManager
+from API.managers import StockReservationManager
+from API.managers import StockMovementManager
+from API.managers import OutboxEmailManager
+from API.managers import ProductViewManager
+from API.managers import ProductViewDailyManager
+from API.managers import ProductVisitorsSketchManager
+from API.hyperloglog import HyperLogLog
+from API.thumbnails import generate_thumbnail
+from API.thumbnails import thumbnail_pool
 
-from PIL import Image
-import os
-from io import BytesIO
 from datetime import timedelta
 from decimal import Decimal
+import hashlib
 
 
 # region Abstract Core Models
@@ -47,10 +55,16 @@ class ProductCategory(MPTTModel):
     name = models.CharField(verbose_name=_("Category name"), max_length=128)
     parent = TreeForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
 
+    objects = ProductCategoryManager()
+
     class Meta:
         db_table = 'API_product_category'
         verbose_name = 'product category'
         verbose_name_plural = 'product categories'
+        indexes = [
+            # descendants lookup by MPTT interval
+            models.Index(fields=['tree_id', 'lft', 'rght'], name='product_category_interval_idx'),
+        ]
 
     class MPTTMeta:
         order_insertion_by = ['name']
@@ -58,20 +72,53 @@ class ProductCategory(MPTTModel):
     def __str__(self):
         return self.name
 
+    @property
+    def path(self) -> list:
+        """
+        :return: breadcrumb path from root category to this one
+        """
+        return ProductCategory.objects.path(self.pk)
+
 
 class Product(models.Model):
+    class ThumbnailStatus(models.IntegerChoices):
+        PENDING = 0, _("Pending")
+        PROCESSING = 1, _("Processing")
+        READY = 2, _("Ready")
+        FAILED = 3, _("Failed")
+        NO_PHOTO = 4, _("No photo")
+
+    # seller's own product identifier used by catalog synchronisation (see `ProductManager.bulk_upsert`)
+    sku = models.CharField(verbose_name=_("SKU"), max_length=64, null=True, blank=True, default=None)
     name = models.CharField(verbose_name=_("Product name"), max_length=128)
     description = models.TextField(verbose_name=_("Product description"), blank=True, default='')
     price = models.DecimalField(verbose_name=_("Product price"), decimal_places=2, max_digits=6)   # up to 9999.99
     category = models.ForeignKey('API.ProductCategory', verbose_name=_("Product category"), null=True,
                                  on_delete=models.SET_NULL)
-    photo = models.ImageField(verbose_name=_("Product photo"), upload_to='photos')
+    photo = models.ImageField(verbose_name=_("Product photo"), upload_to='photos',
+                              validators=[FileExtensionValidator(['jpg', 'jpeg', 'png'])])
+    # imported photo url, downloaded in background by `API.thumbnails.generate_thumbnail` while `photo` is empty
+    photo_url = models.URLField(verbose_name=_("Photo url"), blank=True, default='')
     thumbnail = models.ImageField(verbose_name=_("Product thumbnail"), upload_to='thumbnails', blank=True, default=None)
+    # hash of photo content calculated with thumbnail, names photo derivatives (see `API.thumbnails.derivative_urls`)
+    photo_hash = models.CharField(verbose_name=_("Photo hash"), max_length=32, blank=True, default='', editable=False)
+    thumbnail_status = models.PositiveSmallIntegerField(verbose_name=_("Thumbnail status"),
+                                                        choices=ThumbnailStatus.choices,
+                                                        default=ThumbnailStatus.PENDING, editable=False)
     seller = models.ForeignKey(User, verbose_name=_("Product seller"), null=True, on_delete=models.CASCADE)
     stock = models.PositiveIntegerField(verbose_name=_("Stock"), default=0)
+    # stock of hot products is changed by inserting stock movements folded into `stock` later (see `StockMovement`)
+    stock_ledger = models.BooleanField(verbose_name=_("Use stock ledger"), default=False)
+    # denormalized counters, kept up to date by `API.signals` and repaired by `rebuild_product_counters` command
+    rating_sum = models.FloatField(verbose_name=_("Ratings sum"), blank=True, default=0.0, editable=False)
+    rating_count = models.PositiveIntegerField(verbose_name=_("Ratings count"), blank=True, default=0, editable=False)
+    views_count = models.PositiveIntegerField(verbose_name=_("Views count"), blank=True, default=0, editable=False)
 
     objects = ProductManager()
 
+    COUNTER_FIELDS = ('rating_sum', 'rating_count', 'views_count')
+    THUMBNAIL_FIELDS = ('thumbnail', 'photo_hash', 'thumbnail_status')
+
     def __str__(self):
         return self.name
 
@@ -79,48 +126,94 @@ class Product(models.Model):
         db_table = 'API_product'
         verbose_name = 'product'
         verbose_name_plural = 'products'
+        indexes = [
+            # support keyset pagination of products ordered with `ProductFilter.order`
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ]
+        constraints = [
+            # products without sku (null) don't conflict
+            models.UniqueConstraint(fields=['seller', 'sku'], name='product_seller_sku_unique'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        if 'photo' in field_names:
+            instance._loaded_photo_name = values[field_names.index('photo')]
+        if 'stock_ledger' in field_names:
+            instance._loaded_stock_ledger = values[field_names.index('stock_ledger')]
+
+        return instance
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        self.create_thumbnail()
+        photo_changed = self.photo_changed()
+
+        if photo_changed:
+            self.photo_hash = ''
+            self.thumbnail_status = self.ThumbnailStatus.PENDING if self.photo or self.photo_url else \
+                self.ThumbnailStatus.NO_PHOTO
+
+        if update_fields is None and not force_insert and not self._state.adding:
+            # never overwrite counters updated in the meantime by ratings or views with stale values, thumbnail is
+            # written by the thumbnails worker and changes only together with the photo (unchanged photo isn't written
+            # either, it may have been downloaded in the meantime from imported `photo_url`), stock of products with
+            # stock ledger is changed only by compaction of stock movements (see `StockMovementManager.restock`)
+            excluded_fields = self.COUNTER_FIELDS if photo_changed else \
+                self.COUNTER_FIELDS + self.THUMBNAIL_FIELDS + ('photo',)
+
+            if self.stock_ledger:
+                excluded_fields += ('stock',)
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded_fields
+            ]
 
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
-    def create_thumbnail(self):
-        """
-        Create a thumbnail image from provided `photo` file
-        """
+        if photo_changed:
+            self._loaded_photo_name = self.photo.name
 
-        thumbnail_name, thumbnail_extension = os.path.splitext(self.photo.name)
-        thumbnail_extension = thumbnail_extension.lower()
-        thumb_filename = thumbnail_name + '_thumbnail' + thumbnail_extension
+            if self.thumbnail_status == self.ThumbnailStatus.PENDING:
+                thumbnail_pool.schedule(self.pk)
 
-        if self.thumbnail.name != thumb_filename:
-            thumbnail = Image.open(self.photo)
-            thumbnail.thumbnail(settings.THUMBNAIL_SIZE, Image.ANTIALIAS)
+        if getattr(self, '_loaded_stock_ledger', False) and not self.stock_ledger:
+            # stock set aside for reservations with the ledger could be stale once it's enabled again
+            StockShard.objects.filter(product=self).delete()
+        self._loaded_stock_ledger = self.stock_ledger
 
-            if thumbnail_extension in ['.jpg', '.jpeg']:
-                file_type = 'JPEG'
-            elif thumbnail_extension == '.png':
-                file_type = 'PNG'
-            else:
-                raise ValueError("Wrong product photo image! Accepted extensions are: jpg, jpeg or png!")
+    def photo_changed(self) -> bool:
+        """
+        :return: True if product is new or its photo was replaced since it was loaded from db
+        """
+        if self._state.adding:
+            return True
+        if 'photo' in self.get_deferred_fields():
+            return False
 
-            temp_thumbnail = BytesIO()
-            thumbnail.save(temp_thumbnail, file_type)
-            temp_thumbnail.seek(0)
+        return self.photo.name != getattr(self, '_loaded_photo_name', self.photo.name)
 
-            self.thumbnail.save(thumb_filename, ContentFile(temp_thumbnail.read()), save=False)
-            temp_thumbnail.close()
+    def create_thumbnail(self) -> bool:
+        """
+        Create a thumbnail image from saved `photo` file synchronously (thumbnails of saved products are created in
+        background by `API.thumbnails.thumbnail_pool`)
+        :return: True if thumbnail was created
+        """
+        created = generate_thumbnail(self.pk)
+        self.refresh_from_db(fields=self.THUMBNAIL_FIELDS)
+
+        return created
 
     @property
     def ratings(self) -> float:
-        if self.productrating_set.exists():
-            return self.productrating_set.aggregate(ratings=Avg('rating'))['ratings']
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0.0
 
     @property
     def views(self) -> int:
-        return self.productview_set.count()
+        return self.views_count
 
 
 class ProductRating(models.Model):
@@ -136,6 +229,9 @@ class ProductRating(models.Model):
         db_table = 'API_product_rating'
         verbose_name = 'product rating'
         verbose_name_plural = 'product ratings'
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='product_rating_created_at_idx'),
+        ]
 
 
 class ProductView(models.Model):
@@ -143,10 +239,78 @@ class ProductView(models.Model):
     ip = models.GenericIPAddressField(verbose_name=_('IP Address'))
     created_at = models.DateTimeField(verbose_name=_("Created at"), auto_now_add=True)
 
+    objects = ProductViewManager()
+
     class Meta:
         db_table = 'API_product_views'
         verbose_name = 'product view'
         verbose_name_plural = 'product views'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'ip'], name='unique_product_view_ip'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='product_views_created_at_idx'),
+        ]
+
+
+class ProductViewDaily(models.Model):
+    """
+    Daily rollup of :model:`API.ProductView` rows, created by `RollupProductViews` daily job. Raw views are unique per
+    (product, ip), so views are unique visitors as well, unique visitors of a day including returning ones are estimated
+    by :model:`API.ProductVisitorsSketch`
+    """
+    product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
+    day = models.DateField(verbose_name=_("Day"))
+    views = models.PositiveIntegerField(verbose_name=_("Views"), default=0)
+
+    objects = ProductViewDailyManager()
+
+    class Meta:
+        db_table = 'API_product_views_daily'
+        verbose_name = 'product daily views'
+        verbose_name_plural = 'product daily views'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_views_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='product_views_daily_day_idx'),
+        ]
+
+
+class ProductVisitorsSketch(models.Model):
+    """
+    HyperLogLog sketch of product unique visitors in a single day, week or month bucket
+    """
+    class Period(models.IntegerChoices):
+        DAY = 0, _('Day')
+        WEEK = 1, _('Week')
+        MONTH = 2, _('Month')
+
+    product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
+    period = models.PositiveSmallIntegerField(_("Period"), choices=Period.choices, default=Period.DAY)
+    bucket_start = models.DateField(verbose_name=_("Bucket start"))
+    registers = models.BinaryField(verbose_name=_("HyperLogLog registers"))
+
+    objects = ProductVisitorsSketchManager()
+
+    class Meta:
+        db_table = 'API_product_visitors_sketch'
+        verbose_name = 'product visitors sketch'
+        verbose_name_plural = 'product visitors sketches'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'period', 'bucket_start'], name='unique_product_visitors_bucket'),
+        ]
+
+    @property
+    def sketch(self) -> HyperLogLog:
+        return HyperLogLog.from_bytes(self.registers)
+
+    @property
+    def unique_visitors(self) -> int:
+        """
+        :return: estimated number of unique visitors in this bucket
+        """
+        return self.sketch.count()
 # endregion
 
 
@@ -182,6 +346,12 @@ class Address(models.Model):
     post_code = models.CharField(_("Postal code"), max_length=8)
     state = models.PositiveSmallIntegerField(_("Polish voivodeship"), choices=PolishStates.choices, blank=True,
                                              default=PolishStates.NONE)
+    # hash of normalized address fields, the same address is stored only once (see `AddressManager`), empty for
+    # addresses created before it was added until `dedupe_addresses` command fills it
+    fingerprint = models.CharField(_("Fingerprint"), max_length=64, unique=True, null=True, blank=True, default=None,
+                                   editable=False)
+
+    objects = AddressManager()
 
     class Meta:
         db_table = "API_address"
@@ -203,9 +373,36 @@ class Address(models.Model):
     def full_address(self):
         return self.__str__()
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+    @staticmethod
+    def make_fingerprint(country, city: str, street: str, street_number: str, street_number_local: str = "",
+                         post_code: str = "", state: int = PolishStates.NONE) -> str:
+        """
+        :return: hash of address fields normalized so that differences in letter case, whitespace and postal code
+        format don't make different addresses
+        """
+        def normalize(value) -> str:
+            return " ".join(str(value).split()).casefold()
+
+        return hashlib.sha256("\x1f".join((
+            normalize(country), normalize(city), normalize(street), normalize(street_number),
+            normalize(street_number_local), "".join(str(post_code).split()).replace("-", "").casefold(), str(int(state))
+        )).encode()).hexdigest()
+
+    def update_fingerprint(self) -> str:
+        """
+        Clear voivodeship of addresses outside Poland and set fingerprint of current address fields
+        :return: fingerprint
+        """
         if self.country != "PL" and self.state != Address.PolishStates.NONE:
             self.state = Address.PolishStates.NONE
+        self.fingerprint = self.make_fingerprint(self.country, self.city, self.street, self.street_number,
+                                                 self.street_number_local, self.post_code, self.state)
+        return self.fingerprint
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.update_fingerprint()
+        if update_fields is not None:
+            update_fields = {*update_fields, 'fingerprint'}
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
 
@@ -300,6 +497,8 @@ class Order(SoftDeleteModel):
                                               default=OrderStatus.PENDING)
     discount = models.DecimalField(verbose_name=_('Order discount'), blank=True, null=True, decimal_places=2,
                                    max_digits=3, default=0.0)
+    # validator of conditional requests, set it explicitly in queryset `update` and `bulk_update` calls
+    updated_at = models.DateTimeField(verbose_name=_("Last update"), auto_now=True)
 
     objects = OrderManager()
 
@@ -309,11 +508,28 @@ class Order(SoftDeleteModel):
     @property
     def products_list(self) -> QuerySet:
         """
-        :return: :model:`Common.Product` list associated with this order
+        :return: :model:`Common.Product` list associated with this order, prefetched one if the order was fetched with
+        `products_list_prefetch`
         """
+        if 'orderproductlistitem_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.orderproductlistitem_set.all()
+
         return OrderProductListItem.objects.select_related('product', 'product__category').filter(
             order=self
-        ).only('product', 'quantity')
+        ).order_by('pk')
+
+    @staticmethod
+    def products_list_prefetch(with_products: bool = True) -> Prefetch:
+        """
+        :param with_products: whether products (and their categories) of order lines are fetched too
+        :return: prefetch of orders `products_list` fetching lists of all orders with a single query
+        """
+        queryset = OrderProductListItem.objects.order_by('pk')
+
+        if with_products:
+            queryset = queryset.select_related('product', 'product__category')
+
+        return Prefetch('orderproductlistitem_set', queryset=queryset)
 
     @property
     def has_discount(self) -> bool:
@@ -342,8 +558,8 @@ class Order(SoftDeleteModel):
         if not self.payment_deadline:
             self.payment_deadline = self.order_date + timedelta(days=settings.PAYMENT_DEADLINE_DAYS)
         if update_full_price and not self.full_price and self.products_list.exists():
-            self.full_price = self.products_list.aggregate(
-                full_price=models.Sum(F('product__price') * F('quantity'), output_field=models.DecimalField())
+            self.full_price = OrderProductListItem.objects.filter(order=self).aggregate(
+                full_price=models.Sum('line_total')
             )['full_price']
 
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
@@ -358,9 +574,98 @@ class OrderProductListItem(models.Model):
     product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name=_("Quantity"), blank=True, default=1,
                                            validators=[MinValueValidator(1)])
+    # product price at checkout, statistics don't change when seller changes the price later (empty for lines created
+    # before it was added until `backfill_order_prices` command fills it)
+    unit_price = models.DecimalField(verbose_name=_("Unit price"), decimal_places=2, max_digits=6, null=True,
+                                     blank=True)
+    line_total = models.DecimalField(verbose_name=_("Line total"), decimal_places=2, max_digits=20, null=True,
+                                     blank=True)
+    # product seller at checkout, seller orders and sales statistics don't join products
+    seller = models.ForeignKey(User, verbose_name=_("Seller"), null=True, blank=True, on_delete=models.SET_NULL,
+                               related_name='sold_order_lines', db_index=False)
 
     class Meta:
         db_table = "API_order_product_list_item"
+        indexes = [
+            models.Index(fields=['seller', 'order'], name='order_line_seller_order_idx'),
+        ]
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if self.unit_price is None or self.seller_id is None:
+            price, seller_id = Product.objects.filter(pk=self.product_id).values_list(
+                'price', 'seller_id'
+            ).first() or (None, None)
+            self.unit_price = price if self.unit_price is None else self.unit_price
+            self.seller_id = seller_id if self.seller_id is None else self.seller_id
+        if self.unit_price is not None:
+            self.line_total = self.unit_price * self.quantity
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+
+
+class StockReservation(models.Model):
+    """
+    Products taken from stock by an order. Reservations of not paid orders expire at order payment deadline and their
+    products are returned to stock by `ExpireUnpaidOrders` job, reservations of paid orders never expire.
+    """
+    order = models.ForeignKey('API.Order', verbose_name=_("Order"), on_delete=models.CASCADE)
+    product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name=_("Quantity"), validators=[MinValueValidator(1)])
+    created_at = models.DateTimeField(verbose_name=_("Created at"), auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name=_("Expires at"), null=True, blank=True)
+    released_at = models.DateTimeField(verbose_name=_("Released at"), null=True, blank=True)
+
+    objects = StockReservationManager()
+
+    class Meta:
+        db_table = "API_stock_reservation"
+        indexes = [
+            models.Index(fields=['expires_at'], name='stock_reservation_expires_idx',
+                         condition=models.Q(released_at__isnull=True)),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    Append-only stock change of a product with `stock_ledger` enabled. Concurrent orders of the same product insert
+    movements in parallel instead of waiting for the product row lock, available stock is product `stock` plus
+    quantities of not compacted movements. `CompactStockLedger` job folds movements into product `stock`.
+    """
+    class Kind(models.IntegerChoices):
+        RESERVATION = 0, _('Reservation')
+        RELEASE = 1, _('Release')
+        RESTOCK = 2, _('Restock')
+
+    product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
+    order = models.ForeignKey('API.Order', verbose_name=_("Order"), null=True, blank=True, on_delete=models.SET_NULL)
+    kind = models.PositiveSmallIntegerField(_("Kind"), choices=Kind.choices)
+    # negative for products taken from stock
+    quantity = models.IntegerField(verbose_name=_("Quantity"))
+    created_at = models.DateTimeField(verbose_name=_("Created at"), auto_now_add=True)
+    compacted = models.BooleanField(verbose_name=_("Folded into product stock"), default=False)
+
+    objects = StockMovementManager()
+
+    class Meta:
+        db_table = "API_stock_movement"
+        indexes = [
+            models.Index(fields=['product'], name='stock_movement_pending_idx', condition=models.Q(compacted=False)),
+        ]
+
+
+class StockShard(models.Model):
+    """
+    Part of available stock of a product with `stock_ledger` enabled set aside for reservations, concurrent orders take
+    it from different shards of the product, so they don't wait for each other (see `StockMovementManager.take`)
+    """
+    product = models.ForeignKey('API.Product', verbose_name=_("Product"), on_delete=models.CASCADE)
+    number = models.PositiveSmallIntegerField(verbose_name=_("Number"))
+    quantity = models.PositiveIntegerField(verbose_name=_("Quantity"), default=0)
+
+    class Meta:
+        db_table = "API_stock_shard"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'number'], name='stock_shard_product_number_unique'),
+        ]
 
 
 class DiscountCoupon(models.Model):
@@ -394,3 +699,44 @@ class DiscountCoupon(models.Model):
 
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 # endregion
+
+
+# region Emails
+class OutboxEmail(models.Model):
+    """
+    Email waiting in the outbox, saved in the same transaction as the change it informs about and sent later in
+    batches by `API.outbox.dispatch`. The same email (`dedupe_key`) is queued for a recipient only once.
+    """
+    class Status(models.IntegerChoices):
+        PENDING = 0, _('Pending')
+        SENT = 1, _('Sent')
+        FAILED = 2, _('Failed')
+
+    subject = models.CharField(verbose_name=_("Subject"), max_length=255)
+    body = models.TextField(verbose_name=_("Body"))
+    from_email = models.CharField(verbose_name=_("From"), max_length=254)
+    recipient = models.EmailField(verbose_name=_("Recipient"))
+    # ex. 'order-expired:<order id>'
+    dedupe_key = models.CharField(verbose_name=_("Deduplication key"), max_length=128)
+    status = models.PositiveSmallIntegerField(_("Status"), choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name=_("Attempts"), default=0)
+    # pending email is sent after this time, claimed ones are hidden from other dispatchers until it passes
+    next_attempt_at = models.DateTimeField(verbose_name=_("Next attempt at"), default=timezone.now)
+    last_error = models.TextField(verbose_name=_("Last error"), blank=True, default='')
+    created_at = models.DateTimeField(verbose_name=_("Created at"), auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name=_("Sent at"), null=True, blank=True)
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        db_table = "API_outbox_email"
+        verbose_name = 'outbox email'
+        verbose_name_plural = 'outbox emails'
+        constraints = [
+            models.UniqueConstraint(fields=['dedupe_key', 'recipient'], name='unique_outbox_email_recipient'),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='outbox_email_pending_idx',
+                         condition=models.Q(status=0)),
+        ]
+# endregion
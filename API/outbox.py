@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail import get_connection
+
+from API.models import OutboxEmail
+
+from typing import Tuple
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(batch_size: int = None, max_batches: int = None) -> Tuple[int, int]:
+    """
+    Send pending outbox emails in batches over a single reused mail backend connection (ex. one SMTP session for the
+    whole run), emails which couldn't be sent are retried later (see `OutboxEmailManager.retry_later`).
+    :param batch_size: number of emails claimed at once, `OUTBOX_BATCH_SIZE` by default
+    :param max_batches: max number of sent batches, all pending emails by default
+    :return: number of sent and not sent emails
+    """
+    batch_size = max(1, settings.OUTBOX_BATCH_SIZE if batch_size is None else batch_size)
+    sent, failed, batches = 0, 0, 0
+    connection = None
+
+    try:
+        while max_batches is None or batches < max_batches:
+            emails = OutboxEmail.objects.claim(batch_size)
+            if not emails:
+                break
+
+            batches += 1
+            delivered = []
+
+            for email in emails:
+                try:
+                    if connection is None:
+                        connection = get_connection()
+                        connection.open()
+
+                    connection.send_messages([EmailMessage(
+                        email.subject, email.body, email.from_email, [email.recipient], connection=connection
+                    )])
+                    delivered.append(email.pk)
+                except Exception as exc:
+                    logger.warning("Sending outbox email %s failed: %s", email.pk, exc)
+                    OutboxEmail.objects.retry_later(email, str(exc))
+                    failed += 1
+
+                    # connection may be broken, open a new one for next email
+                    if connection is not None:
+                        try:
+                            connection.close()
+                        except Exception:
+                            pass
+                        connection = None
+
+            OutboxEmail.objects.mark_sent(delivered)
+            sent += len(delivered)
+    finally:
+        if connection is not None:
+            connection.close()
+
+    return sent, failed
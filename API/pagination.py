@@ -0,0 +1,82 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.pagination import PageNumberPagination
+
+
+class QuerysetOrderingCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination using ordering of the paginated queryset (ex. set by view or `ProductFilter.order`).
+
+    Only orderings by indexed fields listed in `ordering_fields` are allowed, so every page costs the same single indexed
+    range query no matter how deep it is. Cursors are opaque and stable, no `COUNT(*)` query is made.
+    """
+    ordering = '-pk'
+    ordering_fields = ('pk', 'id', 'created_at', 'order_date', 'name', 'price')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(str(field) for field in queryset.query.order_by)
+
+        if not ordering:
+            return super().get_ordering(request, queryset, view)
+        if ordering[0].lstrip('-') not in self.ordering_fields:
+            raise ValidationError({
+                self.cursor_query_param: f"Cursor pagination doesn't support ordering by '{ordering[0]}'. Use page "
+                                         f"number pagination instead."
+            })
+
+        return ordering
+
+
+class PageNumberOrCursorPagination(PageNumberPagination):
+    """
+    Page number pagination (default, for existing clients) switching to keyset pagination when `pagination=cursor`
+    or `cursor` query parameter is provided
+    """
+    pagination_query_param = 'pagination'
+    cursor_pagination_class = QuerysetOrderingCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def use_cursor(self, request) -> bool:
+        return request.query_params.get(self.pagination_query_param, None) == 'cursor' or \
+            self.cursor_pagination_class.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            page = self.cursor_paginator.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.cursor_paginator.display_page_controls
+
+            return page
+
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.pagination_query_param,
+                'required': False,
+                'in': 'query',
+                'description': "Set to 'cursor' to use keyset pagination (without total count)",
+                'schema': {'type': 'string', 'enum': ['page', 'cursor']},
+            },
+            {
+                'name': self.cursor_pagination_class.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': self.cursor_pagination_class.cursor_query_description,
+                'schema': {'type': 'string'},
+            },
+        ]
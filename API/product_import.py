@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import transaction
+
+from rest_framework.exceptions import ParseError
+from rest_framework.exceptions import ValidationError
+
+from API.models import Product
+from API.models import ProductCategory
+from API.serializers import ProductImportSerializer
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+CREATED = 'created'
+UPDATED = 'updated'
+FAILED = 'failed'
+
+
+def import_products(seller, rows: Iterable, batch_size: int = None) -> Dict:
+    """
+    Synchronise seller catalog with imported products rows (ex. parsed lazily from NDJSON or CSV request body). Rows are
+    validated and upserted by seller's `sku` in batches (each batch in its own transaction), so a single broken row
+    doesn't stop the import and memory use doesn't grow with catalog size. Imported rows replace products data, photos
+    are downloaded in background. Malformed stream (ex. broken CSV quoting) stops the import at the row which couldn't
+    be read, rows before it stay imported and are reported as usual.
+    :param seller: user with 'seller' role owning imported products
+    :param rows: products fields (see :class:`API.serializers.ProductImportSerializer`) or :class:`ParseError` of
+    malformed rows, iterating them raises :class:`ParseError` if the rest of the stream can't be read
+    :param batch_size: number of rows validated and saved together
+    :return: number of created, updated and failed products and result of each row
+    """
+    batch_size = max(1, settings.PRODUCT_IMPORT_BATCH_SIZE if batch_size is None else batch_size)
+    serializer = ProductImportSerializer()
+    results, batch, rows_by_sku = [], [], {}
+
+    for number, row in enumerate(read_rows(rows), start=1):
+        result = {'row': number}
+        results.append(result)
+
+        if isinstance(row, ParseError):
+            result.update(status=FAILED, errors={'non_field_errors': [row.detail]})
+            continue
+        if not isinstance(row, dict):
+            result.update(status=FAILED, errors={'non_field_errors': ["Expected an object with product fields!"]})
+            continue
+
+        result['sku'] = row.get('sku', None)
+
+        try:
+            # a single serializer instance is reused, so its fields are built once for the whole import
+            data = serializer.run_validation(row)
+        except ValidationError as exc:
+            result.update(status=FAILED, errors=exc.detail)
+            continue
+
+        if data['sku'] in rows_by_sku:
+            result.update(status=FAILED, errors={'sku': [f"SKU repeated, first used in row {rows_by_sku[data['sku']]}!"]})
+            continue
+
+        rows_by_sku[data['sku']] = number
+        batch.append((result, data))
+
+        if len(batch) >= batch_size:
+            upsert_batch(seller, batch)
+            batch = []
+
+    if batch:
+        upsert_batch(seller, batch)
+
+    return {
+        CREATED: sum(result['status'] == CREATED for result in results),
+        UPDATED: sum(result['status'] == UPDATED for result in results),
+        FAILED: sum(result['status'] == FAILED for result in results),
+        'results': results,
+    }
+
+
+def read_rows(rows: Iterable) -> Iterator:
+    """
+    :param rows: products rows of :func:`import_products`
+    :return: rows ending with :class:`ParseError` which stopped their iteration (if any)
+    """
+    try:
+        yield from rows
+    except ParseError as exc:
+        yield ParseError(f"{exc.detail} Following rows weren't imported!")
+
+
+def upsert_batch(seller, batch: List[Tuple[Dict, Dict]]) -> None:
+    """
+    :param seller: user with 'seller' role owning imported products
+    :param batch: results of validated rows (updated in place) with their validated data
+    """
+    categories_ids = {data['category_id'] for result, data in batch if data.get('category_id', None) is not None}
+    existing_categories = set(ProductCategory.objects.filter(pk__in=categories_ids).values_list('pk', flat=True))
+    products = []
+
+    for result, data in batch:
+        category_id = data.get('category_id', None)
+
+        if category_id is not None and category_id not in existing_categories:
+            result.update(status=FAILED,
+                          errors={'category': [f'Invalid pk "{category_id}" - object does not exist.']})
+        else:
+            products.append((result, data))
+
+    if not products:
+        return
+
+    with transaction.atomic():
+        saved = Product.objects.bulk_upsert(seller, [data for result, data in products])
+
+    for result, data in products:
+        pk, created = saved[data['sku']]
+        result.update(id=pk, status=CREATED if created else UPDATED)
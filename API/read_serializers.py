@@ -0,0 +1,303 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import QuerySet
+
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class CompileError(Exception):
+    """
+    Serializer uses fields which can't be read from `.values()` rows
+    """
+    pass
+
+
+@lru_cache(maxsize=None)
+def row_class(model) -> type:
+    """
+    :param model: model class
+    :return: class with model properties, methods and fields descriptors but without model machinery, its instances are
+    created straight from `.values()` rows, so model properties can be evaluated without instantiating models
+    """
+    attrs = {}
+
+    for klass in reversed(model.__mro__):
+        if klass is not object:
+            attrs.update(vars(klass))
+
+    for name in ('__init__', '__dict__', '__weakref__', '__init_subclass__', '__class_getitem__'):
+        attrs.pop(name, None)
+
+    return type(f'{model.__name__}Row', (), attrs)
+
+
+class CompiledReadSerializer:
+    """
+    Read-only representation of a model serializer compiled to per-field accessors of `.values()` rows.
+
+    Output is the same as the output of the serializer (fields values are converted by the same serializer fields):
+    - model fields and annotations are read from row columns,
+    - nested model serializers of foreign keys are compiled recursively (with joined columns),
+    - nested serializers defining `to_representation_from_pk` are called with the foreign key value,
+    - properties and method fields are evaluated on lightweight row objects (see `row_class`) with columns listed in
+      serializer `Meta.fields_sources`, method fields with `<method>_batch` serializer method are computed once for all
+      rows (ex. with a single query instead of one per row).
+    """
+    def __init__(self, serializer: serializers.ModelSerializer, queryset: QuerySet, extra_columns: Iterable[str] = ()):
+        """
+        :param serializer: unbound serializer instance (with context)
+        :param queryset: serialized queryset
+        :param extra_columns: additional columns included in the rows, ex. used by pagination
+        """
+        self.serializer = serializer
+        self.annotations = set(queryset.query.annotations) | set(queryset.query.extra_select)
+        self.columns = []
+        self.batches = []
+        self.plan = self.compile(serializer, queryset.model, prefix='')
+
+        for column in extra_columns:
+            self.add_column(column)
+
+    def add_column(self, column: str) -> str:
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def compile(self, serializer: serializers.ModelSerializer, model, prefix: str) -> List[Tuple[str, Callable]]:
+        """
+        :param serializer: compiled serializer
+        :param model: serialized model
+        :param prefix: lookup of nested serializer columns
+        :return: list of (field name, function returning field value from a row)
+        """
+        if not isinstance(serializer, serializers.ModelSerializer):
+            raise CompileError(f"{serializer.__class__.__name__} is not a model serializer")
+
+        fields_sources = getattr(serializer.Meta, 'fields_sources', {})
+        pk_column = self.add_column(prefix + model._meta.pk.attname)
+        row_columns = {pk_column}
+        plan = []
+
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+
+            if isinstance(field, serializers.SerializerMethodField):
+                method = getattr(serializer, field.method_name)
+                batch = getattr(serializer, f'{field.method_name}_batch', None)
+                sources = fields_sources.get(field.field_name, None)
+
+                if batch is not None and not prefix:
+                    self.batches.append((field.field_name, batch))
+                    plan.append((field.field_name, None))
+                elif sources is not None:
+                    row_columns.update(self.add_column(prefix + column) for column in sources)
+                    plan.append((field.field_name, self.property_getter(model, prefix, row_columns, method)))
+                else:
+                    raise CompileError(f"Sources of method field {field.field_name} are unknown")
+                continue
+
+            source = field.source
+            if source == '*' or '.' in source or isinstance(field, (serializers.ListSerializer,
+                                                                     serializers.ManyRelatedField)):
+                raise CompileError(f"Field {field.field_name} can't be read from a single row")
+
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                model_field = None
+
+            if isinstance(field, serializers.BaseSerializer):
+                if model_field is None or not model_field.many_to_one:
+                    raise CompileError(f"Nested serializer {field.field_name} is not a foreign key")
+
+                fk_column = self.add_column(prefix + model_field.attname)
+
+                if hasattr(field, 'to_representation_from_pk'):
+                    plan.append((field.field_name, self.value_getter(fk_column, field.to_representation_from_pk)))
+                else:
+                    nested_plan = self.compile(field, model_field.related_model, prefix + source + '__')
+                    plan.append((field.field_name, self.nested_getter(fk_column, nested_plan)))
+
+            elif model_field is not None and model_field.concrete:
+                if model_field.is_relation:
+                    if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.pk_field is not None:
+                        raise CompileError(f"Relation {field.field_name} is not rendered as primary key")
+                    plan.append((field.field_name, self.column_getter(self.add_column(prefix + model_field.attname))))
+                elif isinstance(field, serializers.FileField):
+                    column = self.add_column(prefix + model_field.attname)
+                    plan.append((field.field_name, self.file_getter(column, field, model_field.storage)))
+                else:
+                    column = self.add_column(prefix + model_field.attname)
+                    row_columns.add(column)
+                    plan.append((field.field_name, self.value_getter(column, field.to_representation)))
+
+            elif source in self.annotations and not prefix:
+                plan.append((field.field_name, self.value_getter(self.add_column(source), field.to_representation)))
+
+            elif source in fields_sources:
+                row_columns.update(self.add_column(prefix + column) for column in fields_sources[source])
+                plan.append((field.field_name, self.property_getter(
+                    model, prefix, row_columns, lambda obj, source=source, field=field: self.represent(
+                        field, getattr(obj, source)
+                    )
+                )))
+
+            else:
+                raise CompileError(f"Field {field.field_name} can't be read from values")
+
+        return plan
+
+    @staticmethod
+    def represent(field: serializers.Field, value):
+        return None if value is None else field.to_representation(value)
+
+    @staticmethod
+    def column_getter(column: str) -> Callable:
+        return lambda row: row[column]
+
+    @staticmethod
+    def value_getter(column: str, to_representation: Callable) -> Callable:
+        def get_value(row):
+            value = row[column]
+            return None if value is None else to_representation(value)
+
+        return get_value
+
+    @staticmethod
+    def nested_getter(fk_column: str, nested_plan: List[Tuple[str, Callable]]) -> Callable:
+        def get_value(row):
+            if row[fk_column] is None:
+                return None
+            return {name: getter(row) for name, getter in nested_plan}
+
+        return get_value
+
+    @staticmethod
+    def file_getter(column: str, field: serializers.FileField, storage) -> Callable:
+        # the same as `FileField.to_representation` for the file name stored in the column
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        request = field.context.get('request', None)
+
+        def get_value(row):
+            name = row[column]
+
+            if not name:
+                return None
+            if not use_url:
+                return name
+
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return get_value
+
+    def property_getter(self, model, prefix: str, row_columns: set, function: Callable) -> Callable:
+        klass = row_class(model)
+        # columns are resolved when the row object is built, so sources of all fields of the serializer are included
+        attributes = []
+
+        def get_value(row):
+            if not attributes:
+                attributes.extend((column[len(prefix):], column) for column in row_columns)
+
+            obj = klass.__new__(klass)
+            obj.__dict__.update((attribute, row[column]) for attribute, column in attributes)
+
+            return function(obj)
+
+        return get_value
+
+    def values(self, queryset: QuerySet) -> QuerySet:
+        """
+        :param queryset: serialized queryset
+        :return: queryset of rows with all compiled columns
+        """
+        return queryset.values(*self.columns)
+
+    def serialize(self, rows: Iterable[Dict]) -> List[Dict]:
+        """
+        :param rows: rows of `values` queryset (ex. paginated)
+        :return: serialized data
+        """
+        rows = list(rows)
+        data = [{name: getter(row) if getter is not None else None for name, getter in self.plan} for row in rows]
+
+        if self.batches and rows:
+            klass = row_class(self.serializer.Meta.model)
+            pk_column = self.serializer.Meta.model._meta.pk.attname
+            objects = []
+
+            for row in rows:
+                obj = klass.__new__(klass)
+                obj.__dict__[pk_column] = row[pk_column]
+                objects.append(obj)
+
+            for name, batch in self.batches:
+                for item, value in zip(data, batch(objects)):
+                    item[name] = value
+
+        return data
+
+
+def ordering_columns(queryset: QuerySet) -> List[str]:
+    """
+    :param queryset: ordered queryset
+    :return: columns used by queryset ordering which have to be included in rows (ex. by cursor pagination)
+    """
+    opts = queryset.model._meta
+    names = set(queryset.query.annotations) | set(queryset.query.extra_select)
+    columns = []
+
+    for ordering in queryset.query.order_by or opts.ordering:
+        name = str(ordering).lstrip('-')
+
+        if name == 'pk' or name in names:
+            columns.append(name)
+        else:
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if isinstance(field, models.Field) and field.concrete:
+                columns.append(field.attname)
+
+    return columns
+
+
+def compile_serializer(serializer: serializers.ModelSerializer, queryset: QuerySet) -> Optional[CompiledReadSerializer]:
+    """
+    :param serializer: unbound serializer instance
+    :param queryset: serialized queryset
+    :return: compiled serializer or None if it can't be compiled
+    """
+    try:
+        return CompiledReadSerializer(serializer, queryset, ordering_columns(queryset))
+    except CompileError:
+        return None
+
+
+class CompiledListMixin:
+    """
+    ViewSet mixin serializing `list` responses with :class:`CompiledReadSerializer` (falls back to the serializer if
+    it can't be compiled)
+    """
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = compile_serializer(self.get_serializer(), queryset)
+
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = compiled.values(queryset)
+        page = self.paginate_queryset(rows)
+
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+
+        return Response(compiled.serialize(rows))
@@ -0,0 +1,147 @@
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+import csv
+import msgpack
+import orjson
+
+
+# types without native orjson / msgpack support (ex. Decimal, lazy translations, querysets) are converted the same way
+# as by the default `JSONRenderer`
+_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement of `JSONRenderer` using orjson. Output is the same as the output of `JSONRenderer` with compact
+    and unicode settings, but datetimes, dates, dicts and lists are encoded natively in C, `Decimal` values which
+    weren't coerced to strings by serializers are rendered as numbers (like `JSONRenderer` does).
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def get_indent(self, accepted_media_type, renderer_context) -> bool:
+        if accepted_media_type:
+            # only 2 spaces indentation is supported by orjson
+            params = dict(param.strip().split('=', 1) for param in accepted_media_type.split(';')[1:] if '=' in param)
+            if params.get('indent', '').strip().isdigit():
+                return int(params['indent']) > 0
+
+        return bool(renderer_context.get('indent', None))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+
+        ret = orjson.dumps(data, default=_encoder.default, option=options)
+
+        # the same as `JSONRenderer`, escape characters which are not allowed in javascript strings
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(BaseParser):
+    """
+    Drop-in replacement of `JSONParser` using orjson
+    """
+    media_type = 'application/json'
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+
+            return orjson.loads(data)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack renderer for internal services (`Accept: application/msgpack` or `?format=msgpack`). Data is the same as
+    in JSON responses, values without MessagePack type (ex. dates or decimals) are converted like in JSON responses.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True, datetime=False)
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parser of MessagePack requests sent by internal services
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parser of newline delimited JSON (ex. bulk imports), objects are parsed lazily while the request body is read, so
+    the whole body is never kept in memory. Malformed lines are returned as :class:`ParseError` instances, so they can
+    be reported next to other rows.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return self.iter_objects(stream)
+
+    @staticmethod
+    def iter_objects(stream):
+        for line in stream:
+            line = line.strip()
+
+            if line:
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError as exc:
+                    yield ParseError(f'JSON parse error - {exc}')
+
+
+class CSVParser(BaseParser):
+    """
+    Parser of CSV with header row (ex. bulk imports), rows are parsed lazily while the request body is read. Empty cells
+    are skipped, so missing values take their defaults.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+
+        # spreadsheets often start utf-8 files with BOM
+        if encoding.lower().replace('-', '') == 'utf8':
+            encoding = 'utf-8-sig'
+
+        return self.iter_rows(line.decode(encoding) for line in stream)
+
+    @staticmethod
+    def iter_rows(lines):
+        try:
+            for row in csv.DictReader(lines):
+                yield {key: value for key, value in row.items() if key is not None and value not in ('', None)}
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise ParseError(f'CSV parse error - {exc}')
@@ -0,0 +1,234 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from rest_framework.response import Response
+
+from API.conditional import ConditionalGetMixin
+from API.conditional import hash_data
+from API.roles import user_groups
+
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlencode
+import hashlib
+import uuid
+
+
+PRODUCTS_TAG = 'products'
+CATEGORIES_TAG = 'categories'
+
+
+def product_tag(product_id: int) -> str:
+    return f'product:{product_id}'
+
+
+def seller_tag(seller_id: int) -> str:
+    return f'seller:{seller_id}'
+
+
+def get_request_role(request) -> str:
+    """
+    :param request: api request
+    :return: name of the caller role, responses are cached separately for each role
+    """
+    user = request.user
+
+    if not user.is_authenticated:
+        return 'anonymous'
+    if user.is_superuser:
+        return 'superuser'
+
+    return '+'.join(sorted(user_groups(user))) or 'user'
+
+
+class ResponseCache:
+    """
+    Cache of serialized api responses invalidated by tags.
+
+    Every tag has a version (random token) stored in the cache, each cached response keeps versions of its tags from the
+    moment it was computed and is treated as a miss once any of them changes. Invalidating a tag is a single cache write
+    no matter how many responses use it. Hits and misses are counted per namespace in the cache, so they are shared by
+    all workers using the same cache backend.
+    """
+    KEY_PREFIX = 'response_cache'
+
+    def __init__(self, alias: str = None, timeout: int = None):
+        self.alias = settings.RESPONSE_CACHE_ALIAS if alias is None else alias
+        self.timeout = settings.RESPONSE_CACHE_TIMEOUT if timeout is None else timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def tag_key(self, tag: str) -> str:
+        return f'{self.KEY_PREFIX}:tag:{tag}'
+
+    def stats_key(self, namespace: str, result: str) -> str:
+        return f'{self.KEY_PREFIX}:stats:{namespace}:{result}'
+
+    def request_key(self, namespace: str, request) -> str:
+        """
+        :param namespace: cached view name
+        :param request: api request
+        :return: cache key of the request built from its url with sorted query parameters and caller role
+        """
+        # empty parameters are kept, some change the response (ex. `expand=` collapses all relations)
+        query = urlencode(sorted(
+            (key, value) for key, values in request.query_params.lists() for value in values
+        ))
+        url = request.build_absolute_uri(request.path) + '?' + query
+
+        return f'{self.KEY_PREFIX}:{namespace}:{get_request_role(request)}:{hashlib.md5(url.encode()).hexdigest()}'
+
+    def tags_versions(self, tags: Iterable[str]) -> Dict[str, Optional[str]]:
+        keys = {self.tag_key(tag): tag for tag in tags}
+        versions = self.cache.get_many(keys.keys())
+
+        return {tag: versions.get(key, None) for key, tag in keys.items()}
+
+    def get(self, key: str) -> Optional[Tuple[Any, str]]:
+        """
+        :param key: request cache key
+        :return: cached response data with its ETag or None if it's missing or any of its tags was invalidated
+        """
+        entry = self.cache.get(key, None)
+
+        if entry is None:
+            return None
+
+        data, versions, etag = entry
+        if self.tags_versions(versions.keys()) != versions:
+            return None
+
+        return data, etag
+
+    def set(self, key: str, data, versions: Dict[str, Optional[str]]) -> str:
+        """
+        :param key: request cache key
+        :param data: response data
+        :param versions: versions of response tags read before the response was computed
+        :return: ETag of response data
+        """
+        missing = {self.tag_key(tag): uuid.uuid4().hex for tag, version in versions.items() if version is None}
+
+        if missing:
+            for tag_key, version in missing.items():
+                self.cache.add(tag_key, version, timeout=None)
+            versions = {**versions, **self.tags_versions(tag for tag, version in versions.items() if version is None)}
+
+        etag = hash_data(data)
+        self.cache.set(key, (data, versions, etag), timeout=self.timeout)
+
+        return etag
+
+    def invalidate(self, *tags: str) -> None:
+        """
+        :param tags: tags of responses which are no longer valid
+        """
+        if tags:
+            # versions are only compared for equality, so all invalidated tags can share the new one
+            version = uuid.uuid4().hex
+            self.cache.set_many({self.tag_key(tag): version for tag in tags}, timeout=None)
+
+    def count(self, namespace: str, result: str) -> None:
+        key = self.stats_key(namespace, result)
+
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, 1, timeout=None):
+                self.cache.incr(key)
+
+    def stats(self, namespace: str) -> Dict[str, int]:
+        """
+        :param namespace: cached view name
+        :return: number of hits and misses of the view responses and hit ratio
+        """
+        hits = self.cache.get(self.stats_key(namespace, 'hits'), 0)
+        misses = self.cache.get(self.stats_key(namespace, 'misses'), 0)
+
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else 0.0}
+
+    def reset_stats(self, namespace: str) -> None:
+        self.cache.delete_many([self.stats_key(namespace, 'hits'), self.stats_key(namespace, 'misses')])
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_responses(*tags: str) -> None:
+    """
+    Invalidate responses with given tags now and again once current transaction commits, so responses cached from the
+    old data before the commit are dropped too
+    :param tags: invalidated tags
+    """
+    response_cache.invalidate(*tags)
+    transaction.on_commit(lambda: response_cache.invalidate(*tags))
+
+
+def invalidate_product_responses(products_ids: Iterable[int]) -> None:
+    """
+    :param products_ids: ids of changed products (ex. with queryset `update` or `bulk_update` skipping signals)
+    """
+    invalidate_responses(PRODUCTS_TAG, *(product_tag(product_id) for product_id in products_ids))
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    ViewSet mixin caching data of successful GET responses of `response_cache_actions` in :class:`ResponseCache`.
+
+    Responses are tagged with tags returned by `get_response_cache_tags`, `X-Cache` header tells if response was served
+    from the cache. Cached responses have ETag of their data, so conditional requests are answered with
+    `304 Not Modified` without touching the database.
+    """
+    response_cache_namespace = None
+    response_cache_actions = ('list', 'retrieve')
+
+    @property
+    def conditional_actions(self):
+        return self.response_cache_actions
+
+    def get_response_cache_tags(self, data=None) -> Iterable[str]:
+        """
+        :param data: response data, None before the response is computed
+        :return: tags of the response known from the request (without data) or entities included in response data
+        """
+        return ()
+
+    def cached_response(self, request, get_response: Callable[[], Response]):
+        """
+        :param request: api request
+        :param get_response: function computing response on cache miss
+        :return: cached, computed or `304 Not Modified` response
+        """
+        if request.method != 'GET' or self.action not in self.response_cache_actions:
+            return get_response()
+
+        namespace = self.response_cache_namespace or self.basename
+        key = response_cache.request_key(namespace, request)
+        cached = response_cache.get(key)
+
+        if cached is not None:
+            data, etag = cached
+            response_cache.count(namespace, 'hits')
+            response = self.conditional_response(request, lambda: Response(data), etag=etag)
+            response['X-Cache'] = 'HIT'
+
+            return response
+
+        response_cache.count(namespace, 'misses')
+        # versions are read before computing the response, so invalidation made in the meantime is not missed
+        versions = response_cache.tags_versions(self.get_response_cache_tags())
+        response = get_response()
+
+        if response.status_code == 200:
+            versions.update(response_cache.tags_versions(
+                tag for tag in self.get_response_cache_tags(response.data) if tag not in versions
+            ))
+            etag = response_cache.set(key, response.data, versions)
+            # client may still have the same data, ex. when it was evicted from the cache
+            response = self.conditional_response(request, lambda: response, etag=etag)
+
+        response['X-Cache'] = 'MISS'
+
+        return response
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from typing import FrozenSet, Iterable
+
+
+USER_GROUPS_CACHE_KEY = 'user_groups:{}'
+
+
+def user_groups(user) -> FrozenSet[str]:
+    """
+    Names of user groups are loaded once and kept on the user instance for the rest of the request, and in the cache
+    for next requests (invalidated by `API.signals` when user groups change)
+    :param user: user model instance or anonymous user
+    :return: names of user groups
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    groups = getattr(user, '_groups_names', None)
+
+    if groups is None:
+        key = USER_GROUPS_CACHE_KEY.format(user.pk)
+        groups = cache.get(key)
+
+        if groups is None:
+            groups = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(key, groups, settings.USER_GROUPS_CACHE_TIMEOUT)
+
+        user._groups_names = groups
+
+    return groups
+
+
+def has_group(user, group_name: str) -> bool:
+    """
+    :param user: user model instance or anonymous user
+    :param group_name: group name
+    :return: whether user belongs to the group
+    """
+    return group_name in user_groups(user)
+
+
+def is_client(user) -> bool:
+    return has_group(user, settings.USER_CLIENT_GROUP_NAME)
+
+
+def is_seller(user) -> bool:
+    return has_group(user, settings.USER_SELLER_GROUP_NAME)
+
+
+def invalidate_user_groups(users_ids: Iterable[int]) -> None:
+    """
+    Forget cached groups names now and again after current transaction commits, so groups cached by concurrent requests
+    before the change is committed don't stay in the cache
+    :param users_ids: ids of users whose groups changed
+    """
+    keys = [USER_GROUPS_CACHE_KEY.format(user_id) for user_id in users_ids]
+
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -1,4 +1,5 @@
 from django.db.models import Q, Sum
+from django.utils import timezone
 
 import graphene
 from graphql import SelectionSetNode
@@ -7,16 +8,19 @@ from API.models import ProductCategory
 from API.models import Product
 from API.models import Order
 from API.models import DiscountCoupon
+from API.models import ProductVisitorsSketch
 from API.types import ProductCategoryType
 from API.types import ProductType
 from API.types import ProductStatisticObjectType
+from API.types import ProductUniqueVisitorsType
 from API.types import OrderType
 from API.types import SalesAndProfitsType
 from API.types import MonthlySalesAndProfitsType
 from API.types import CountrySalesAndProfitsType
 from API.types import DiscountCouponType
+from API.search import search_products
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 PRODUCT_STATS_VALID_ORDERS = {
@@ -31,26 +35,50 @@ PRODUCT_STATS_VALID_ORDERS = {
     'views', '-views',
 }
 
+# statistics fields read from annotations replacing model fields
+PRODUCT_STATS_SOURCES = {
+    'stock': 'available_stock',
+}
+
+PRODUCT_VISITORS_PERIODS = {
+    'day': ProductVisitorsSketch.Period.DAY,
+    'week': ProductVisitorsSketch.Period.WEEK,
+    'month': ProductVisitorsSketch.Period.MONTH,
+}
+
 
 def is_product_order_valid(order: str) -> bool:
     return order in PRODUCT_STATS_VALID_ORDERS
 
 
-def get_date_range_product_filter_from_kwargs(**kwargs):
+def get_product_stats_source(name: str) -> str:
+    """
+    :param name: statistics field name or ordering
+    :return: name of the annotation the field is read from (with ordering direction)
+    """
+    field = name.lstrip('-')
+
+    return name[:len(name) - len(field)] + PRODUCT_STATS_SOURCES.get(field, field)
+
+
+def get_date_range_from_kwargs(**kwargs):
     date_from_limit = kwargs.get("date_from", None)
     date_to_limit = kwargs.get("date_to", None)
+
+    return (
+        datetime.strptime(date_from_limit, '%Y-%m-%d %H:%M:%S') if date_from_limit else None,
+        datetime.strptime(date_to_limit, '%Y-%m-%d %H:%M:%S') if date_to_limit else None
+    )
+
+
+def get_date_range_product_filter_from_kwargs(**kwargs):
+    date_from_limit, date_to_limit = get_date_range_from_kwargs(**kwargs)
     date_filter_query = Q()
 
     if date_from_limit:
-        date_filter_query.add(
-            Q(orderproductlistitem__order__order_date__gte=datetime.strptime(date_from_limit, '%Y-%m-%d %H:%M:%S')),
-            Q.AND
-        )
+        date_filter_query.add(Q(orderproductlistitem__order__order_date__gte=date_from_limit), Q.AND)
     if date_to_limit:
-        date_filter_query.add(
-            Q(orderproductlistitem__order__order_date__lte=datetime.strptime(date_to_limit, '%Y-%m-%d %H:%M:%S')),
-            Q.AND
-        )
+        date_filter_query.add(Q(orderproductlistitem__order__order_date__lte=date_to_limit), Q.AND)
 
     return date_filter_query
 
@@ -71,7 +99,7 @@ def get_simple_query_fields(selection_set: SelectionSetNode, force_id: bool = Fa
 class APIQuery(graphene.ObjectType):
     all_categories = graphene.List(ProductCategoryType)
     category = graphene.Field(ProductCategoryType, id=graphene.ID(required=True))
-    all_products = graphene.List(ProductType)
+    all_products = graphene.List(ProductType, search=graphene.String(required=False))
     product = graphene.Field(ProductType, id=graphene.ID(required=True))
     products_statistic = graphene.List(ProductStatisticObjectType,
                                        date_from=graphene.String(required=False),
@@ -85,6 +113,12 @@ class APIQuery(graphene.ObjectType):
                                        date_to=graphene.String(required=False),
                                        order_by=graphene.String(required=False),
                                        )
+    product_unique_visitors = graphene.Field(ProductUniqueVisitorsType,
+                                             id=graphene.ID(required=True),
+                                             period=graphene.String(required=False),
+                                             date_from=graphene.String(required=False),
+                                             date_to=graphene.String(required=False),
+                                             )
     all_orders = graphene.List(OrderType,
                                limit=graphene.Int(required=False),
                                date_from=graphene.String(required=False),
@@ -111,25 +145,31 @@ class APIQuery(graphene.ObjectType):
         except ProductCategory.DoesNotExist:
             return None
 
-    def resolve_all_products(self, info):
-        return Product.objects.select_related('category').all()
+    def resolve_all_products(self, info, **kwargs):
+        search = kwargs.get('search', None)
+
+        if search:
+            return search_products(Product.objects.with_available_stock().select_related('category'), search)
+        return Product.objects.with_available_stock().select_related('category')
 
     def resolve_product(self, info, id):
         try:
-            return Product.objects.select_related('category').get(pk=id)
+            return Product.objects.with_available_stock().select_related('category').get(pk=id)
         except Product.DoesNotExist:
             return None
 
     def resolve_products_statistic(self, info, **kwargs):
-        q = Product.objects.full_stats(get_date_range_product_filter_from_kwargs(**kwargs)).values(
-            *get_simple_query_fields(info.field_nodes[0].selection_set)
+        q = Product.objects.full_stats(
+            get_date_range_product_filter_from_kwargs(**kwargs), *get_date_range_from_kwargs(**kwargs)
+        ).values(
+            *map(get_product_stats_source, get_simple_query_fields(info.field_nodes[0].selection_set))
         )
         limit = kwargs.get('limit', -1)
         order_by = kwargs.get('order_by', None)
 
         if order_by is not None:
             order_by = order_by.split(';')
-            order_by = [order for order in filter(is_product_order_valid, order_by)]
+            order_by = [get_product_stats_source(order) for order in filter(is_product_order_valid, order_by)]
             q = q.order_by(*order_by)
 
         if limit > 0:
@@ -138,14 +178,16 @@ class APIQuery(graphene.ObjectType):
 
     def resolve_product_statistic(self, info, **kwargs):
         product_id = kwargs.get('id', None)
-        q = Product.objects.full_stats(get_date_range_product_filter_from_kwargs(**kwargs)).values(
-            *get_simple_query_fields(info.field_nodes[0].selection_set, force_id=True)
+        q = Product.objects.full_stats(
+            get_date_range_product_filter_from_kwargs(**kwargs), *get_date_range_from_kwargs(**kwargs)
+        ).values(
+            *map(get_product_stats_source, get_simple_query_fields(info.field_nodes[0].selection_set, force_id=True))
         )
         order_by = kwargs.get('order_by', None)
 
         if order_by is not None:
             order_by = order_by.split(';')
-            order_by = [order for order in filter(is_product_order_valid, order_by)]
+            order_by = [get_product_stats_source(order) for order in filter(is_product_order_valid, order_by)]
             q = q.order_by(*order_by)
 
         if product_id is None:
@@ -156,6 +198,18 @@ class APIQuery(graphene.ObjectType):
         except Product.DoesNotExist:
             return None
 
+    def resolve_product_unique_visitors(self, info, id, **kwargs):
+        date_from, date_to = get_date_range_from_kwargs(**kwargs)
+        date_to = date_to.date() if date_to else timezone.localdate()
+        date_from = date_from.date() if date_from else date_to - timedelta(days=30)
+        period = PRODUCT_VISITORS_PERIODS.get(kwargs.get('period', 'day'), ProductVisitorsSketch.Period.DAY)
+
+        return {
+            'id': id,
+            'unique_visitors': ProductVisitorsSketch.objects.unique_visitors(id, date_from, date_to),
+            'buckets': ProductVisitorsSketch.objects.unique_visitors_series(id, period, date_from, date_to),
+        }
+
     def resolve_all_orders(self, info, **kwargs):
         date_from_limit = kwargs.get("date_from", None)
         date_to_limit = kwargs.get("date_to", None)
@@ -171,13 +225,19 @@ class APIQuery(graphene.ObjectType):
         if date_to_limit:
             date_filter_query.add(Q(order_date__lte=datetime.strptime(date_to_limit, '%Y-%m-%d %H:%M:%S')), Q.AND)
         if date_filter_query:
-            return Order.objects.filter(date_filter_query).order_by('-order_date')[:limit]
+            return Order.objects.filter(date_filter_query).select_related('client', 'order_address').prefetch_related(
+                Order.products_list_prefetch()
+            ).order_by('-order_date')[:limit]
 
-        return Order.objects.all().order_by('-order_date')[:limit]
+        return Order.objects.select_related('client', 'order_address').prefetch_related(
+            Order.products_list_prefetch()
+        ).order_by('-order_date')[:limit]
 
     def resolve_order(self, info, id):
         try:
-            return Order.objects.get(pk=id)
+            return Order.objects.select_related('client', 'order_address').prefetch_related(
+                Order.products_list_prefetch()
+            ).get(pk=id)
         except Order.DoesNotExist:
             return None
 
@@ -0,0 +1,232 @@
+from django.conf import settings
+from django.db import connections
+from django.db import DatabaseError
+from django.db.models import Q, QuerySet, FloatField, BooleanField, Value
+from django.db.models.expressions import RawSQL
+
+from typing import List
+import re
+import time
+
+
+PRODUCT_TABLE = 'API_product'
+PRODUCT_FTS_TABLE = 'API_product_fts'
+PRODUCT_SEARCH_INDEX = 'API_product_search_idx'
+
+
+def search_terms(query: str) -> List[str]:
+    """
+    :param query: raw search query provided by the user
+    :return: words of the query stripped from all full-text search operators
+    """
+    return re.findall(r'\w+', query or '')
+
+
+class BaseProductSearchBackend:
+    """
+    Base class of database specific product full-text search.
+
+    `search` filters products matching all words of the query (words are matched as prefixes) and annotates them with
+    `search_rank` where higher value means more relevant product.
+    """
+    def __init__(self, using: str = 'default'):
+        self.using = using
+        self.connection = connections[using]
+
+    def install(self) -> None:
+        """
+        Create database structures required by full-text search if they don't exist yet
+        """
+        pass
+
+    def is_installed(self) -> bool:
+        return True
+
+    def rebuild(self) -> None:
+        """
+        Recreate full-text search index from current products
+        """
+        pass
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        terms = search_terms(query)
+        filter_q = Q()
+
+        for term in terms:
+            filter_q &= Q(name__icontains=term) | Q(description__icontains=term)
+
+        return queryset.filter(filter_q).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteProductSearchBackend(BaseProductSearchBackend):
+    """
+    SQLite FTS5 external content table kept in sync with products table by triggers
+    """
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_FTS_TABLE} USING fts5("
+                f"name, description, content='{PRODUCT_TABLE}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN "
+                f"INSERT INTO {PRODUCT_FTS_TABLE}(rowid, name, description) "
+                f"VALUES (new.id, new.name, new.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN "
+                f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, name, description) "
+                f"VALUES ('delete', old.id, old.name, old.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_au AFTER UPDATE OF name, description "
+                f"ON {PRODUCT_TABLE} BEGIN "
+                f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, name, description) "
+                f"VALUES ('delete', old.id, old.name, old.description); "
+                f"INSERT INTO {PRODUCT_FTS_TABLE}(rowid, name, description) "
+                f"VALUES (new.id, new.name, new.description); END"
+            )
+
+    def is_installed(self):
+        return PRODUCT_FTS_TABLE in self.connection.introspection.table_names()
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('rebuild')")
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        match = ' '.join(f'"{term}"*' for term in terms)
+
+        # joining FTS table (instead of correlated subqueries) lets SQLite run the MATCH only once per query, bm25 returns
+        # lower values for better matches and name column is weighted more than description
+        return queryset.extra(
+            tables=[PRODUCT_FTS_TABLE],
+            where=[f'{PRODUCT_FTS_TABLE}.rowid = "{PRODUCT_TABLE}"."id"', f'{PRODUCT_FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({PRODUCT_FTS_TABLE}, 10.0, 1.0)'}
+        )
+
+
+class PostgreSQLProductSearchBackend(BaseProductSearchBackend):
+    """
+    PostgreSQL weighted tsvector expression with GIN index, no extra column or triggers are needed
+    """
+    @property
+    def vector_sql(self) -> str:
+        config = settings.PRODUCT_SEARCH_CONFIG
+
+        return f"setweight(to_tsvector('{config}'::regconfig, coalesce(\"{PRODUCT_TABLE}\".\"name\", '')), 'A') || " \
+               f"setweight(to_tsvector('{config}'::regconfig, coalesce(\"{PRODUCT_TABLE}\".\"description\", '')), 'B')"
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PRODUCT_SEARCH_INDEX} ON \"{PRODUCT_TABLE}\" USING GIN (({self.vector_sql}))"
+            )
+
+    def is_installed(self):
+        with self.connection.cursor() as cursor:
+            return PRODUCT_SEARCH_INDEX in self.connection.introspection.get_constraints(cursor, PRODUCT_TABLE)
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {PRODUCT_SEARCH_INDEX}")
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+
+        if not terms:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        config = settings.PRODUCT_SEARCH_CONFIG
+        ts_query = ' & '.join(f'{term}:*' for term in terms)
+
+        return queryset.alias(search_match=RawSQL(
+            f"({self.vector_sql}) @@ to_tsquery('{config}'::regconfig, %s)", (ts_query,), output_field=BooleanField()
+        )).filter(search_match=True).annotate(search_rank=RawSQL(
+            f"ts_rank({self.vector_sql}, to_tsquery('{config}'::regconfig, %s))", (ts_query,), output_field=FloatField()
+        ))
+
+
+PRODUCT_SEARCH_BACKENDS = {
+    'sqlite': SQLiteProductSearchBackend,
+    'postgresql': PostgreSQLProductSearchBackend,
+}
+
+# full-text search missing in a database is looked for again after this time (in seconds), ex. once it has been
+# installed by another process
+FALLBACK_RECHECK_INTERVAL = 60
+
+_installed_backends = {}
+_fallback_backends = {}
+
+
+def get_product_search_backend(using: str = 'default') -> BaseProductSearchBackend:
+    """
+    :param using: database alias
+    :return: full-text search backend of given database, or `icontains` based one if full-text search is not available
+    (the fallback of database supporting full-text search is used only until it is installed)
+    """
+    if using in _installed_backends:
+        return _installed_backends[using]
+
+    fallback, checked_at = _fallback_backends.get(using, (None, None))
+
+    if fallback is not None and time.monotonic() - checked_at < FALLBACK_RECHECK_INTERVAL:
+        return fallback
+
+    backend = PRODUCT_SEARCH_BACKENDS.get(connections[using].vendor, BaseProductSearchBackend)(using)
+
+    if backend.is_installed():
+        _installed_backends[using] = backend
+        _fallback_backends.pop(using, None)
+        return backend
+
+    fallback = BaseProductSearchBackend(using)
+    _fallback_backends[using] = (fallback, time.monotonic())
+
+    return fallback
+
+
+def install_product_search(using: str = 'default', rebuild: bool = False) -> BaseProductSearchBackend:
+    """
+    Create (and optionally rebuild) full-text search structures of given database, newly created index is always filled
+    with existing products
+    :param using: database alias
+    :param rebuild: recreate index from current products
+    :return: installed search backend
+    """
+    backend = PRODUCT_SEARCH_BACKENDS.get(connections[using].vendor, BaseProductSearchBackend)(using)
+
+    try:
+        was_installed = backend.is_installed()
+        backend.install()
+
+        if rebuild or not was_installed:
+            backend.rebuild()
+    except DatabaseError:
+        # ex. SQLite compiled without FTS5 extension
+        backend = BaseProductSearchBackend(using)
+        _fallback_backends[using] = (backend, time.monotonic())
+        _installed_backends.pop(using, None)
+        return backend
+
+    _installed_backends[using] = backend
+    _fallback_backends.pop(using, None)
+
+    return backend
+
+
+def search_products(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    :param queryset: products queryset
+    :param query: search query
+    :return: products matching search query ordered from the most relevant
+    """
+    return get_product_search_backend(queryset.db).search(queryset, query).order_by('-search_rank', '-pk')
@@ -2,7 +2,6 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.conf import settings
 from django.db import transaction
-from django.db.models import F
 
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
@@ -13,10 +12,24 @@ from API.models import ProductCategory
 from API.models import Product
 from API.models import ProductRating
 from API.models import ProductView
+from API.models import ProductVisitorsSketch
 from API.models import Address
 from API.models import Order
 from API.models import OrderProductListItem
 from API.models import DiscountCoupon
+from API.models import StockReservation
+from API.models import StockMovement
+from API.managers import StockReservationError
+from API.thumbnails import derivative_urls
+from API.thumbnails import PHOTO_URL_SCHEMES
+from API.thumbnails import THUMBNAIL_FILE_TYPES
+from API.fieldsets import SparseFieldsetSerializerMixin
+from API.read_serializers import CompiledReadSerializer
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+import os
 
 
 # region Utility serializers
@@ -61,6 +74,10 @@ class UserCreateSerializer(ModelSerializer):
 
 
 class ProductCategorySerializer(ModelSerializer):
+    """
+    Category with all its descendants, served from cached categories tree (see `ProductCategoryManager.cached_tree`),
+    so no queries are made per category or per serialized product
+    """
     children = RecursiveSerializer(many=True)
 
     class Meta:
@@ -68,6 +85,41 @@ class ProductCategorySerializer(ModelSerializer):
         fields = ('id', 'name', 'parent', 'children')
         read_only_fields = fields
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._categories_tree = None
+
+    def get_node(self, pk: int) -> Optional[Dict]:
+        # tree is fetched once per serializer, ex. once for whole products list
+        if self._categories_tree is None:
+            self._categories_tree = ProductCategory.objects.cached_tree()
+
+        return self._categories_tree['nodes'].get(pk, None)
+
+    def to_representation(self, instance):
+        node = self.get_node(instance.pk)
+
+        if node is None:
+            return super().to_representation(instance)
+        return node
+
+    def to_representation_from_pk(self, pk: int):
+        """
+        Used by :class:`API.read_serializers.CompiledReadSerializer`, so serialized rows don't need category columns
+        :param pk: category id
+        :return: serialized category
+        """
+        node = self.get_node(pk)
+
+        if node is None:
+            return super().to_representation(ProductCategory.objects.get(pk=pk))
+        return node
+
+
+class ProductCategoryPathSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+
 
 class ProductCategoryManageSerializer(ModelSerializer):
     parent = serializers.PrimaryKeyRelatedField(queryset=ProductCategory.objects.all())
@@ -78,13 +130,14 @@ class ProductCategoryManageSerializer(ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ProductRatingSerializer(ModelSerializer):
+class ProductRatingSerializer(SparseFieldsetSerializerMixin, ModelSerializer):
     reviewer = UserSerializer()
 
     class Meta:
         model = ProductRating
         fields = ('id', 'product', 'rating', 'reviewer', 'review', 'created_at')
         read_only_fields = fields
+        expandable_fields = ('reviewer',)
 
 
 class ProductRatingCreateSerializer(ModelSerializer):
@@ -112,29 +165,110 @@ class ProductViewSerializer(ModelSerializer):
         read_only_fields = ('id', 'created_at')
 
 
-class ProductSerializer(ModelSerializer):
+class ProductSerializer(SparseFieldsetSerializerMixin, ModelSerializer):
     category = ProductCategorySerializer()
     seller = UserSerializer()
+    images = serializers.SerializerMethodField()
+    # serialized products are annotated with `ProductManager.with_available_stock`
+    stock = serializers.IntegerField(source='available_stock', read_only=True)
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'seller', 'stock', 'ratings',
-                  'views')
+        fields = ('id', 'sku', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'thumbnail_status',
+                  'images', 'seller', 'stock', 'ratings', 'views')
         read_only_fields = fields
+        expandable_fields = ('category', 'seller')
+        fields_sources = {
+            'images': ('photo', 'photo_hash'),
+            'ratings': ('rating_sum', 'rating_count'),
+            'views': ('views_count',),
+        }
+
+    def get_images(self, product: Product) -> Dict[str, Optional[str]]:
+        """
+        :param product: serialized product
+        :return: urls of photo derivatives of each registered size
+        """
+        request = self.context.get('request', None)
+
+        return {
+            name: request.build_absolute_uri(url) if request is not None and url is not None else url
+            for name, url in derivative_urls(product).items()
+        }
 
 
 class ProductManageSerializer(ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=ProductCategory.objects.all())
-    seller = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all())
+    # explicitly declared fields aren't made read only by `Meta.read_only_fields`, created products get requesting seller
+    seller = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'seller', 'stock')
-        read_only_fields = ['id', 'thumbnail', 'seller']
+        fields = ('id', 'sku', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'thumbnail_status',
+                  'seller', 'stock')
+        read_only_fields = ['id', 'thumbnail', 'thumbnail_status', 'seller']
+
+    def validate_sku(self, value):
+        if not value:
+            return None
+
+        products = Product.objects.filter(seller=self.get_seller(), sku=value)
+        if self.instance is not None:
+            products = products.exclude(pk=self.instance.pk)
+        if products.exists():
+            raise serializers.ValidationError("Seller already has a product with this SKU!")
+
+        return value
+
+    def get_seller(self):
+        """
+        :return: seller of updated product or requesting user for created product
+        """
+        if self.instance is not None:
+            return self.instance.seller
+        return self.context['request'].user
+
+    def create(self, validated_data):
+        validated_data['seller'] = self.get_seller()
+        return super().create(validated_data)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        # stock of products with stock ledger isn't written by `Product.save`, it's changed by a restock movement
+        stock = validated_data.pop('stock', None) if instance.stock_ledger else None
+        instance = super().update(instance, validated_data)
+
+        if stock is not None:
+            StockMovement.objects.restock({instance.pk: stock})
+            instance.stock = stock
+
+        return instance
+
+
+class ProductImportSerializer(ModelSerializer):
+    """
+    Product row of imported seller catalog (see `API.product_import`), validated without queries (categories are
+    checked for whole batch of rows)
+    """
+    sku = serializers.CharField(max_length=64)
+    category = serializers.IntegerField(source='category_id', required=False, allow_null=True, min_value=1)
+    photo_url = serializers.URLField(required=False, max_length=200)
+
+    class Meta:
+        model = Product
+        fields = ('sku', 'name', 'description', 'price', 'category', 'stock', 'photo_url')
+
+    def validate_photo_url(self, value):
+        if urlparse(value).scheme not in PHOTO_URL_SCHEMES:
+            raise serializers.ValidationError("Product photo url must be http or https url!")
+        if os.path.splitext(urlparse(value).path)[1].lower() not in THUMBNAIL_FILE_TYPES:
+            raise serializers.ValidationError("Wrong product photo image! Accepted extensions are: jpg, jpeg or png!")
+        return value
 
 
 class ProductTopLeastSellersSerializer(ModelSerializer):
     category = ProductCategorySerializer()
+    stock = serializers.IntegerField(source='available_stock', read_only=True)
     sells_count = serializers.IntegerField()
 
     class Meta:
@@ -145,6 +279,7 @@ class ProductTopLeastSellersSerializer(ModelSerializer):
 
 class ProductTopLeastProfitableSerializer(ModelSerializer):
     category = ProductCategorySerializer()
+    stock = serializers.IntegerField(source='available_stock', read_only=True)
     sells_count = serializers.IntegerField()
     total_profit = serializers.DecimalField(max_digits=18, decimal_places=2)
 
@@ -160,13 +295,13 @@ class ProductListItemSerializer(ModelSerializer):
 
     class Meta:
         model = OrderProductListItem
-        fields = ('id', 'product', 'quantity')
+        fields = ('id', 'product', 'quantity', 'unit_price', 'line_total')
         read_only_fields = fields
 
 
 class ProductListItemCreateSerializer(ProductListItemSerializer):
     class Meta(ProductListItemSerializer.Meta):
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'unit_price', 'line_total')
 
 
 class AddressSerializer(ModelSerializer):
@@ -179,6 +314,10 @@ class AddressSerializer(ModelSerializer):
         fields = ('id', 'country', 'city', 'street', 'street_number', 'street_number_local', 'post_code', 'state',
                   'short_address', 'full_address')
         read_only_fields = fields
+        fields_sources = {
+            'short_address': ('street', 'street_number', 'street_number_local', 'post_code', 'city'),
+            'full_address': ('street', 'street_number', 'street_number_local', 'post_code', 'city', 'country', 'state'),
+        }
 
 
 class OrderCreateAddressSerializer(AddressSerializer):
@@ -186,7 +325,7 @@ class OrderCreateAddressSerializer(AddressSerializer):
         read_only_fields = ('id', 'short_address', 'full_address')
 
 
-class OrderSerializer(ModelSerializer):
+class OrderSerializer(SparseFieldsetSerializerMixin, ModelSerializer):
     client = UserSerializer()
     order_address = AddressSerializer()
     products_list = serializers.SerializerMethodField()
@@ -196,10 +335,31 @@ class OrderSerializer(ModelSerializer):
         fields = ('id', 'client', 'order_address', 'order_date', 'payment_deadline', 'full_price', 'status', 'discount',
                   'final_price', 'products_list')
         read_only_fields = fields
+        expandable_fields = ('client', 'order_address')
+        fields_sources = {
+            'final_price': ('full_price', 'discount'),
+            'products_list': ('orderproductlistitem_set',),
+        }
 
     def get_products_list(self, obj):
         return ProductListItemSerializer(obj.products_list, many=True).data
 
+    def get_products_list_batch(self, orders) -> List[List[Dict]]:
+        """
+        Used by :class:`API.read_serializers.CompiledReadSerializer` instead of a query per order
+        :param orders: serialized orders
+        :return: products lists of all orders (in the same order) fetched with a single query
+        """
+        items = OrderProductListItem.objects.filter(order_id__in=[order.pk for order in orders]).order_by('pk')
+        compiled = CompiledReadSerializer(ProductListItemSerializer(context=self.context), items, ('order_id',))
+        rows = list(compiled.values(items))
+        products_lists = defaultdict(list)
+
+        for row, item in zip(rows, compiled.serialize(rows)):
+            products_lists[row['order_id']].append(item)
+
+        return [products_lists[order.pk] for order in orders]
+
 
 class OrderCreateSerializer(ModelSerializer):
     client = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all())
@@ -226,28 +386,38 @@ class OrderCreateSerializer(ModelSerializer):
             validated_data['discount'] = 0.0
 
         # try to get for possible repeated delivery address
-        order_address, _ = Address.objects.get_or_create(**address_data)
+        order_address = Address.objects.upsert(**address_data)
         validated_data['order_address'] = order_address
-        instance = super().create(validated_data)
 
-        # reduce product stock
-        # add custom validation ex. handle cases when quantity > product.stock
-        product_quantity = {item['product']: item['quantity'] for item in order_products}
-        products = Product.objects.filter(pk__in=[item['product'] for item in order_products]).only('id', 'stock')
-        for product in products:
-            if product_quantity[product.id] > product.stock:
-                product_quantity[product.id] = product.stock
-            product.stock = F('stock') - product_quantity[product.id]
-        products.bulk_update(products, ['stock'])
+        # repeated products are ordered together, prices and sellers of products fetched by validation are kept in
+        # order lines
+        product_quantity, products = defaultdict(int), {}
+        for item in order_products:
+            product_quantity[item['product'].pk] += item['quantity']
+            products[item['product'].pk] = item['product']
 
         products_list = [
             OrderProductListItem(
-                order=instance, product=product_id, quantity=product_quantity[product_id]
-            ) for product_id in product_quantity
+                product_id=product_id, quantity=quantity, unit_price=products[product_id].price,
+                line_total=products[product_id].price * quantity, seller_id=products[product_id].seller_id
+            ) for product_id, quantity in product_quantity.items()
         ]
+        validated_data['full_price'] = sum(item.line_total for item in products_list)
+        instance = super().create(validated_data)
 
+        try:
+            StockReservation.objects.reserve(instance, product_quantity, instance.payment_deadline)
+        except StockReservationError as exc:
+            raise serializers.ValidationError({
+                'orderproductlistitem_set': [
+                    {'quantity': [exc.errors[item['product'].pk]]} if item['product'].pk in exc.errors else {}
+                    for item in order_products
+                ]
+            })
+
+        for item in products_list:
+            item.order = instance
         OrderProductListItem.objects.bulk_create(products_list)
-        instance.save(update_full_price=True)
 
         return instance
 
@@ -266,6 +436,14 @@ class DiscountCouponCodesSerializer(serializers.Serializer):
     flat = serializers.BooleanField(required=False)
 
 
+class UniqueVisitorsQuerySerializer(serializers.Serializer):
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    period = serializers.ChoiceField(choices=ProductVisitorsSketch.Period.choices, required=False,
+                                     default=ProductVisitorsSketch.Period.DAY)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+
 class OrderStatusExtraExplanation(serializers.Serializer):
     status = serializers.ChoiceField(choices=Order.OrderStatus.choices)
     status_explanation = serializers.CharField(style={'base_template': 'textarea.html', 'rows': 10})
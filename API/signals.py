@@ -0,0 +1,173 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models import F
+from django.db.models.signals import pre_save
+from django.db.models.signals import post_save
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_migrate
+from django.db.models.signals import pre_delete
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from mptt.signals import node_moved
+
+from API.models import Address
+from API.models import Order
+from API.models import ProductCategory
+from API.models import Product
+from API.models import ProductRating
+from API.models import ProductView
+from API.search import install_product_search
+from API.response_cache import CATEGORIES_TAG
+from API.response_cache import invalidate_responses
+from API.response_cache import invalidate_product_responses
+from API.response_cache import seller_tag
+from API.roles import invalidate_user_groups
+from API.serializers import UserSerializer
+
+
+# region Categories tree cache
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(node_moved, sender=ProductCategory)
+def invalidate_categories_tree_cache(sender, **kwargs):
+    ProductCategory.objects.invalidate_tree_cache()
+# endregion
+
+
+# region Product counters
+@receiver(pre_save, sender=ProductRating)
+def remember_previous_rating(sender, instance: ProductRating, **kwargs):
+    """
+    Store rating values from before the update, so the difference can be applied to product counters after save
+    """
+    instance._previous_rating = None
+
+    if not instance._state.adding and instance.pk is not None:
+        instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=ProductRating)
+def update_product_ratings_on_save(sender, instance: ProductRating, created: bool, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+
+    if created or previous is None:
+        Product.objects.filter(pk=instance.product_id).update(
+            rating_sum=F('rating_sum') + instance.rating, rating_count=F('rating_count') + 1
+        )
+    elif previous[0] != instance.product_id:
+        Product.objects.filter(pk=previous[0]).update(
+            rating_sum=F('rating_sum') - previous[1], rating_count=F('rating_count') - 1
+        )
+        Product.objects.filter(pk=instance.product_id).update(
+            rating_sum=F('rating_sum') + instance.rating, rating_count=F('rating_count') + 1
+        )
+    elif previous[1] != instance.rating:
+        Product.objects.filter(pk=instance.product_id).update(rating_sum=F('rating_sum') - previous[1] + instance.rating)
+
+
+@receiver(post_delete, sender=ProductRating)
+def update_product_ratings_on_delete(sender, instance: ProductRating, **kwargs):
+    Product.objects.filter(pk=instance.product_id, rating_count__gt=0).update(
+        rating_sum=F('rating_sum') - instance.rating, rating_count=F('rating_count') - 1
+    )
+
+
+# raw views are compacted into daily rollups, so their deletion does not change the total views count
+@receiver(post_save, sender=ProductView)
+def update_product_views_on_save(sender, instance: ProductView, created: bool, **kwargs):
+    if created:
+        Product.objects.filter(pk=instance.product_id).update(views_count=F('views_count') + 1)
+# endregion
+
+
+# region Response cache
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(node_moved, sender=ProductCategory)
+def invalidate_categories_responses(sender, **kwargs):
+    invalidate_responses(CATEGORIES_TAG)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_responses_on_change(sender, instance: Product, **kwargs):
+    invalidate_product_responses([instance.pk])
+
+
+@receiver(post_save, sender=ProductRating)
+@receiver(post_delete, sender=ProductRating)
+def invalidate_rated_product_responses(sender, instance: ProductRating, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    invalidate_product_responses({instance.product_id, previous[0]} if previous else [instance.product_id])
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_seller_responses(sender, instance, created: bool, update_fields=None, **kwargs):
+    # saves of fields which aren't serialized with products (ex. `last_login` on every login) don't change responses
+    if not created and (update_fields is None or not update_fields.isdisjoint(UserSerializer.Meta.fields)):
+        invalidate_responses(seller_tag(instance.pk))
+# endregion
+
+
+# region Orders validators
+@receiver(post_save, sender=get_user_model())
+def touch_client_orders(sender, instance, created: bool, update_fields=None, **kwargs):
+    """
+    Client data is embedded in orders, so their update date (ETag of conditional requests) changes with it
+    """
+    if not created and (update_fields is None or not update_fields.isdisjoint(UserSerializer.Meta.fields)):
+        Order.objects.filter(client=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Address)
+def touch_address_orders(sender, instance: Address, created: bool, **kwargs):
+    """
+    Address is embedded in orders (shared by orders with the same address), so their update date changes with it
+    """
+    if not created:
+        Order.objects.filter(order_address=instance).update(updated_at=timezone.now())
+# endregion
+
+
+# region Products full-text search
+@receiver(post_migrate)
+def install_products_full_text_search(sender, using: str = 'default', **kwargs):
+    """
+    Create full-text search structures (not handled by model migrations) after products table is migrated
+    """
+    if sender.name == 'API':
+        install_product_search(using)
+# endregion
+
+
+# region User roles cache
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_user_groups_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Forget cached groups names of users whose groups changed, from either side of the relation (`user.groups` or
+    `group.user_set`)
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.__dict__.pop('_groups_names', None)
+            invalidate_user_groups([instance.pk])
+    elif action == 'pre_clear':
+        # users of cleared group aren't known after clearing
+        instance._cleared_users_ids = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_user_groups(getattr(instance, '_cleared_users_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_groups(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_users_cache(sender, instance: Group, **kwargs):
+    """
+    Renamed or deleted group changes groups names of all its users
+    """
+    if instance.pk is not None:
+        invalidate_user_groups(instance.user_set.values_list('pk', flat=True))
+# endregion
@@ -1,3 +1,1241 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.db import DatabaseError
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test import skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from API.buffers import ProductViewsBuffer
+from API.exports import iter_csv
+from API.exports import iter_ndjson
+from API.hyperloglog import HyperLogLog
+from API.managers import StockReservationError
+from API.managers import day_start
+from API.models import Address
+from API.models import Order
+from API.models import OutboxEmail
+from API.models import OrderProductListItem
+from API.models import Product
+from API.models import ProductCategory
+from API.models import ProductRating
+from API.models import ProductView
+from API.models import ProductViewDaily
+from API.models import ProductVisitorsSketch
+from API.models import StockMovement
+from API.models import StockReservation
+from API.models import StockShard
+from API.outbox import dispatch
+from API.product_import import import_products
+from API.read_serializers import compile_serializer
+from API.response_cache import PRODUCTS_TAG
+from API.response_cache import ResponseCache
+from API.roles import USER_GROUPS_CACHE_KEY
+from API.roles import is_client
+from API.roles import is_seller
+from API.roles import user_groups
+from API.serializers import ProductSerializer
+
+from PIL import Image
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from datetime import timedelta
+from decimal import Decimal
+from tempfile import TemporaryDirectory
+from typing import FrozenSet, Tuple
+from unittest import mock
+import atexit
+import csv
+import io
+import orjson
+
+
+class StockReservationTestCase(TransactionTestCase):
+    """
+    `StockReservation.objects` reserve, release and release_expired, for products with and without the stock ledger
+    """
+    def setUp(self):
+        self.deadline = timezone.now() + timedelta(hours=1)
+
+    def create_products(self, *stocks: int, ledger: bool = False):
+        return [
+            Product.objects.create(name=f'Product {number}', price=1, stock=stock, stock_ledger=ledger)
+            for number, stock in enumerate(stocks)
+        ]
+
+    def create_order(self) -> Order:
+        return Order.objects.create(payment_deadline=self.deadline)
+
+    def assertAvailableStock(self, products, *stocks: int):
+        available = StockMovement.objects.available_stock([product.pk for product in products])
+        self.assertEqual([available[product.pk] for product in products], list(stocks))
+
+    def test_reserve_takes_stock(self):
+        first, second = self.create_products(10, 5)
+
+        reservations = StockReservation.objects.reserve(self.create_order(), {first.pk: 3, second.pk: 5}, self.deadline)
+
+        self.assertEqual(len(reservations), 2)
+        self.assertAvailableStock([first, second], 7, 0)
+
+    def test_reserve_never_oversells(self):
+        product, = self.create_products(5)
+        StockReservation.objects.reserve(self.create_order(), {product.pk: 3}, self.deadline)
+
+        with self.assertRaises(StockReservationError) as error:
+            StockReservation.objects.reserve(self.create_order(), {product.pk: 3}, self.deadline)
+
+        self.assertEqual(list(error.exception.errors), [product.pk])
+        self.assertAvailableStock([product], 2)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_reserve_rolls_back_partial_shortage(self):
+        available, missing = self.create_products(10, 1)
+
+        with self.assertRaises(StockReservationError) as error:
+            StockReservation.objects.reserve(self.create_order(), {available.pk: 5, missing.pk: 2}, self.deadline)
+
+        self.assertEqual(list(error.exception.errors), [missing.pk])
+        self.assertAvailableStock([available, missing], 10, 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_release_is_idempotent(self):
+        product, = self.create_products(10)
+        order = self.create_order()
+        StockReservation.objects.reserve(order, {product.pk: 4}, self.deadline)
+
+        self.assertEqual(StockReservation.objects.release_order(order), 1)
+        self.assertEqual(StockReservation.objects.release_order(order), 0)
+        self.assertAvailableStock([product], 10)
+
+    def test_release_expired(self):
+        product, = self.create_products(10)
+        expired, pending, paid = self.create_order(), self.create_order(), self.create_order()
+        StockReservation.objects.reserve(expired, {product.pk: 1}, timezone.now() - timedelta(minutes=1))
+        StockReservation.objects.reserve(pending, {product.pk: 2}, self.deadline)
+        StockReservation.objects.reserve(paid, {product.pk: 3}, timezone.now() - timedelta(minutes=1))
+        StockReservation.objects.commit(paid)
+
+        self.assertEqual(StockReservation.objects.release_expired(), 1)
+        self.assertEqual(StockReservation.objects.release_expired(), 0)
+        self.assertAvailableStock([product], 5)
+        self.assertEqual(list(StockReservation.objects.filter(released_at__isnull=False).values_list(
+            'order_id', flat=True
+        )), [expired.pk])
+
+    @override_settings(STOCK_LEDGER_SAFETY_MARGIN=5)
+    def test_ledger_reserve_and_release(self):
+        product, = self.create_products(10, ledger=True)
+        order = self.create_order()
+
+        # above the safety margin
+        StockReservation.objects.reserve(order, {product.pk: 4}, self.deadline)
+        # below the safety margin
+        StockReservation.objects.reserve(self.create_order(), {product.pk: 6}, self.deadline)
+
+        with self.assertRaises(StockReservationError):
+            StockReservation.objects.reserve(self.create_order(), {product.pk: 1}, self.deadline)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10)
+        self.assertAvailableStock([product], 0)
+
+        StockReservation.objects.release_order(order)
+        StockReservation.objects.release_order(order)
+        self.assertAvailableStock([product], 4)
+
+        self.assertEqual(StockMovement.objects.compact(), 3)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 4)
+        self.assertAvailableStock([product], 4)
+
+    @override_settings(STOCK_LEDGER_SAFETY_MARGIN=10, STOCK_LEDGER_SHARDS=4)
+    def test_ledger_shards(self):
+        product, = self.create_products(30, ledger=True)
+
+        # the first order allots stock above the safety margin to shards
+        StockReservation.objects.reserve(self.create_order(), {product.pk: 1}, self.deadline)
+        self.assertEqual(sorted(StockShard.objects.filter(product=product).values_list('quantity', flat=True)),
+                         [4, 5, 5, 5])
+
+        for _ in range(19):
+            StockReservation.objects.reserve(self.create_order(), {product.pk: 1}, self.deadline)
+        self.assertAvailableStock([product], 10)
+
+        # lowered stock takes back stock allotted to shards
+        StockMovement.objects.restock({product.pk: 3})
+        self.assertFalse(StockShard.objects.filter(product=product, quantity__gt=0).exists())
+
+        with self.assertRaises(StockReservationError):
+            StockReservation.objects.reserve(self.create_order(), {product.pk: 4}, self.deadline)
+
+        StockReservation.objects.reserve(self.create_order(), {product.pk: 3}, self.deadline)
+        self.assertAvailableStock([product], 0)
+
+        # shards of products without the ledger are dropped, so they are never stale
+        StockMovement.objects.restock({product.pk: 50})
+        product.refresh_from_db()
+        product.stock_ledger = False
+        product.save()
+        self.assertFalse(StockShard.objects.filter(product=product).exists())
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_reservations_never_oversell(self):
+        for ledger in (False, True):
+            with self.subTest(ledger=ledger):
+                product, = self.create_products(20, ledger=ledger)
+                orders = [self.create_order() for _ in range(40)]
+
+                def reserve(order) -> bool:
+                    try:
+                        StockReservation.objects.reserve(order, {product.pk: 1}, self.deadline)
+                        return True
+                    except StockReservationError:
+                        return False
+                    finally:
+                        connection.close()
+
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    reserved = sum(executor.map(reserve, orders))
+
+                self.assertEqual(reserved, 20)
+                self.assertAvailableStock([product], 0)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    @override_settings(STOCK_LEDGER_SAFETY_MARGIN=10, STOCK_LEDGER_SHARDS=4)
+    def test_concurrent_ledger_reservations_above_margin_never_oversell(self):
+        product, = self.create_products(250, ledger=True)
+        # every order but the smallest ones takes more than the safety margin, all of them much more than the stock
+        quantities = [1 + number % 30 for number in range(60)]
+        orders = [(self.create_order(), quantity) for quantity in quantities]
+
+        def reserve(order_quantity) -> bool:
+            order, quantity = order_quantity
+            try:
+                StockReservation.objects.reserve(order, {product.pk: quantity}, self.deadline)
+                return True
+            except StockReservationError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            reserved = list(executor.map(reserve, orders))
+
+        available = StockMovement.objects.available_stock([product.pk])[product.pk]
+        self.assertGreaterEqual(available, 0)
+        self.assertEqual(available, 250 - sum(quantity for quantity, ok in zip(quantities, reserved) if ok))
+        # orders are rejected only when stock really runs out
+        self.assertTrue(all(available < quantity for quantity, ok in zip(quantities, reserved) if not ok))
+
+        StockMovement.objects.compact()
+        product.refresh_from_db()
+        self.assertEqual(product.stock, available)
+
+
+class OrderConditionalGetTestCase(TestCase):
+    """
+    Orders list and detail are answered with `304 Not Modified` until orders or their embedded client or address change
+    """
+    def setUp(self):
+        # cached roles of users created by other tests could be returned for reused ids
+        caches['default'].clear()
+        self.user = User.objects.create_user('client', 'client@example.com', 'password')
+        self.address = Address.objects.upsert(country='PL', city='Kraków', street='Długa', street_number='1',
+                                              post_code='30-001')
+        self.order = Order.objects.create(client=self.user, order_address=self.address)
+        self.client.force_login(self.user)
+
+    def assertRevalidated(self, url: str, change) -> None:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def change_status(self):
+        self.order.status = Order.OrderStatus.SHIPPED
+        self.order.save()
+
+    def change_client(self):
+        self.user.email = 'new-client@example.com'
+        self.user.save()
+
+    def change_address(self):
+        self.address.street_number = '2'
+        self.address.save()
+
+    def test_list(self):
+        url = reverse('api_orders-list')
+
+        for change in (self.change_status, self.change_client, self.change_address,
+                       lambda: Order.objects.create(client=self.user, order_address=self.address),
+                       lambda: self.order.delete()):
+            self.assertRevalidated(url, change)
+
+    def test_retrieve(self):
+        url = reverse('api_orders-detail', args=[self.order.pk])
+
+        for change in (self.change_status, self.change_client, self.change_address):
+            self.assertRevalidated(url, change)
+
+    def test_unserialized_client_fields_keep_etag(self):
+        url = reverse('api_orders-list')
+        etag = self.client.get(url)['ETag']
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CompiledReadSerializerTestCase(TestCase):
+    """
+    List responses serialized by `CompiledReadSerializer` from `.values()` rows are byte-identical to the ones serialized
+    by their model serializers
+    """
+    @classmethod
+    def setUpTestData(cls):
+        sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        clients = Group.objects.create(name=settings.USER_CLIENT_GROUP_NAME)
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.seller.groups.add(sellers)
+        cls.buyer = User.objects.create_user('client', 'client@example.com', 'password')
+        cls.buyer.groups.add(clients)
+
+        root = ProductCategory.objects.create(name='Root')
+        child = ProductCategory.objects.create(name='Child', parent=root)
+        # created without `save`, so no thumbnails are generated for missing photo files
+        products = Product.objects.bulk_create([
+            Product(sku='sku-1', name='Photo', description='With photo', price=Decimal('10.50'), category=child,
+                    photo='photos/photo.jpg', thumbnail='thumbnails/photo.webp', photo_hash='0123456789abcdef',
+                    thumbnail_status=Product.ThumbnailStatus.READY, seller=cls.seller, stock=20, views_count=3),
+            Product(name='No photo', price=Decimal('1.99'), category=root, seller=cls.seller, stock=5,
+                    thumbnail_status=Product.ThumbnailStatus.NO_PHOTO),
+            Product(name='No category', price=Decimal('100.00'), seller=cls.seller, stock=8, stock_ledger=True),
+        ])
+        ProductRating.objects.create(product=products[0], reviewer=cls.buyer, rating=4.5, review='Good')
+        ProductRating.objects.create(product=products[1], reviewer=cls.buyer, rating=2.0, review='Bad')
+
+        address = Address.objects.upsert(country='PL', city='Kraków', street='Długa', street_number='1',
+                                         street_number_local='2', post_code='30-001', state=Address.PolishStates.MP)
+        Address.objects.upsert(country='DE', city='Berlin', street='Lange', street_number='3', post_code='10115')
+
+        for discount, quantities in ((Decimal('0.00'), (1, 2, 3)), (Decimal('0.25'), (4, 0, 1))):
+            order = Order.objects.create(client=cls.buyer, order_address=address, discount=discount)
+            OrderProductListItem.objects.bulk_create([
+                OrderProductListItem(order=order, product=product, quantity=quantity, unit_price=product.price,
+                                     line_total=product.price * quantity, seller=cls.seller)
+                for product, quantity in zip(products, quantities) if quantity
+            ])
+            order.save(update_full_price=True)
+
+    def setUp(self):
+        # cached roles of users created by other tests could be returned for reused ids
+        caches['default'].clear()
+
+    def assertCompiledOutput(self, url: str) -> None:
+        compiled = []
+
+        def compile_and_record(serializer, queryset):
+            compiled.append(compile_serializer(serializer, queryset))
+            return compiled[-1]
+
+        # response cache would answer the second request with the first response
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        with mock.patch('API.read_serializers.compile_serializer', compile_and_record):
+            response = self.client.get(url)
+
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        with mock.patch('API.read_serializers.compile_serializer', return_value=None):
+            expected = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(compiled[0], f"{url} wasn't compiled")
+        self.assertEqual(response.content, expected.content)
+
+    def test_products(self):
+        for query in ('', '?fields=id,name,price,stock', '?fields=id,images,ratings,views', '?expand=category',
+                      '?fields=id,seller&expand=seller', '?fields=id,category,seller', '?pagination=cursor&order=price'):
+            with self.subTest(query=query):
+                self.assertCompiledOutput(reverse('api_products-list') + query)
+
+    def test_ratings(self):
+        for query in ('', '?fields=id,rating', '?fields=id,reviewer&expand=reviewer', '?fields=reviewer'):
+            with self.subTest(query=query):
+                self.assertCompiledOutput(reverse('api_ratings-list') + query)
+
+    def test_addresses(self):
+        self.assertCompiledOutput(reverse('api_address-list'))
+
+    def test_orders(self):
+        self.client.force_login(self.buyer)
+
+        for query in ('', '?fields=id,final_price,products_list', '?fields=id,client&expand=client',
+                      '?fields=id,client,order_address', '?expand=order_address'):
+            with self.subTest(query=query):
+                self.assertCompiledOutput(reverse('api_orders-list') + query)
+
+    def test_statistics(self):
+        self.client.force_login(self.seller)
+
+        for action in ('top_sellers', 'least_sellers', 'top_profitable', 'least_profitable'):
+            with self.subTest(action=action):
+                self.assertCompiledOutput(reverse(f'api_products_stats-{action}'))
+
+
+class ProductViewsBufferTestCase(TestCase):
+    """
+    `ProductViewsBuffer` deduplicates recorded views and writes only new ones, counting them in products `views_count`
+    """
+    def setUp(self):
+        self.product, self.other = Product.objects.bulk_create([
+            Product(name='Viewed', price=1), Product(name='Other', price=1)
+        ])
+        self.buffer = ProductViewsBuffer(max_size=100, flush_interval=3600, dedupe_window=60)
+        # views left in the buffer aren't flushed at exit, after test products are gone
+        atexit.unregister(self.buffer.stop)
+        # views are flushed explicitly instead of by the background thread
+        patcher = mock.patch.object(self.buffer, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertViewsCount(self, product, count: int) -> None:
+        product.refresh_from_db(fields=['views_count'])
+        self.assertEqual(product.views_count, count)
+
+    def test_record_dedupes_within_window(self):
+        self.assertTrue(self.buffer.record(self.product.pk, '10.0.0.1'))
+        self.assertFalse(self.buffer.record(self.product.pk, '10.0.0.1'))
+        self.assertTrue(self.buffer.record(self.other.pk, '10.0.0.1'))
+        self.assertEqual(len(self.buffer), 2)
+
+    def test_flush_writes_views_and_counters(self):
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            self.buffer.record(self.product.pk, ip)
+        self.buffer.record(self.other.pk, '10.0.0.1')
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(ProductView.objects.count(), 3)
+        self.assertViewsCount(self.product, 2)
+        self.assertViewsCount(self.other, 1)
+
+    def test_flush_skips_stored_views(self):
+        # ex. written by another worker, counted when it was stored
+        ProductView.objects.create(product=self.product, ip='10.0.0.1')
+        ProductView.objects.create(product=self.product, ip='2001:db8::1')
+
+        for ip in ('10.0.0.1', '2001:DB8:0::1', '10.0.0.3'):
+            self.buffer.record(self.product.pk, ip)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ProductView.objects.count(), 3)
+        self.assertViewsCount(self.product, 3)
+
+    def test_failed_flush_keeps_views(self):
+        self.buffer.record(self.product.pk, '10.0.0.1')
+
+        with mock.patch.object(ProductView.objects, 'insert_new', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertViewsCount(self.product, 1)
+
+
+class ProductManageTestCase(TestCase):
+    """
+    Products created and updated by sellers belong to them and keep their SKUs unique per seller
+    """
+    @classmethod
+    def setUpTestData(cls):
+        sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.seller.groups.add(sellers)
+        cls.other_seller = User.objects.create_user('other', 'other@example.com', 'password')
+        cls.other_seller.groups.add(sellers)
+        cls.category = ProductCategory.objects.create(name='Category')
+        cls.product = Product.objects.create(sku='sku-1', name='Product', price=1, seller=cls.seller)
+
+    def setUp(self):
+        # cached roles of users created by other tests could be returned for reused ids
+        caches['default'].clear()
+        # uploaded photos are removed with the temporary media directory
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(TemporaryDirectory())))
+
+    def create_product(self, sku: str):
+        photo = io.BytesIO()
+        Image.new('RGB', (1, 1)).save(photo, 'PNG')
+
+        return self.client.post(reverse('api_products-list'), {
+            'sku': sku, 'name': 'New', 'price': '2.00', 'category': self.category.pk, 'stock': 1,
+            'photo': SimpleUploadedFile('photo.png', photo.getvalue(), content_type='image/png'),
+        })
+
+    def test_create_assigns_seller(self):
+        self.client.force_login(self.other_seller)
+
+        response = self.create_product('sku-1')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['seller'], self.other_seller.pk)
+        self.assertTrue(Product.objects.filter(seller=self.other_seller, sku='sku-1').exists())
+
+    def test_create_rejects_seller_duplicate_sku(self):
+        self.client.force_login(self.seller)
+
+        response = self.create_product('sku-1')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', response.data)
+        self.assertEqual(Product.objects.filter(sku='sku-1').count(), 1)
+
+    def test_update_rejects_seller_duplicate_sku(self):
+        other = Product.objects.create(sku='sku-2', name='Other', price=1, seller=self.seller, stock=1)
+        self.client.force_login(self.seller)
+        url = reverse('api_products-detail', args=[other.pk])
+
+        self.assertEqual(self.client.patch(url, {'sku': 'sku-1'}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.patch(url, {'sku': 'sku-2'}, content_type='application/json').status_code, 200)
+
+
+class ProductCountersTestCase(TestCase):
+    """
+    Denormalized ratings and views counters of products follow their ratings and views through model signals
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.reviewer = User.objects.create_user('client', 'client@example.com', 'password')
+
+    def setUp(self):
+        self.product, self.other = Product.objects.bulk_create([
+            Product(name='Rated', price=1), Product(name='Other', price=1)
+        ])
+
+    def assertCounters(self, product, rating_sum: float, rating_count: int, views_count: int = 0) -> None:
+        product.refresh_from_db(fields=Product.COUNTER_FIELDS)
+        self.assertEqual((product.rating_sum, product.rating_count, product.views_count),
+                         (rating_sum, rating_count, views_count))
+
+    def rate(self, product, rating: float) -> ProductRating:
+        return ProductRating.objects.create(product=product, reviewer=self.reviewer, rating=rating)
+
+    def test_ratings_change_counters(self):
+        first = self.rate(self.product, 4.0)
+        self.rate(self.product, 2.0)
+        self.assertCounters(self.product, 6.0, 2)
+        self.assertEqual(self.product.ratings, 3.0)
+
+        first.rating = 5.0
+        first.save()
+        self.assertCounters(self.product, 7.0, 2)
+
+        first.product = self.other
+        first.save()
+        self.assertCounters(self.product, 2.0, 1)
+        self.assertCounters(self.other, 5.0, 1)
+
+        first.delete()
+        self.assertCounters(self.other, 0.0, 0)
+        self.assertEqual(self.other.ratings, 0.0)
+
+    def test_views_change_counters(self):
+        ProductView.objects.create(product=self.product, ip='10.0.0.1')
+        view = ProductView.objects.create(product=self.product, ip='10.0.0.2')
+        self.assertCounters(self.product, 0.0, 0, 2)
+
+        # raw views are removed by compaction after they are rolled up, views count stays
+        view.delete()
+        self.assertCounters(self.product, 0.0, 0, 2)
+
+    def test_bulk_inserts_are_counted_by_rebuild(self):
+        # bulk inserts don't send signals, so counters are rebuilt afterwards
+        ProductRating.objects.bulk_create([
+            ProductRating(product=self.product, reviewer=self.reviewer, rating=rating) for rating in (1.0, 3.0)
+        ])
+        ProductView.objects.bulk_create([ProductView(product=self.product, ip='10.0.0.1')])
+        self.assertCounters(self.product, 0.0, 0)
+
+        self.assertEqual(Product.objects.rebuild_counters(batch_size=1), 2)
+        self.assertCounters(self.product, 4.0, 2, 1)
+        self.assertCounters(self.other, 0.0, 0)
+
+
+class ProductViewsRollupTestCase(TestCase):
+    """
+    Raw product views are rolled up into daily rows and deleted after retention window without changing views totals
+    """
+    def setUp(self):
+        self.product = Product.objects.create(name='Viewed', price=1)
+        self.today = timezone.localdate()
+
+    def view(self, ip: str, days_ago: int) -> None:
+        view = ProductView.objects.create(product=self.product, ip=ip)
+        # `created_at` is set on insert
+        ProductView.objects.filter(pk=view.pk).update(
+            created_at=day_start(self.today - timedelta(days=days_ago)) + timedelta(hours=12)
+        )
+
+    def assertDailyViews(self, *days: Tuple[int, int]) -> None:
+        self.assertEqual(
+            list(ProductViewDaily.objects.order_by('day').values_list('day', 'views')),
+            [(self.today - timedelta(days=days_ago), views) for days_ago, views in days]
+        )
+
+    def assertViewsTotal(self, total: int) -> None:
+        Product.objects.rebuild_counters()
+        self.product.refresh_from_db(fields=['views_count'])
+        self.assertEqual(self.product.views_count, total)
+
+    def test_rollup_and_compact(self):
+        for ip, days_ago in (('10.0.0.1', 3), ('10.0.0.2', 3), ('10.0.0.3', 2), ('10.0.0.4', 0)):
+            self.view(ip, days_ago)
+
+        self.assertEqual(ProductViewDaily.objects.rollup(chunk_size=1), 2)
+        self.assertDailyViews((3, 2), (2, 1))
+        # repeated rollup doesn't count rolled up days again
+        self.assertEqual(ProductViewDaily.objects.rollup(), 0)
+
+        self.assertEqual(ProductViewDaily.objects.compact(1, chunk_size=1), 3)
+        self.assertEqual(list(ProductView.objects.values_list('ip', flat=True)), ['10.0.0.4'])
+        self.assertViewsTotal(4)
+
+    def test_compact_keeps_not_rolled_up_views(self):
+        self.assertEqual(ProductViewDaily.objects.compact(0), 0)
+
+        for ip, days_ago in (('10.0.0.1', 3), ('10.0.0.2', 2)):
+            self.view(ip, days_ago)
+
+        ProductViewDaily.objects.rollup(until=self.today - timedelta(days=3))
+        # views of days after the last rolled up one are kept even if they are older than retention window
+        self.assertEqual(ProductViewDaily.objects.compact(0), 1)
+        self.assertEqual(list(ProductView.objects.values_list('ip', flat=True)), ['10.0.0.2'])
+        self.assertViewsTotal(2)
+
+
+class ProductVisitorsSketchTestCase(TestCase):
+    """
+    Product unique visitors are estimated by merging HyperLogLog sketches of days, weeks and months covering the range
+    """
+    @classmethod
+    def setUpTestData(cls):
+        sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.seller.groups.add(sellers)
+        cls.other_seller = User.objects.create_user('other', 'other@example.com', 'password')
+        cls.other_seller.groups.add(sellers)
+        cls.product = Product.objects.create(name='Visited', price=1, seller=cls.seller)
+
+        # monday, visitors of the first day return on the second one
+        cls.monday = date(2024, 1, 1)
+        ProductVisitorsSketch.objects.record(((cls.product.pk, f'10.0.0.{i}') for i in range(100)), day=cls.monday)
+        ProductVisitorsSketch.objects.record(((cls.product.pk, f'10.0.{i // 250}.{i % 250}') for i in range(150)),
+                                             day=cls.monday + timedelta(days=1))
+
+    def setUp(self):
+        # cached roles of users created by other tests could be returned for reused ids
+        caches['default'].clear()
+
+    def assertEstimate(self, estimate: int, count: int) -> None:
+        # standard error of default precision is ~3.25%
+        self.assertAlmostEqual(estimate, count, delta=count * 0.1)
+
+    def test_hyperloglog(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        first.update(str(i) for i in range(5000))
+        first.update(str(i) for i in range(1000))
+        second.update(str(i) for i in range(2500, 7500))
+
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEstimate(first.count(), 5000)
+        self.assertEqual(HyperLogLog.from_bytes(bytes(first)).count(), first.count())
+        self.assertEstimate(first.merge(second).count(), 7500)
+
+    def test_hyperloglog_rejects_other_precisions(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(precision=17)
+        with self.assertRaises(ValueError):
+            HyperLogLog(precision=4, registers=bytes(32))
+        with self.assertRaises(ValueError):
+            HyperLogLog().merge(HyperLogLog(precision=12))
+
+    def test_unique_visitors(self):
+        visitors = ProductVisitorsSketch.objects.unique_visitors
+        sunday = self.monday + timedelta(days=6)
+
+        self.assertEstimate(visitors(self.product.pk, self.monday, self.monday), 100)
+        # returning visitors are counted once by the weekly and monthly sketches
+        self.assertEstimate(visitors(self.product.pk, self.monday, sunday), 150)
+        self.assertEstimate(visitors(self.product.pk, self.monday, date(2024, 1, 31)), 150)
+        self.assertEqual(visitors(self.product.pk, sunday, sunday), 0)
+
+        series = ProductVisitorsSketch.objects.unique_visitors_series(
+            self.product.pk, ProductVisitorsSketch.Period.DAY, self.monday, sunday
+        )
+        self.assertEqual([bucket['bucket_start'] for bucket in series], [self.monday, self.monday + timedelta(days=1)])
+
+    def test_compact_keeps_weekly_and_monthly_sketches(self):
+        self.assertEqual(ProductVisitorsSketch.objects.compact(0), 2)
+        self.assertEstimate(
+            ProductVisitorsSketch.objects.unique_visitors(self.product.pk, self.monday, self.monday + timedelta(days=6)),
+            150
+        )
+
+    def test_endpoint(self):
+        url = reverse('api_products_stats-unique_visitors')
+        query = {'product': self.product.pk, 'period': ProductVisitorsSketch.Period.WEEK,
+                 'date_from': '2024-01-01', 'date_to': '2024-01-14'}
+
+        self.client.force_login(self.seller)
+        response = self.client.get(url, query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEstimate(response.data['unique_visitors'], 150)
+        self.assertEqual(len(response.data['buckets']), 1)
+        self.assertEqual(self.client.get(url, {**query, 'period': 5}).status_code, 400)
+
+        self.client.force_login(self.other_seller)
+        self.assertEqual(self.client.get(url, query).status_code, 403)
+
+
+class ProductCursorPaginationTestCase(TestCase):
+    """
+    Products list switches from page number to keyset pagination for `pagination=cursor`
+    """
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='Category')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {number:02}', price=(number * 7) % 25 + 1, category=category, stock=1,
+                    thumbnail_status=Product.ThumbnailStatus.NO_PHOTO)
+            for number in range(25)
+        ])
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def walk(self, query: dict) -> list:
+        response = self.client.get(reverse('api_products-list'), query)
+        pages = []
+
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([product['id'] for product in response.data['results']])
+
+            if response.data['next'] is None:
+                return pages
+            response = self.client.get(response.data['next'])
+
+    def test_page_number_by_default(self):
+        response = self.client.get(reverse('api_products-list'))
+
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual([product['id'] for product in response.data['results']],
+                         [product.pk for product in self.products[::-1][:10]])
+
+    def test_cursor_pages(self):
+        pages = self.walk({'pagination': 'cursor'})
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), [product.pk for product in self.products[::-1]])
+
+    def test_cursor_pages_follow_filter_ordering(self):
+        pages = self.walk({'pagination': 'cursor', 'order': 'price'})
+
+        self.assertEqual(sum(pages, []), [product.pk for product in sorted(self.products, key=lambda p: p.price)])
+
+    def test_cursor_rejects_unsupported_ordering(self):
+        response = self.client.get(reverse('api_products-list'), {'pagination': 'cursor', 'order': 'category'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+        self.assertEqual(self.client.get(reverse('api_products-list'), {'cursor': 'broken'}).status_code, 404)
+
+
+class ProductResponseCacheTestCase(TestCase):
+    """
+    Cached products responses are dropped when a product, category or seller included in them changes, and only then
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.category = ProductCategory.objects.create(name='Category')
+        cls.product, cls.other = Product.objects.bulk_create([
+            Product(name=name, price=1, category=cls.category, seller=cls.seller, stock=1,
+                    thumbnail_status=Product.ThumbnailStatus.NO_PHOTO)
+            for name in ('Cached', 'Other')
+        ])
+
+    def setUp(self):
+        caches['default'].clear()
+        # retrieved products views aren't recorded by the shared buffer
+        patcher = mock.patch('API.views.product_views_buffer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertCache(self, url: str, result: str):
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], result)
+        return response
+
+    def test_responses_are_cached(self):
+        url = reverse('api_products-detail', args=[self.product.pk])
+
+        self.assertCache(url, 'MISS')
+        response = self.assertCache(url, 'HIT')
+        self.assertEqual(response.data['name'], 'Cached')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # responses of other roles and queries are cached separately
+        self.client.force_login(self.seller)
+        self.assertCache(url, 'MISS')
+        self.assertCache(url + '?fields=id', 'MISS')
+        self.assertCache(url + '?fields=id&expand=', 'MISS')
+
+    def test_changed_product_invalidates_its_responses(self):
+        list_url = reverse('api_products-list')
+        url = reverse('api_products-detail', args=[self.product.pk])
+        other_url = reverse('api_products-detail', args=[self.other.pk])
+        for cached_url in (list_url, url, other_url):
+            self.assertCache(cached_url, 'MISS')
+
+        self.product.name = 'Renamed'
+        self.product.save()
+
+        self.assertEqual(self.assertCache(url, 'MISS').data['name'], 'Renamed')
+        self.assertCache(list_url, 'MISS')
+        self.assertCache(other_url, 'HIT')
+
+    def test_embedded_category_and_seller_invalidate_responses(self):
+        url = reverse('api_products-detail', args=[self.product.pk])
+        self.assertCache(url, 'MISS')
+
+        self.seller.last_login = timezone.now()
+        self.seller.save(update_fields=['last_login'])
+        self.assertCache(url, 'HIT')
+
+        self.seller.email = 'renamed@example.com'
+        self.seller.save()
+        self.assertEqual(self.assertCache(url, 'MISS').data['seller']['email'], 'renamed@example.com')
+
+        self.category.name = 'Renamed'
+        self.category.save()
+        self.assertEqual(self.assertCache(url, 'MISS').data['category']['name'], 'Renamed')
+
+    def test_response_computed_during_invalidation_is_not_served(self):
+        cache = ResponseCache(alias='default', timeout=60)
+        versions = cache.tags_versions([PRODUCTS_TAG])
+        cache.set('key', 'old data', versions)
+        self.assertEqual(cache.get('key')[0], 'old data')
+
+        # product changed while the response was computed from versions read before
+        versions = cache.tags_versions([PRODUCTS_TAG])
+        cache.invalidate(PRODUCTS_TAG)
+        cache.set('key', 'stale data', versions)
+
+        self.assertIsNone(cache.get('key'))
+
+
+class SparseFieldsetTestCase(TestCase):
+    """
+    Products responses render only fields requested with `fields` and nest only relations requested with `expand`
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        category = ProductCategory.objects.create(name='Category')
+        cls.product = Product.objects.create(name='Product', description='Long description', price=1, stock=1,
+                                             category=category, seller=cls.seller)
+
+    def setUp(self):
+        caches['default'].clear()
+        patcher = mock.patch('API.views.product_views_buffer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, **query):
+        return self.client.get(reverse('api_products-detail', args=[self.product.pk]), query)
+
+    def test_all_fields_by_default(self):
+        data = self.get().data
+
+        self.assertEqual(list(data), list(ProductSerializer.Meta.fields))
+        self.assertEqual(data['seller']['username'], 'seller')
+        self.assertEqual(data['category']['name'], 'Category')
+
+    def test_requested_fields(self):
+        self.assertEqual(self.get(fields='name,id').data, {'id': self.product.pk, 'name': 'Product'})
+        # relations are nested unless `expand` lists other ones, not expanded relations are collapsed to primary keys
+        self.assertEqual(self.get(fields='id,seller').data['seller']['username'], 'seller')
+        self.assertEqual(self.get(fields='id,seller', expand='').data, {'id': self.product.pk, 'seller': self.seller.pk})
+        data = self.get(fields='id', expand='seller').data
+        self.assertEqual(list(data), ['id', 'seller'])
+        self.assertEqual(data['seller']['username'], 'seller')
+
+        # expanded relations are rendered even if they aren't listed in `fields`
+        results = self.client.get(reverse('api_products-list'), {'fields': 'id,category', 'expand': 'seller'}).data
+        self.assertEqual([list(product) for product in results['results']], [['id', 'category', 'seller']])
+        self.assertEqual(results['results'][0]['category'], self.product.category_id)
+
+    def test_requested_fields_narrow_query(self):
+        queryset = Product.objects.select_related('category', 'seller')
+        collapsed = ProductSerializer.parse_fieldset({'fields': 'id,name,seller', 'expand': ''})
+        expanded = ProductSerializer.parse_fieldset({'fields': 'id,name', 'expand': 'seller'})
+
+        sql = str(ProductSerializer.narrow_queryset(queryset, collapsed).query)
+        self.assertNotIn('description', sql)
+        self.assertNotIn('JOIN', sql)
+        sql = str(ProductSerializer.narrow_queryset(queryset, expanded).query)
+        self.assertIn('auth_user', sql)
+        self.assertNotIn('API_product_category', sql)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.get(fields='id,password', expand='description')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'fields', 'expand'})
+
+
+class ProductBulkUpsertTestCase(TestCase):
+    """
+    Seller catalog rows are created or updated by SKU, rows which can't be saved are reported without stopping the import
+    """
+    @classmethod
+    def setUpTestData(cls):
+        sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.seller.groups.add(sellers)
+        cls.other_seller = User.objects.create_user('other', 'other@example.com', 'password')
+        cls.category = ProductCategory.objects.create(name='Category')
+        cls.product, cls.ledger_product, cls.other_product = Product.objects.bulk_create([
+            Product(sku='A-1', name='Old', price=1, seller=cls.seller, stock=1),
+            Product(sku='A-2', name='Ledger', price=1, seller=cls.seller, stock=5, stock_ledger=True),
+            Product(sku='A-1', name='Other seller', price=1, seller=cls.other_seller, stock=1),
+        ])
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.seller)
+
+    def upsert(self, body: str, content_type: str) -> dict:
+        response = self.client.post(reverse('api_products-bulk_upsert'), body, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ndjson_rows(self):
+        data = self.upsert('\n'.join([
+            f'{{"sku": "A-1", "name": "Chair", "price": "49.99", "category": {self.category.pk}, "stock": 10}}',
+            '{"sku": "A-2", "name": "Ledger", "price": "5.00", "stock": 20}',
+            '{"sku": "B-1", "name": "Table", "price": "99.00"}',
+            '',
+            '{"sku": "B-2", "name": "Broken", "price": "free"}',
+            '{"sku": "B-3", "name": "Lamp", "price": "1.00", "category": 999}',
+            '{"sku": "B-1", "name": "Table again", "price": "1.00"}',
+            '{"sku": "B-4", "name": ',
+            '["not", "an", "object"]',
+        ]), 'application/x-ndjson')
+
+        self.assertEqual((data['created'], data['updated'], data['failed']), (1, 2, 5))
+        self.assertEqual([row['status'] for row in data['results']],
+                         ['updated', 'updated', 'created', 'failed', 'failed', 'failed', 'failed', 'failed'])
+        self.assertEqual([set(row.get('errors', ())) for row in data['results']],
+                         [set(), set(), set(), {'price'}, {'category'}, {'sku'}, {'non_field_errors'},
+                          {'non_field_errors'}])
+        self.assertEqual(data['results'][0]['id'], self.product.pk)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.price, self.product.stock), ('Chair', Decimal('49.99'), 10))
+        self.assertEqual(StockMovement.objects.available_stock([self.ledger_product.pk])[self.ledger_product.pk], 20)
+        created = Product.objects.get(seller=self.seller, sku='B-1')
+        self.assertEqual((created.name, created.thumbnail_status), ('Table', Product.ThumbnailStatus.NO_PHOTO))
+        # the same sku of another seller is a different product
+        self.other_product.refresh_from_db()
+        self.assertEqual(self.other_product.name, 'Other seller')
+
+    def test_csv_rows_before_malformed_row_are_imported(self):
+        data = self.upsert(
+            'sku,name,price,stock\r\n'
+            'C-1,Cup,2.50,\r\n'
+            'C-2,"Mug,3.00,1\r\n',
+            'text/csv'
+        )
+
+        self.assertEqual((data['created'], data['failed']), (1, 1))
+        self.assertEqual(data['results'][1]['status'], 'failed')
+        self.assertEqual(Product.objects.get(seller=self.seller, sku='C-1').stock, 0)
+        self.assertFalse(Product.objects.filter(sku='C-2').exists())
+
+    def test_failed_batch_rows_are_reported(self):
+        rows = [{'sku': f'D-{number}', 'name': 'Product', 'price': '1.00', 'category': category}
+                for number, category in enumerate((self.category.pk, 999, self.category.pk))]
+
+        data = import_products(self.seller, rows, batch_size=1)
+
+        self.assertEqual([row['status'] for row in data['results']], ['created', 'failed', 'created'])
+        self.assertEqual(Product.objects.filter(seller=self.seller, sku__startswith='D-').count(), 2)
+
+    def test_sellers_only(self):
+        self.client.force_login(self.other_seller)
+        response = self.client.post(reverse('api_products-bulk_upsert'), '{"sku": "E-1"}',
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class StatisticsExportTestCase(TestCase):
+    """
+    Products statistics are streamed as CSV (with cells escaped against formula injection) or NDJSON
+    """
+    @classmethod
+    def setUpTestData(cls):
+        sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        cls.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        cls.seller.groups.add(sellers)
+        cls.client_user = User.objects.create_user('client', 'client@example.com', 'password')
+        cls.sold, cls.unsold = Product.objects.bulk_create([
+            Product(name='=HYPERLINK("http://example.com")', price=Decimal('2.50'), seller=cls.seller, stock=3),
+            Product(name='Unsold', price=Decimal('-1.00'), seller=cls.seller, stock=1),
+        ])
+        order = Order.objects.create(client=cls.client_user)
+        OrderProductListItem.objects.create(order=order, product=cls.sold, quantity=2, unit_price=cls.sold.price,
+                                            line_total=cls.sold.price * 2, seller=cls.seller)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.seller)
+
+    def export(self, export_format: str):
+        response = self.client.get(reverse('api_products_stats-top_sellers'), {'format': export_format})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="top_sellers.{export_format}"')
+
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+
+        self.assertEqual([row['id'] for row in rows], [str(self.sold.pk), str(self.unsold.pk)])
+        self.assertEqual(rows[0]['name'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual((rows[0]['price'], rows[0]['sells_count'], rows[0]['stock']), ('2.50', '2', '3'))
+        # negative numbers aren't formulas
+        self.assertEqual(rows[1]['price'], '-1.00')
+
+    def test_ndjson(self):
+        rows = [orjson.loads(line) for line in self.export('ndjson').splitlines()]
+
+        self.assertEqual([row['id'] for row in rows], [self.sold.pk, self.unsold.pk])
+        # not escaped, JSON isn't evaluated by spreadsheets
+        self.assertEqual(rows[0]['name'], '=HYPERLINK("http://example.com")')
+        self.assertEqual((rows[0]['price'], rows[0]['sells_count']), ('2.50', 2))
+
+    def test_csv_escaping_and_chunks(self):
+        rows = [{'value': value} for value in ('=1+1', '+48 123', '@SUM(A1)', '-2', '+3.5', 'text', 7)]
+        chunks = list(iter_csv(rows, ['value'], buffer_size=1))
+
+        # header is sent before the first row is read
+        self.assertEqual(chunks[0], b'value\r\n')
+        self.assertEqual(b''.join(chunks).decode().split('\r\n')[1:-1],
+                         ["'=1+1", "'+48 123", "'@SUM(A1)", '-2', '+3.5', 'text', '7'])
+        self.assertEqual(len(list(iter_ndjson(rows, buffer_size=1))), len(rows))
+
+    def test_errors_are_rendered_in_requested_format(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('api_products_stats-top_sellers'), {'format': 'ndjson'})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.streaming)
+        self.assertIn('detail', orjson.loads(response.content))
+
+
+class AddressUpsertTestCase(TestCase):
+    """
+    Addresses are stored once per fingerprint of their normalized fields, duplicates from before are merged by command
+    """
+    fields = {'country': 'PL', 'city': 'Kraków', 'street': 'Długa', 'street_number': '1', 'post_code': '30-001',
+              'state': Address.PolishStates.MP}
+
+    def test_same_address_is_stored_once(self):
+        address = Address.objects.upsert(**self.fields)
+        same = Address.objects.upsert(**{**self.fields, 'city': ' KRAKÓW ', 'street': 'długa', 'post_code': '30 001'})
+
+        self.assertEqual(same.pk, address.pk)
+        self.assertNotEqual(Address.objects.upsert(**{**self.fields, 'street_number_local': '2'}).pk, address.pk)
+        self.assertEqual(Address.objects.count(), 2)
+
+    def test_voivodeship_is_cleared_outside_poland(self):
+        address = Address.objects.upsert(**{**self.fields, 'country': 'DE'})
+
+        self.assertEqual(address.state, Address.PolishStates.NONE)
+        self.assertEqual(Address.objects.upsert(**{**self.fields, 'country': 'DE', 'state': 0}).pk, address.pk)
+
+    def test_address_inserted_after_lookup_is_returned(self):
+        address = Address.objects.create(**self.fields)
+
+        # ex. the same address inserted by a concurrent order after the lookup
+        with mock.patch('django.db.models.QuerySet.first', return_value=None):
+            same = Address.objects.upsert(**self.fields)
+
+        self.assertEqual(same.pk, address.pk)
+        self.assertEqual(Address.objects.count(), 1)
+
+    def test_dedupe_addresses(self):
+        client = User.objects.create_user('client', 'client@example.com', 'password')
+        # created before fingerprints, without `save`
+        first, duplicate, other = Address.objects.bulk_create([
+            Address(**self.fields), Address(**{**self.fields, 'city': 'kraków'}),
+            Address(**{**self.fields, 'city': 'Łódź'}),
+        ])
+        order = Order.objects.create(client=client, order_address=duplicate)
+        kept = Address.objects.upsert(**self.fields)
+        self.assertNotIn(kept.pk, (first.pk, duplicate.pk))
+
+        call_command('dedupe_addresses', batch_size=1, stdout=io.StringIO())
+
+        self.assertEqual(set(Address.objects.values_list('pk', flat=True)), {kept.pk, other.pk})
+        self.assertFalse(Address.objects.filter(fingerprint__isnull=True).exists())
+        order.refresh_from_db()
+        self.assertEqual(order.order_address_id, kept.pk)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', OUTBOX_MAX_ATTEMPTS=2,
+                   OUTBOX_RETRY_DELAY=60)
+class OutboxEmailTestCase(TestCase):
+    """
+    Queued emails are claimed by a single dispatcher, sent in batches and retried with growing delay when sending fails
+    """
+    def enqueue(self, *recipients: str) -> int:
+        return OutboxEmail.objects.enqueue(('Subject', 'Body', recipient, 'key') for recipient in recipients)
+
+    def test_enqueue_skips_duplicates(self):
+        self.assertEqual(self.enqueue('first@example.com', '', 'second@example.com'), 2)
+        self.enqueue('first@example.com')
+
+        self.assertEqual(sorted(OutboxEmail.objects.values_list('recipient', flat=True)),
+                         ['first@example.com', 'second@example.com'])
+
+    def test_dispatch(self):
+        self.enqueue('first@example.com', 'second@example.com', 'third@example.com')
+
+        self.assertEqual(dispatch(batch_size=2), (3, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['first@example.com', 'second@example.com', 'third@example.com'])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.Status.SENT).count(), 3)
+        self.assertEqual(dispatch(), (0, 0))
+
+    def test_claimed_emails_are_hidden(self):
+        self.enqueue('first@example.com', 'second@example.com')
+
+        claimed = OutboxEmail.objects.claim(1)
+
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual([email.recipient for email in OutboxEmail.objects.claim(10)], ['second@example.com'])
+        self.assertEqual(OutboxEmail.objects.claim(10), [])
+
+    def test_failed_emails_are_retried_later(self):
+        self.enqueue('broken@example.com', 'ok@example.com')
+        send_messages = EmailBackend.send_messages
+
+        def send_or_fail(backend, messages):
+            if messages[0].to == ['broken@example.com']:
+                raise ConnectionError('Connection refused')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', send_or_fail):
+            self.assertEqual(dispatch(), (1, 1))
+            email = OutboxEmail.objects.get(recipient='broken@example.com')
+            self.assertEqual((email.status, email.attempts, email.last_error),
+                             (OutboxEmail.Status.PENDING, 1, 'Connection refused'))
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+            # not retried before its delay passes
+            self.assertEqual(dispatch(), (0, 0))
+
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(dispatch(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.Status.FAILED, 2))
+        self.assertEqual([message.to for message in mail.outbox], [['ok@example.com']])
+
+
+class UserGroupsCacheTestCase(TestCase):
+    """
+    Cached groups names of users (their roles) are forgotten whenever users groups change, from either side
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.sellers = Group.objects.create(name=settings.USER_SELLER_GROUP_NAME)
+        cls.clients = Group.objects.create(name=settings.USER_CLIENT_GROUP_NAME)
+        cls.user = User.objects.create_user('user', 'user@example.com', 'password')
+        cls.user.groups.add(cls.clients)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def groups(self) -> FrozenSet[str]:
+        # fresh instance, like the one loaded by the next request
+        return user_groups(User.objects.get(pk=self.user.pk))
+
+    def test_groups_are_cached(self):
+        self.assertEqual(self.groups(), {settings.USER_CLIENT_GROUP_NAME})
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_client(user))
+            self.assertFalse(is_seller(user))
+        self.assertEqual(user_groups(AnonymousUser()), frozenset())
+
+    def test_changed_user_groups_invalidate_cache(self):
+        self.groups()
+        self.user.groups.add(self.sellers)
+        self.assertEqual(self.groups(), {settings.USER_CLIENT_GROUP_NAME, settings.USER_SELLER_GROUP_NAME})
+
+        self.clients.user_set.remove(self.user)
+        self.assertEqual(self.groups(), {settings.USER_SELLER_GROUP_NAME})
+
+        self.sellers.user_set.clear()
+        self.assertEqual(self.groups(), frozenset())
+
+    def test_renamed_and_deleted_groups_invalidate_cache(self):
+        self.groups()
+        self.clients.name = 'renamed'
+        self.clients.save()
+        self.assertEqual(self.groups(), {'renamed'})
+
+        self.clients.delete()
+        self.assertEqual(self.groups(), frozenset())
+
+    def test_groups_cached_before_commit_are_forgotten(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.sellers)
+            # ex. cached by a concurrent request which didn't see the change yet
+            self.assertEqual(self.groups(), {settings.USER_CLIENT_GROUP_NAME, settings.USER_SELLER_GROUP_NAME})
+            caches['default'].set(USER_GROUPS_CACHE_KEY.format(self.user.pk), frozenset())
+
+        self.assertEqual(self.groups(), {settings.USER_CLIENT_GROUP_NAME, settings.USER_SELLER_GROUP_NAME})
+
+    def test_new_role_is_checked_by_permissions(self):
+        self.client.force_login(self.user)
+        url = reverse('api_products_stats-top_sellers')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.groups.add(self.sellers)
+
+        self.assertEqual(self.client.get(url).status_code, 200)
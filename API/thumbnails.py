@@ -0,0 +1,376 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db import transaction
+
+from API.response_cache import invalidate_product_responses
+
+from PIL import Image
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+import hashlib
+import ipaddress
+import logging
+import os
+import requests
+import socket
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIRECTORY = 'derivatives'
+
+THUMBNAIL_FILE_TYPES = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+}
+
+PHOTO_URL_SCHEMES = ('http', 'https')
+PHOTO_DOWNLOAD_MAX_REDIRECTS = 3
+
+
+def thumbnail_filename(photo_name: str) -> str:
+    """
+    :param photo_name: product photo file name
+    :return: name of the thumbnail file of provided photo
+    """
+    name, extension = os.path.splitext(photo_name)
+
+    return name + '_thumbnail' + extension.lower()
+
+
+def photo_hash(photo) -> str:
+    """
+    :param photo: image file opened in binary mode
+    :return: hash of image content used in derivatives names
+    """
+    content_hash = hashlib.blake2b(digest_size=16)
+
+    for chunk in iter(lambda: photo.read(65536), b''):
+        content_hash.update(chunk)
+
+    return content_hash.hexdigest()
+
+
+def render_image(photo, size: Tuple[int, int], file_type: str, **save_options) -> bytes:
+    """
+    Downscale image to fit in provided size. JPEG images are decoded in draft mode, so the decoder itself scales them
+    down (by 1/2, 1/4 or 1/8) and only a small image is resampled
+    :param photo: image file or path
+    :param size: max image width and height
+    :param file_type: output image format
+    :param save_options: encoder options, ex. quality
+    :return: encoded image
+    """
+    with Image.open(photo) as image:
+        if image.format == 'JPEG':
+            image.draft('RGB', size)
+
+        image.thumbnail(size, Image.LANCZOS)
+
+        if file_type == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif file_type == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+
+        output = BytesIO()
+        image.save(output, file_type, **save_options)
+
+    return output.getvalue()
+
+
+def render_thumbnail(photo, size: Tuple[int, int], extension: str) -> bytes:
+    """
+    :param photo: image file or path
+    :param size: max thumbnail width and height
+    :param extension: photo file extension
+    :return: encoded thumbnail in the same format as the photo
+    """
+    file_type = THUMBNAIL_FILE_TYPES.get(extension.lower(), None)
+
+    if file_type is None:
+        raise ValueError("Wrong product photo image! Accepted extensions are: jpg, jpeg or png!")
+
+    return render_image(photo, size, file_type)
+
+
+def check_photo_url(photo_url: str) -> None:
+    """
+    Check that photo url may be fetched by the server: only http(s) urls of hosts from `PRODUCT_PHOTO_ALLOWED_HOSTS`
+    (if set) are accepted and every address the host resolves to must be public (not loopback, private, link-local,
+    reserved etc.), so sellers can't make the server request its own or internal network services
+    :param photo_url: product photo url
+    """
+    url = urlparse(photo_url)
+
+    if url.scheme not in PHOTO_URL_SCHEMES or not url.hostname:
+        raise ValueError("Product photo url must be http or https url!")
+
+    if settings.PRODUCT_PHOTO_ALLOWED_HOSTS and url.hostname.lower() not in settings.PRODUCT_PHOTO_ALLOWED_HOSTS:
+        raise ValueError("Product photo host is not allowed!")
+
+    try:
+        addresses = socket.getaddrinfo(url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+                                       proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError("Product photo host can't be resolved!")
+
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split('%', 1)[0])
+
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError("Product photo host is not public!")
+
+
+def download_photo(product, photo_url: str) -> str:
+    """
+    Download imported product photo and set it as product photo if it's still missing. Redirects are followed manually,
+    so url of every hop is checked with `check_photo_url`
+    :param product: product with empty `photo`
+    :param photo_url: product `photo_url`
+    :return: name of the saved photo
+    """
+    from API.models import Product
+
+    extension = os.path.splitext(urlparse(photo_url).path)[1].lower()
+
+    if extension not in THUMBNAIL_FILE_TYPES:
+        raise ValueError("Wrong product photo image! Accepted extensions are: jpg, jpeg or png!")
+
+    content = BytesIO()
+    url = photo_url
+
+    for _ in range(PHOTO_DOWNLOAD_MAX_REDIRECTS + 1):
+        check_photo_url(url)
+
+        with requests.get(url, stream=True, allow_redirects=False,
+                          timeout=settings.PRODUCT_PHOTO_DOWNLOAD_TIMEOUT) as response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers['location'])
+                continue
+
+            response.raise_for_status()
+
+            for chunk in response.iter_content(65536):
+                content.write(chunk)
+                if content.tell() > settings.PRODUCT_PHOTO_DOWNLOAD_MAX_SIZE:
+                    raise ValueError("Product photo is too large!")
+            break
+    else:
+        raise ValueError("Too many redirects while downloading product photo!")
+
+    product.photo.save(os.path.basename(urlparse(photo_url).path), ContentFile(content.getvalue()), save=False)
+
+    if not Product.objects.filter(pk=product.pk, photo='', photo_url=photo_url).update(photo=product.photo.name):
+        product.photo.storage.delete(product.photo.name)
+        raise ValueError("Product photo was changed in the meantime!")
+
+    return product.photo.name
+
+
+def generate_thumbnail(product_id: int) -> bool:
+    """
+    Create thumbnail and content hash of product photo and mark thumbnail as ready (or failed), product is updated only
+    if its photo hasn't changed in the meantime. Missing photo of imported product is downloaded from its `photo_url`
+    first, product without both of them is marked as having no photo.
+    :param product_id: product id
+    :return: True if thumbnail was created
+    """
+    from API.models import Product
+
+    try:
+        product = Product.objects.only('id', 'photo', 'photo_url', 'thumbnail').get(pk=product_id)
+    except Product.DoesNotExist:
+        return False
+
+    if not product.photo and product.photo_url:
+        try:
+            download_photo(product, product.photo_url)
+        except Exception:
+            logger.exception("Downloading photo of product %s from %s failed", product_id, product.photo_url)
+            Product.objects.filter(pk=product_id, photo='', photo_url=product.photo_url).update(
+                thumbnail_status=Product.ThumbnailStatus.FAILED
+            )
+            return False
+
+    if not product.photo:
+        Product.objects.filter(pk=product_id, photo='', photo_url='').update(
+            thumbnail_status=Product.ThumbnailStatus.NO_PHOTO
+        )
+        return False
+
+    photo_name = product.photo.name
+    Product.objects.filter(pk=product_id, photo=photo_name).update(thumbnail_status=Product.ThumbnailStatus.PROCESSING)
+
+    try:
+        with product.photo.open('rb') as photo:
+            content_hash = photo_hash(photo)
+            photo.seek(0)
+            content = render_thumbnail(photo, settings.THUMBNAIL_SIZE, os.path.splitext(photo_name)[1])
+
+        product.thumbnail.save(thumbnail_filename(photo_name), ContentFile(content), save=False)
+    except Exception:
+        logger.exception("Creating thumbnail of product %s photo %s failed", product_id, photo_name)
+        Product.objects.filter(pk=product_id, photo=photo_name).update(thumbnail_status=Product.ThumbnailStatus.FAILED)
+        return False
+
+    updated = Product.objects.filter(pk=product_id, photo=photo_name).update(
+        thumbnail=product.thumbnail.name, photo_hash=content_hash, thumbnail_status=Product.ThumbnailStatus.READY
+    )
+
+    if updated:
+        invalidate_product_responses([product_id])
+
+    return bool(updated)
+
+
+# region Derivatives
+def derivative_filename(name: str) -> str:
+    """
+    :param name: derivative name from `PRODUCT_IMAGE_DERIVATIVES` setting
+    :return: derivative file name, changing derivative size changes its name
+    """
+    width, height = settings.PRODUCT_IMAGE_DERIVATIVES[name]
+
+    return f'{name}_{width}x{height}.webp'
+
+
+def derivative_name(filename: str) -> Optional[str]:
+    """
+    :param filename: derivative file name
+    :return: name of registered derivative with given file name or None
+    """
+    for name in settings.PRODUCT_IMAGE_DERIVATIVES:
+        if derivative_filename(name) == filename:
+            return name
+
+    return None
+
+
+def derivative_path(product_id: int, content_hash: str, name: str) -> str:
+    """
+    :param product_id: product id
+    :param content_hash: product photo hash
+    :param name: derivative name
+    :return: derivative path in media storage (and url path relative to `MEDIA_URL`)
+    """
+    return f'{DERIVATIVES_DIRECTORY}/{product_id}/{content_hash}/{derivative_filename(name)}'
+
+
+def derivative_urls(product) -> Dict[str, Optional[str]]:
+    """
+    :param product: product with `photo_hash` field
+    :return: urls of all registered derivatives of product photo (None until photo hash is calculated)
+    """
+    if not product.photo_hash:
+        return {name: None for name in settings.PRODUCT_IMAGE_DERIVATIVES}
+
+    return {
+        name: product.photo.storage.url(derivative_path(product.pk, product.photo_hash, name))
+        for name in settings.PRODUCT_IMAGE_DERIVATIVES
+    }
+
+
+def get_or_create_derivative(product, name: str) -> str:
+    """
+    Render derivative of product photo on first request and keep it in media storage
+    :param product: product with `photo` and `photo_hash` fields
+    :param name: derivative name
+    :return: derivative path in media storage
+    """
+    storage = product.photo.storage
+    path = derivative_path(product.pk, product.photo_hash, name)
+
+    if storage.exists(path):
+        return path
+
+    # only requests of the same derivative wait for each other, different ones are rendered in parallel
+    with _derivative_lock(path):
+        if not storage.exists(path):
+            with product.photo.open('rb') as photo:
+                content = render_image(photo, settings.PRODUCT_IMAGE_DERIVATIVES[name], 'WEBP',
+                                       quality=settings.PRODUCT_IMAGE_DERIVATIVES_QUALITY, method=4)
+            storage.save(path, ContentFile(content))
+
+    return path
+
+
+@contextmanager
+def _derivative_lock(path: str):
+    """
+    Lock of a single derivative path, removed when no thread holds or waits for it
+    :param path: derivative path
+    """
+    with _derivatives_locks_guard:
+        lock, users = _derivatives_locks.get(path, (None, 0))
+        if lock is None:
+            lock = threading.Lock()
+        _derivatives_locks[path] = (lock, users + 1)
+
+    try:
+        with lock:
+            yield
+    finally:
+        with _derivatives_locks_guard:
+            lock, users = _derivatives_locks[path]
+            if users > 1:
+                _derivatives_locks[path] = (lock, users - 1)
+            else:
+                del _derivatives_locks[path]
+
+
+_derivatives_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+_derivatives_locks_guard = threading.Lock()
+# endregion
+
+
+class ThumbnailWorkerPool:
+    """
+    Background pool creating product thumbnails outside of the request. Pillow releases the GIL while decoding,
+    resampling and encoding images, so threads scale thumbnails generation across cores.
+    """
+    def __init__(self, workers: int = None):
+        self.workers = settings.THUMBNAIL_WORKERS if workers is None else workers
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+        return self._executor
+
+    def submit(self, product_id: int) -> Optional[Future]:
+        """
+        Generate product thumbnail in background (or synchronously if pool has no workers)
+        :param product_id: product id
+        :return: future of the thumbnail generation
+        """
+        if self.workers < 1:
+            generate_thumbnail(product_id)
+            return None
+
+        return self.executor.submit(self._run, product_id)
+
+    def schedule(self, product_id: int) -> None:
+        """
+        Generate product thumbnail after current transaction commits, so the worker sees saved product
+        :param product_id: product id
+        """
+        transaction.on_commit(lambda: self.submit(product_id))
+
+    @staticmethod
+    def _run(product_id: int) -> bool:
+        try:
+            return generate_thumbnail(product_id)
+        finally:
+            close_old_connections()
+
+
+thumbnail_pool = ThumbnailWorkerPool()
@@ -12,6 +12,7 @@ from API.models import Address
 from API.models import Order
 from API.models import OrderProductListItem
 from API.models import DiscountCoupon
+from API.models import StockMovement
 
 
 class UserType(DjangoObjectType):
@@ -29,7 +30,17 @@ class ProductCategoryType(DjangoObjectType):
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
-        fields = ('id', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'seller', 'stock')
+        fields = ('id', 'sku', 'name', 'description', 'price', 'category', 'photo', 'thumbnail', 'thumbnail_status',
+                  'seller', 'stock')
+
+    def resolve_stock(self, info):
+        # stock including not compacted stock movements, annotated by `ProductManager.with_available_stock` (nested
+        # products are read one by one)
+        if hasattr(self, 'available_stock'):
+            return self.available_stock
+        if self.stock_ledger:
+            return StockMovement.objects.available_stock([self.pk])[self.pk]
+        return self.stock
 
 
 class ProductRatingType(DjangoObjectType):
@@ -54,7 +65,7 @@ class ProductStatisticObjectType(graphene.ObjectType):
     id = graphene.ID()
     name = graphene.String()
     price = graphene.Decimal()
-    stock = graphene.Int()
+    stock = graphene.Int(source='available_stock')
     sells_count = graphene.Int()
     total_profit = graphene.Decimal()
     ratings = graphene.Float()
@@ -62,6 +73,17 @@ class ProductStatisticObjectType(graphene.ObjectType):
     views = graphene.Int()
 
 
+class UniqueVisitorsBucketType(graphene.ObjectType):
+    bucket_start = graphene.Date()
+    unique_visitors = graphene.Int()
+
+
+class ProductUniqueVisitorsType(graphene.ObjectType):
+    id = graphene.ID()
+    unique_visitors = graphene.Int()
+    buckets = graphene.List(UniqueVisitorsBucketType)
+
+
 class AddressType(DjangoObjectType):
     country = graphene.Field(Country)
 
@@ -76,7 +98,7 @@ class AddressType(DjangoObjectType):
 class OrderProductListItemType(DjangoObjectType):
     class Meta:
         model = OrderProductListItem
-        fields = ('id', 'product', 'quantity')
+        fields = ('id', 'product', 'quantity', 'unit_price', 'line_total')
 
 
 class OrderType(DjangoObjectType):
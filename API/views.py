@@ -1,7 +1,13 @@
-from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.http import FileResponse
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from datetime import timedelta
 
 from rest_framework.generics import CreateAPIView
 from rest_framework.generics import ListCreateAPIView
@@ -21,11 +27,17 @@ from API.models import ProductCategory
 from API.models import Product
 from API.models import ProductRating
 from API.models import ProductView
+from API.models import ProductVisitorsSketch
 from API.models import Order
 from API.models import Address
 from API.models import DiscountCoupon
+from API.models import StockReservation
+from API.models import OutboxEmail
+from API.thumbnails import derivative_name
+from API.thumbnails import get_or_create_derivative
 from API.serializers import ProductCategorySerializer
 from API.serializers import ProductCategoryManageSerializer
+from API.serializers import ProductCategoryPathSerializer
 from API.serializers import ProductSerializer
 from API.serializers import ProductManageSerializer
 from API.serializers import ProductRatingSerializer
@@ -40,38 +52,76 @@ from API.serializers import UserCreateSerializer
 from API.serializers import DiscountCouponSerializer
 from API.serializers import DiscountCouponCodesSerializer
 from API.serializers import OrderStatusExtraExplanation
+from API.serializers import UniqueVisitorsQuerySerializer
 from API.filters import ProductFilter
 from API.filters import ProductStatisticsFilter
-
-
-class ProductCategoryModelViewSet(ModelViewSet):
+from API.buffers import product_views_buffer
+from API.pagination import PageNumberOrCursorPagination
+from API.conditional import ConditionalGetMixin
+from API.fieldsets import SparseFieldsetViewMixin
+from API.read_serializers import CompiledListMixin
+from API.renderers import CSVParser
+from API.renderers import NDJSONParser
+from API.product_import import import_products
+from API.exports import StreamingExportMixin
+from API.conditional import make_etag
+from API.response_cache import CachedResponseMixin
+from API.response_cache import CATEGORIES_TAG
+from API.response_cache import PRODUCTS_TAG
+from API.response_cache import product_tag
+from API.response_cache import seller_tag
+from API.roles import is_client
+from API.roles import is_seller
+
+
+class ProductCategoryModelViewSet(CachedResponseMixin, ModelViewSet):
     serializer_class = ProductCategoryManageSerializer
-    queryset = ProductCategory.objects.root_nodes().prefetch_related('children')
+    queryset = ProductCategory.objects.root_nodes()
     permission_classes = [IsAdminUser]
     pagination_class = None
+    response_cache_actions = ('list', 'retrieve', 'path')
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return ProductCategorySerializer
+        elif self.action == 'path':
+            return ProductCategoryPathSerializer
         return self.serializer_class
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'path']:
             permission_classes = [AllowAny]
         else:
             permission_classes = self.permission_classes
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        if self.action == 'path':
+            return ProductCategory.objects.all()
+        return super().get_queryset()
+
+    def get_response_cache_tags(self, data=None):
+        return [CATEGORIES_TAG]
+
+    def list(self, request, *args, **kwargs):
+        # whole tree is built from a single cached query, so root nodes don't have to be fetched separately
+        return self.cached_response(request, lambda: Response(ProductCategory.objects.cached_tree()['roots']))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(ProductCategoryModelViewSet, self).retrieve(request, *args,
+                                                                                                      **kwargs))
+
+    @action(methods=['get'], detail=True, url_path='path', url_name='path')
+    def path(self, request, pk=None):
+        return self.cached_response(request, lambda: Response(ProductCategory.objects.path(self.get_object().pk)))
+
 
-class ProductModelViewSet(ModelViewSet):
+class ProductModelViewSet(SparseFieldsetViewMixin, CachedResponseMixin, CompiledListMixin, ModelViewSet):
     serializer_class = ProductManageSerializer
-    queryset = Product.objects.available().select_related(
-        'category'
-    ).prefetch_related(
-        'productrating_set'
-    ).order_by('-pk')
+    queryset = Product.objects.available().select_related('category', 'seller').order_by('-pk')
     permission_classes = [AuthenticatedSellersOnly]
     filterset_class = ProductFilter
+    pagination_class = PageNumberOrCursorPagination
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -89,12 +139,40 @@ class ProductModelViewSet(ModelViewSet):
 
     def get_queryset(self):
         if self.request.user.is_superuser:
-            return Product.objects.all().select_related('category').order_by('-pk')
+            return Product.objects.with_available_stock().select_related('category', 'seller').order_by('-pk')
         return super().get_queryset()
 
+    def get_response_cache_tags(self, data=None):
+        # embedded categories include their subtrees, so any category change may alter product responses
+        tags = [CATEGORIES_TAG]
+
+        if self.action == 'list':
+            tags.append(PRODUCTS_TAG)
+        elif self.action == 'retrieve':
+            tags.append(product_tag(self.kwargs[self.lookup_url_kwarg or self.lookup_field]))
+
+        if data is not None:
+            if self.action == 'list':
+                products = data['results'] if isinstance(data, dict) else data
+            else:
+                products = [data]
+
+            for product in products:
+                # seller may be nested, collapsed to id or not requested at all
+                seller = product.get('seller', None)
+                if isinstance(seller, dict):
+                    seller = seller['id']
+                if seller is not None:
+                    tags.append(seller_tag(seller))
+
+        return tags
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(ProductModelViewSet, self).list(request, *args, **kwargs))
+
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
+        response = self.cached_response(request, lambda: super(ProductModelViewSet, self).retrieve(request, *args,
+                                                                                                   **kwargs))
         x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
 
         if x_forwarded_for:
@@ -102,10 +180,10 @@ class ProductModelViewSet(ModelViewSet):
         else:
             ip_address = request.META.get("REMOTE_ADDR")
 
-        if not ProductView.objects.filter(product=instance, ip=ip_address).exists():
-            ProductView.objects.create(product=instance, ip=ip_address)
+        # views are recorded for cached and not modified responses too
+        product_views_buffer.record(int(self.kwargs[self.lookup_url_kwarg or self.lookup_field]), ip_address)
 
-        return Response(serializer.data)
+        return response
 
     @action(methods=['post'], detail=False, url_path='rate-product', url_name='rate_product')
     def rate_product(self, request):
@@ -117,6 +195,12 @@ class ProductModelViewSet(ModelViewSet):
             return Response(product_rating.data, status=status.HTTP_201_CREATED)
         return Response(product_rating.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, url_path='bulk-upsert', url_name='bulk_upsert',
+            parser_classes=[NDJSONParser, CSVParser], name="Synchronise products",
+            description="Create or update seller's products identified by SKU from NDJSON or CSV rows")
+    def bulk_upsert(self, request):
+        return Response(import_products(request.user, request.data), status=status.HTTP_200_OK)
+
     @action(methods=['get'], detail=True, url_path='ratings', url_name='ratings')
     def ratings(self, request, pk=None):
         product = self.get_object()
@@ -132,7 +216,7 @@ class ProductModelViewSet(ModelViewSet):
         )
 
 
-class ProductRatingsModelViewSet(ModelViewSet):
+class ProductRatingsModelViewSet(SparseFieldsetViewMixin, CompiledListMixin, ModelViewSet):
     serializer_class = ProductRatingCreateSerializer
     queryset = ProductRating.objects.select_related('product').all()
     permission_classes = [AuthenticatedClientsOnly]
@@ -170,18 +254,32 @@ class ProductListCreateAPIView(ListCreateAPIView):
     permission_classes = [AuthenticatedSellersOnly]
 
 
-class ProductStatisticsListAPIView(mixins.ListModelMixin, GenericViewSet):
+class ProductStatisticsListAPIView(StreamingExportMixin, CompiledListMixin, mixins.ListModelMixin, GenericViewSet):
     serializer_class = ProductTopLeastSellersSerializer
     queryset = Product.objects.none()
     filterset_class = ProductStatisticsFilter
     permission_classes = [AuthenticatedSellersOnly]
     pagination_class = LimitOffsetPagination
+    export_actions = ('top_sellers', 'least_sellers', 'top_profitable', 'least_profitable')
 
     def get_serializer_class(self):
         if self.action in ['top_profitable', 'least_profitable']:
             return ProductTopLeastProfitableSerializer
         return self.serializer_class
 
+    def get_export_fields(self):
+        # flat rows with the same statistics as graphql `productsStatistic` query
+        fields = ['id', 'name', 'price', 'category', ('stock', 'available_stock'), 'sells_count']
+
+        if self.action in ['top_profitable', 'least_profitable']:
+            fields.append('total_profit')
+
+        return fields + [
+            ('ratings', Product.objects.RATINGS_AVERAGE),
+            ('rates_count', F('rating_count')),
+            ('views', F('views_count')),
+        ]
+
     def get_queryset(self):
         if self.action == 'least_sellers':
             return Product.objects.least_sellers(self.request.user)
@@ -211,8 +309,34 @@ class ProductStatisticsListAPIView(mixins.ListModelMixin, GenericViewSet):
     def least_profitable(self, request):
         return self.list(request)
 
+    @action(methods=['get'], detail=False, url_path='unique-visitors', url_name='unique_visitors',
+            name="Product unique visitors", description="Estimated number of product unique visitors in date range "
+                                                        "(last 30 days by default) and in each day, week or month")
+    def unique_visitors(self, request):
+        query = UniqueVisitorsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
 
-class AddressModelViewSet(ModelViewSet):
+        product = query.validated_data['product']
+
+        if not (request.user.is_superuser or product.seller_id == request.user.id):
+            return Response({"status": "error", "msg": "You can only see statistics of your own products!"},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        period = query.validated_data['period']
+        date_to = query.validated_data.get('date_to', timezone.localdate())
+        date_from = query.validated_data.get('date_from', date_to - timedelta(days=30))
+
+        return Response({
+            "product": product.pk,
+            "period": ProductVisitorsSketch.Period(period).label,
+            "date_from": date_from,
+            "date_to": date_to,
+            "unique_visitors": ProductVisitorsSketch.objects.unique_visitors(product.pk, date_from, date_to),
+            "buckets": ProductVisitorsSketch.objects.unique_visitors_series(product.pk, period, date_from, date_to)
+        }, status=status.HTTP_200_OK)
+
+
+class AddressModelViewSet(CompiledListMixin, ModelViewSet):
     serializer_class = AddressSerializer
     queryset = Address.objects.all()
     permission_classes = [AuthenticatedSellersOnly]
@@ -225,10 +349,11 @@ class AddressModelViewSet(ModelViewSet):
         return [permission() for permission in permission_classes]
 
 
-class OrderModelViewSet(ModelViewSet):
+class OrderModelViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, CompiledListMixin, ModelViewSet):
     serializer_class = OrderCreateSerializer
     queryset = Order.objects.all()
     permission_classes = [AuthenticatedClientsOnly]
+    pagination_class = PageNumberOrCursorPagination
 
     def get_serializer_class(self):
         is_custom_action = self.action not in ['list', 'create', 'retrieve', 'update', 'partial_update', 'destroy']
@@ -252,32 +377,64 @@ class OrderModelViewSet(ModelViewSet):
 
         if user.is_authenticated:
             if user.is_superuser:
-                q = Order.objects.all().select_related('client').prefetch_related('orderproductlistitem_set')
-            elif user.groups.filter(name=settings.USER_SELLER_GROUP_NAME).exists():
-                q = Order.objects.filter(orderproductlistitem__product__seller=user)
+                q = Order.objects.all()
+            elif is_seller(user):
+                q = Order.objects.of_seller(user)
             else:
                 q = Order.objects.filter(client=user)
 
-            return q.select_related('client').prefetch_related('orderproductlistitem_set').order_by("-pk")
+            # order lines are serialized from their own (snapshotted) data only, so products aren't fetched
+            return q.select_related('client', 'order_address').prefetch_related(
+                Order.products_list_prefetch(with_products=False)
+            ).order_by("-pk")
 
         return q
 
+    def get_conditional_validators(self, request):
+        queryset = self.get_queryset().prefetch_related(None)
+
+        # embedded client and address are part of orders representation, their changes update orders `updated_at`
+        # (see `API.signals.touch_client_orders` and `touch_address_orders`)
+        if self.action == 'retrieve':
+            version = queryset.filter(pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field]).values_list(
+                'updated_at', 'client__username', 'client__email'
+            ).first()
+
+            if version is None:
+                return None, None
+
+            return make_etag(request.user.pk, *version), version[0]
+
+        # orders lines embed only product ids and prices snapshotted when the order was placed, so products changes
+        # don't change orders representation. Last-Modified isn't sent, deleted orders don't take part in the newest
+        # update date (the count in ETag changes instead).
+        version = queryset.order_by().aggregate(last_update=Max('updated_at'), count=Count('id'))
+
+        return make_etag(request.user.pk, request.get_full_path(), version['last_update'], version['count']), None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(OrderModelViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(OrderModelViewSet, self).retrieve(request, *args,
+                                                                                                 **kwargs))
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        instance = serializer.save()
-        client_email = instance.client.email
-        payment_deadline = instance.payment_deadline.strftime("%m.%d.%Y, %H:%M:%S")
-
-        send_mail(
-            "Your order has been created",
-            f"Thank you for shopping in our shop. \n"
-            f"Make payment for your order ({instance.final_price} PLN) by {payment_deadline}.",
-            settings.DEFAULT_EMAIL_ADDRESS,
-            [client_email if client_email else "user.email@example.com"],
-            fail_silently=True,
-        )
+        with transaction.atomic():
+            instance = serializer.save()
+            payment_deadline = instance.payment_deadline.strftime("%m.%d.%Y, %H:%M:%S")
+
+            # sent in background by outbox dispatcher, only if the order is saved
+            OutboxEmail.objects.enqueue([(
+                "Your order has been created",
+                f"Thank you for shopping in our shop. \n"
+                f"Make payment for your order ({instance.final_price} PLN) by {payment_deadline}.",
+                instance.client.email,
+                f"order-created:{instance.pk}"
+            )])
 
         headers = self.get_success_headers(serializer.data)
 
@@ -302,6 +459,7 @@ class OrderModelViewSet(ModelViewSet):
         order.status = Order.OrderStatus.PAYMENT_RECEIVED
         order.is_paid = True
         order.save()
+        StockReservation.objects.commit(order)
 
         return Response({"action": "PAYMENT_RECEIVED", "status": "success"}, status=status.HTTP_200_OK)
 
@@ -327,6 +485,7 @@ class OrderModelViewSet(ModelViewSet):
         if order.payment_deadline < timezone.now():
             order.status = Order.OrderStatus.EXPIRED
             order.save()
+            StockReservation.objects.release_order(order)
 
             return Response({"action": "EXPIRED", "status": "success"}, status=status.HTTP_200_OK)
         return Response(
@@ -395,6 +554,7 @@ class OrderModelViewSet(ModelViewSet):
         order = self.get_object()
         order.status = Order.OrderStatus.DECLINED
         order.save()
+        StockReservation.objects.release_order(order)
 
         return Response({"action": "DECLINED", "status": "success"}, status=status.HTTP_200_OK)
 
@@ -403,6 +563,7 @@ class OrderModelViewSet(ModelViewSet):
         order = self.get_object()
         order.status = Order.OrderStatus.CANCELED
         order.save()
+        StockReservation.objects.release_order(order)
 
         return Response({"action": "CANCELED", "status": "success"}, status=status.HTTP_200_OK)
 
@@ -456,7 +617,7 @@ class UserCreateAPIView(CreateAPIView):
         return Response({
             "username": instance.username,
             "email": instance.email,
-            "account_type": "Client" if instance.groups.filter(name=settings.USER_CLIENT_GROUP_NAME).exists() else "Seller"
+            "account_type": "Client" if is_client(instance) else "Seller"
         }, status=status.HTTP_201_CREATED, headers=headers)
 
 
@@ -526,3 +687,22 @@ class DiscountCouponModelViewSet(ModelViewSet):
             {'status': 'Empty data received! Provide at least one coupon code to check'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+def product_image_derivative(request, product_id: int, photo_hash: str, filename: str) -> FileResponse:
+    """
+    Serve product photo derivative, rendering it on the first request. Web server should serve existing derivatives
+    directly from `MEDIA_ROOT` and fall back to this view only for missing ones.
+    """
+    name = derivative_name(filename)
+
+    if name is None:
+        raise Http404("Unknown image derivative")
+
+    product = get_object_or_404(Product.objects.only('id', 'photo', 'photo_hash'), pk=product_id, photo_hash=photo_hash)
+    path = get_or_create_derivative(product, name)
+
+    response = FileResponse(product.photo.storage.open(path, 'rb'), content_type='image/webp')
+    response['Cache-Control'] = f'public, max-age={settings.PRODUCT_IMAGE_DERIVATIVES_MAX_AGE}, immutable'
+
+    return response
@@ -153,10 +153,19 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # DRF
+# browsable api renders html forms with choices of every relation, so it's enabled only on demand (ex. for development)
+BROWSABLE_API = int(os.environ.get('BROWSABLE_API', 0))
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'API.renderers.ORJSONRenderer',
+        'API.renderers.MessagePackRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if BROWSABLE_API else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'API.renderers.ORJSONParser',
+        'API.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -176,6 +185,16 @@ GRAPHENE = {
     ],
 }
 
+# Cache
+# local memory cache is per process, use shared backend (ex. redis or memcached) when running multiple workers, so
+# invalidations reach all of them
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
 # Crispy forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
@@ -193,10 +212,45 @@ COUNTRIES_FLAG_URL = "assets/flags/{code}.gif"
 MPTT_ADMIN_LEVEL_INDENT = 20
 
 # Custom project variables
+# api responses cache (see `API.response_cache`), timeout limits staleness of data updated without invalidation like
+# products views counters
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 DEFAULT_EMAIL_ADDRESS = os.environ.get('DEFAULT_EMAIL_ADDRESS', 'shop.example@platform.com')
+# emails are queued in the outbox and sent in batches over a single connection (see `API.outbox`) every dispatch
+# interval (in seconds) by async task collector or `dispatch_emails` command, failed ones are retried after retry delay
+# doubled with each attempt
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_DISPATCH_INTERVAL = int(os.environ.get('OUTBOX_DISPATCH_INTERVAL', 10))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_DELAY = int(os.environ.get('OUTBOX_RETRY_DELAY', 60))
+# claimed emails not marked as sent or failed within this time (in seconds, ex. after dispatcher crash) are sent again
+OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 300))
 
 THUMBNAIL_SIZE = (200, 300)
+# threads of the background thumbnails pool, 0 creates thumbnails synchronously on save
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', os.cpu_count() or 1))
+# photos of imported products are downloaded by thumbnails workers
+PRODUCT_PHOTO_DOWNLOAD_TIMEOUT = int(os.environ.get('PRODUCT_PHOTO_DOWNLOAD_TIMEOUT', 10))
+PRODUCT_PHOTO_DOWNLOAD_MAX_SIZE = int(os.environ.get('PRODUCT_PHOTO_DOWNLOAD_MAX_SIZE', 10 * 1024 * 1024))
+# comma separated hosts photos may be downloaded from, empty allows every host with public address
+PRODUCT_PHOTO_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.environ.get('PRODUCT_PHOTO_ALLOWED_HOSTS', '').split(',') if host.strip()
+]
+# rows of imported sellers catalogs validated and saved together (see `API.product_import`)
+PRODUCT_IMPORT_BATCH_SIZE = int(os.environ.get('PRODUCT_IMPORT_BATCH_SIZE', 1000))
+# rows fetched at once by streamed CSV / NDJSON exports (see `API.exports`)
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+# WebP derivatives of product photos (name: max width and height), rendered on first request
+PRODUCT_IMAGE_DERIVATIVES = {
+    'small': (100, 150),
+    'medium': (200, 300),
+    'large': (800, 1200),
+}
+PRODUCT_IMAGE_DERIVATIVES_QUALITY = int(os.environ.get('PRODUCT_IMAGE_DERIVATIVES_QUALITY', 80))
+# derivatives names contain photo content hash, so browsers can cache them forever
+PRODUCT_IMAGE_DERIVATIVES_MAX_AGE = 60 * 60 * 24 * 365
 
 PAYMENT_DEADLINE_DAYS = int(os.environ.get('PAYMENT_DEADLINE_DAYS', 5))
 
@@ -241,6 +295,38 @@ DATETIME_INPUT_FORMATS = [
     "%d-%m-%y %H:%M",
 ]
 
+# Serialized categories tree is cached (and invalidated on every category change) for up to timeout seconds
+CATEGORY_TREE_CACHE_TIMEOUT = int(os.environ.get("CATEGORY_TREE_CACHE_TIMEOUT", 60 * 60))
+
+# Product views are buffered in memory and written in batches when buffer size or flush interval (in seconds) is
+# reached. Views from the same ip are counted once per product within deduplication window (in seconds).
+PRODUCT_VIEWS_BUFFER_SIZE = int(os.environ.get("PRODUCT_VIEWS_BUFFER_SIZE", 500))
+PRODUCT_VIEWS_FLUSH_INTERVAL = int(os.environ.get("PRODUCT_VIEWS_FLUSH_INTERVAL", 5))
+PRODUCT_VIEWS_DEDUPE_WINDOW = int(os.environ.get("PRODUCT_VIEWS_DEDUPE_WINDOW", 60 * 60))
+# Raw product views older than retention window (in days) are deleted after being rolled up into daily statistics, a
+# product view from the same ip is counted again after its previous view has been deleted
+PRODUCT_VIEWS_RETENTION_DAYS = int(os.environ.get("PRODUCT_VIEWS_RETENTION_DAYS", 30))
+# Daily unique visitors sketches are deleted after retention window (in days), weekly and monthly ones are kept
+PRODUCT_VISITORS_DAILY_SKETCH_RETENTION_DAYS = int(os.environ.get("PRODUCT_VISITORS_DAILY_SKETCH_RETENTION_DAYS", 90))
+PRODUCT_VIEWS_ROLLUP_CHUNK_SIZE = int(os.environ.get("PRODUCT_VIEWS_ROLLUP_CHUNK_SIZE", 1000))
+
+# Stock of products with `stock_ledger` enabled is changed by inserting stock movements instead of updating product row.
+# Available stock above the safety margin is split between stock shards, reservations take the product row lock only
+# when their shard runs out (and always below the margin), shards are filled again and movements are folded into product
+# stock every compaction interval (in seconds) by `CompactStockLedger` job
+STOCK_LEDGER_SAFETY_MARGIN = int(os.environ.get("STOCK_LEDGER_SAFETY_MARGIN", 100))
+STOCK_LEDGER_SHARDS = int(os.environ.get("STOCK_LEDGER_SHARDS", 8))
+STOCK_LEDGER_COMPACTION_INTERVAL = int(os.environ.get("STOCK_LEDGER_COMPACTION_INTERVAL", 60))
+
+# Text search configuration used by PostgreSQL products full-text search, ex. 'simple', 'english' or 'polish'
+PRODUCT_SEARCH_CONFIG = os.environ.get("PRODUCT_SEARCH_CONFIG", 'simple')
+
+# names of user groups (roles) are cached between requests for this time (in seconds), changes invalidate them. Local
+# memory cache isn't shared by workers, so other workers see changed roles only after the (short by default) timeout
+USER_GROUPS_CACHE_TIMEOUT = int(os.environ.get(
+    "USER_GROUPS_CACHE_TIMEOUT", 30 if CACHES['default']['BACKEND'].endswith('LocMemCache') else 60 * 60
+))
+
 USE_ASYNC_TASK_COLLECTOR = int(os.environ.get("USE_ASYNC_TASK_COLLECTOR", 0))
 TASK_COLLECTOR_REFRESH_RATE = int(os.environ.get("TASK_COLLECTOR_REFRESH_RATE", 60 * 60 * 24))   # every 24 hours
 
@@ -19,11 +19,17 @@ from django.urls import include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from API.thumbnails import DERIVATIVES_DIRECTORY
+from API.views import product_image_derivative
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('API.urls')),
     path('graphql/', include('GraphQL.urls')),
     path('', include('UserInterface.urls')),
+    # before media files, so missing derivatives are rendered instead of returning 404
+    path(f'{settings.MEDIA_URL.strip("/")}/{DERIVATIVES_DIRECTORY}/<int:product_id>/<str:photo_hash>/<str:filename>',
+         product_image_derivative, name='product_image_derivative'),
 ] + static(
     settings.MEDIA_URL,
     document_root=settings.MEDIA_ROOT
@@ -1,9 +1,9 @@
 from django import template
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.template.defaultfilters import floatformat
 
 from API.models import Product
+from API import roles
 
 import random
 from typing import Union
@@ -20,7 +20,7 @@ def is_client(value):
     :param value: user model instance
     :return: Returns True if user is in "Clients" group
     """
-    return value.is_authenticated and value.groups.filter(name=settings.USER_CLIENT_GROUP_NAME).exists()
+    return roles.is_client(value)
 
 
 @register.filter(name="is_seller")
@@ -30,7 +30,7 @@ def is_seller(value):
     :param value: user model instance
     :return: Returns True if user is in "Sellers" group
     """
-    return value.is_authenticated and value.groups.filter(name=settings.USER_SELLER_GROUP_NAME).exists()
+    return roles.is_seller(value)
 
 
 @register.simple_tag(name='random_int')
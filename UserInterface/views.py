@@ -8,6 +8,8 @@ from django.conf import settings
 
 from API.models import ProductCategory
 from API.filters import ProductFilter
+from API.roles import has_group
+from API.roles import is_seller
 from UserInterface.forms import AddressForm
 
 
@@ -19,7 +21,7 @@ class RestrictAccessTemplateView(TemplateView):
         user = self.request.user
 
         if user.is_authenticated:
-            if user.is_superuser or user.groups.filter(name=self.allowed_users_groups).exists():
+            if user.is_superuser or has_group(user, self.allowed_users_groups):
                 return super().get(request, *args, **kwargs)
             return redirect(self.not_allowed_redirect)
 
@@ -92,7 +94,7 @@ class ProductDetailsTemplateView(TemplateView):
         user = self.request.user
 
         if user.is_authenticated:
-            if user.is_superuser or user.groups.filter(name=settings.USER_SELLER_GROUP_NAME).exists():
+            if user.is_superuser or is_seller(user):
                 context['categories'] = ProductCategory.objects.all()
 
         return context